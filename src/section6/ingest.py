@@ -0,0 +1,342 @@
+"""
+動画の文字起こしを`transcriptions`テーブルに取り込むパイプライン。
+文字起こしは1行に1動画のJSONLで受け取り、チャンクへの分割・ベクトル化・書き込みを並行に流します。
+
+```
+uv run python -m src.section6.ingest transcripts/*.jsonl
+cat transcripts.jsonl | uv run python -m src.section6.ingest -
+```
+
+チャンクのIDは動画IDと本文のハッシュなので、同じファイルを何度取り込んでも行は重複しません。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import sys
+import time
+import unicodedata
+import zlib
+from collections.abc import AsyncIterator, Iterable, Iterator
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+from lancedb.table import Table
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section6.transcript_search import (
+    DB_PATH,
+    TABLE_NAME,
+    EmbedBatch,
+    create_fts_index,
+    create_indexes,
+    has_fts_index,
+    openai_embed_batch,
+)
+
+# text-embedding-ada-002の次元数
+EMBEDDING_DIM = 1536
+
+SCHEMA = pa.schema(
+    [
+        pa.field("title", pa.string()),
+        pa.field("published", pa.string()),
+        pa.field("video_id", pa.string()),
+        pa.field("channel_id", pa.string()),
+        pa.field("url", pa.string()),
+        pa.field("id", pa.string()),
+        pa.field("text", pa.string()),
+        pa.field("start", pa.float64()),
+        pa.field("end", pa.float64()),
+        pa.field("vector", pa.list_(pa.float32(), EMBEDDING_DIM)),
+    ]
+)
+
+# IVF-PQの学習に必要な行数。これより少ないうちはインデックスを作らずに全件検索する
+MIN_INDEX_ROWS = 5000
+
+
+class Segment(BaseModel):
+    text: str
+    start: float
+    end: float
+
+
+class TranscriptDocument(BaseModel):
+    video_id: str
+    title: str
+    published: str
+    channel_id: str
+    url: str
+    segments: list[Segment]
+
+
+class IngestStats(BaseModel):
+    documents: int = 0
+    chunks: int = 0
+    # すでにテーブルにあるか、同じ実行の中で重複していたためスキップしたチャンクの数
+    duplicates: int = 0
+    embedding_calls: int = 0
+    rows_written: int = 0
+    write_batches: int = 0
+    compactions: int = 0
+
+    def summary(self, elapsed: float) -> str:
+        return (
+            f"{self.documents} documents, {self.chunks} chunks "
+            f"({self.duplicates} duplicates skipped), {self.rows_written} rows written "
+            f"in {self.write_batches} batches, {self.embedding_calls} embedding calls, "
+            f"{self.compactions} compactions, {self.rows_written / elapsed:.0f} rows/s"
+        )
+
+
+def chunk_id(video_id: str, text: str) -> str:
+    return hashlib.sha256(f"{video_id}\0{text}".encode()).hexdigest()[:32]
+
+
+def chunk_document(
+    document: TranscriptDocument, max_chars: int = 500, overlap: int = 1
+) -> Iterator[dict[str, Any]]:
+    """
+    文字起こしのセグメントを、`max_chars`文字程度のチャンクにまとめます。
+    文脈が途切れないよう、前のチャンクの最後の`overlap`個のセグメントを次のチャンクの先頭にも含めます。
+    """
+    segments = document.segments
+    begin = 0
+    while begin < len(segments):
+        end = begin
+        length = 0
+        while end < len(segments) and (end == begin or length < max_chars):
+            length += len(segments[end].text)
+            end += 1
+        text = "".join(segment.text for segment in segments[begin:end])
+        yield {
+            "title": document.title,
+            "published": document.published,
+            "video_id": document.video_id,
+            "channel_id": document.channel_id,
+            "url": document.url,
+            "id": chunk_id(document.video_id, text),
+            "text": text,
+            "start": segments[begin].start,
+            "end": segments[end - 1].end,
+        }
+        if end == len(segments):
+            break
+        begin = max(end - overlap, begin + 1)
+
+
+async def hash_embed_batch(texts: list[str]) -> list[list[float]]:
+    """
+    APIを使わずに、文字バイグラムのハッシュからベクトルを作る決定的な埋め込み。
+    同じ文字列を多く含む文章ほど近いベクトルになるので、パイプラインや検索の動作確認に使えます。
+    """
+    return await asyncio.to_thread(_hash_embed, texts)
+
+
+def _hash_embed(texts: list[str]) -> list[list[float]]:
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        text = unicodedata.normalize("NFKC", text).lower()
+        for bigram in zip(text, text[1:]):
+            h = zlib.crc32("".join(bigram).encode())
+            vectors[i, h % EMBEDDING_DIM] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).tolist()
+
+
+def open_table(db_path: Path = DB_PATH, table_name: str = TABLE_NAME) -> Table:
+    db = lancedb.connect(db_path)
+    if table_name in db.table_names():
+        return db.open_table(table_name)
+    return db.create_table(table_name, schema=SCHEMA)
+
+
+def existing_ids(table: Table) -> set[str]:
+    ids = table.search().select(["id"]).limit(None).to_arrow()["id"]
+    return set(ids.to_pylist())
+
+
+class IngestPipeline:
+    """
+    チャンク分割 → ベクトル化 → 書き込みの各段階を、サイズに上限のあるキューでつないだパイプライン。
+    書き込みやベクトル化が遅れるとキューが埋まり、前の段階（ファイルの読み込み）が待たされるので、
+    大量の文字起こしを流してもメモリに溜まり続けることはありません。
+
+    - ベクトル化は`embed_batch_size`件ずつまとめ、最大`embed_concurrency`個を同時に実行します
+    - 書き込みは`write_batch_rows`行のArrowのテーブルにまとめてから追記します
+    - `compact_every`回書き込むごとに、小さなファイルの結合とインデックスの更新を行います
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        embed_batch: EmbedBatch = openai_embed_batch,
+        embed_batch_size: int = 256,
+        embed_concurrency: int = 4,
+        write_batch_rows: int = 8192,
+        compact_every: int = 16,
+        max_chars: int = 500,
+    ):
+        self.table = table
+        self.embed_batch = embed_batch
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.write_batch_rows = write_batch_rows
+        self.compact_every = compact_every
+        self.max_chars = max_chars
+        self.stats = IngestStats()
+        self._seen: set[str] = set()
+
+    async def run(
+        self,
+        documents: AsyncIterator[TranscriptDocument] | Iterable[TranscriptDocument],
+    ) -> IngestStats:
+        self._seen = await asyncio.to_thread(existing_ids, self.table)
+        logger.info(f"{len(self._seen)} chunks already in {self.table.name}")
+        chunk_queue: asyncio.Queue[list[dict[str, Any]] | None] = asyncio.Queue(
+            maxsize=self.embed_concurrency * 2
+        )
+        row_queue: asyncio.Queue[list[dict[str, Any]] | None] = asyncio.Queue(
+            maxsize=self.embed_concurrency * 2
+        )
+        async with asyncio.TaskGroup() as group:
+            group.create_task(self._chunk(documents, chunk_queue))
+            for _ in range(self.embed_concurrency):
+                group.create_task(self._embed(chunk_queue, row_queue))
+            group.create_task(self._write(row_queue))
+        return self.stats
+
+    async def _chunk(
+        self,
+        documents: AsyncIterator[TranscriptDocument] | Iterable[TranscriptDocument],
+        output: asyncio.Queue[list[dict[str, Any]] | None],
+    ) -> None:
+        batch: list[dict[str, Any]] = []
+        async for document in _aiter(documents):
+            self.stats.documents += 1
+            for chunk in chunk_document(document, self.max_chars):
+                self.stats.chunks += 1
+                if chunk["id"] in self._seen:
+                    self.stats.duplicates += 1
+                    continue
+                self._seen.add(chunk["id"])
+                batch.append(chunk)
+                if len(batch) >= self.embed_batch_size:
+                    await output.put(batch)
+                    batch = []
+        if batch:
+            await output.put(batch)
+        for _ in range(self.embed_concurrency):
+            await output.put(None)
+
+    async def _embed(
+        self,
+        input: asyncio.Queue[list[dict[str, Any]] | None],
+        output: asyncio.Queue[list[dict[str, Any]] | None],
+    ) -> None:
+        while (batch := await input.get()) is not None:
+            self.stats.embedding_calls += 1
+            vectors = await self.embed_batch([chunk["text"] for chunk in batch])
+            await output.put(
+                [chunk | {"vector": vector} for chunk, vector in zip(batch, vectors)]
+            )
+        await output.put(None)
+
+    async def _write(self, input: asyncio.Queue[list[dict[str, Any]] | None]) -> None:
+        rows: list[dict[str, Any]] = []
+        finished = 0
+        while finished < self.embed_concurrency:
+            batch = await input.get()
+            if batch is None:
+                finished += 1
+                continue
+            rows.extend(batch)
+            if len(rows) >= self.write_batch_rows:
+                await self._flush(rows)
+                rows = []
+        if rows:
+            await self._flush(rows)
+        if self.stats.write_batches % self.compact_every != 0:
+            await asyncio.to_thread(self.compact)
+
+    async def _flush(self, rows: list[dict[str, Any]]) -> None:
+        data = pa.Table.from_pylist(rows, schema=SCHEMA)
+        await asyncio.to_thread(self.table.add, data)
+        self.stats.rows_written += len(rows)
+        self.stats.write_batches += 1
+        logger.debug(f"Appended {len(rows)} rows to {self.table.name}")
+        if self.stats.write_batches % self.compact_every == 0:
+            await asyncio.to_thread(self.compact)
+
+    def compact(self) -> None:
+        """
+        追記で増えた小さなファイルを結合し、追加した行をインデックスに反映します。
+        インデックスがまだなく、行数が十分に増えていればインデックスを作ります。
+        全文検索のインデックスは行数によらず作ります。
+        """
+        start = time.perf_counter()
+        indexed = any(
+            index.index_type == "IvfPq" for index in self.table.list_indices()
+        )
+        if not indexed and self.table.count_rows() >= MIN_INDEX_ROWS:
+            create_indexes(self.table)
+        elif not has_fts_index(self.table):
+            # ハイブリッド検索には全文検索のインデックスが必要なので、行数が少なくても先に作っておく
+            create_fts_index(self.table)
+        self.table.optimize(cleanup_older_than=timedelta(days=1))
+        self.stats.compactions += 1
+        logger.info(
+            f"Compacted {self.table.name} in {time.perf_counter() - start:.1f}s"
+        )
+
+
+async def _aiter(
+    items: AsyncIterator[TranscriptDocument] | Iterable[TranscriptDocument],
+) -> AsyncIterator[TranscriptDocument]:
+    if isinstance(items, AsyncIterator):
+        async for item in items:
+            yield item
+        return
+    # ファイルの読み込みでイベントループを止めないよう、1件ずつスレッドで読む
+    iterator = iter(items)
+    while (item := await asyncio.to_thread(next, iterator, None)) is not None:
+        yield item
+
+
+def read_documents(paths: list[str]) -> Iterator[TranscriptDocument]:
+    for path in paths:
+        with sys.stdin if path == "-" else open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield TranscriptDocument.model_validate_json(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="文字起こしをテーブルに取り込みます。")
+    parser.add_argument("paths", nargs="+", help="JSONLファイル。-の場合は標準入力")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument(
+        "--local-embedder",
+        action="store_true",
+        help="APIを使わずにハッシュから作ったベクトルで取り込みます（動作確認用）",
+    )
+    args = parser.parse_args()
+
+    pipeline = IngestPipeline(
+        open_table(args.db, args.table),
+        embed_batch=hash_embed_batch if args.local_embedder else openai_embed_batch,
+    )
+    start = time.perf_counter()
+    stats = await pipeline.run(read_documents(args.paths))
+    logger.info(stats.summary(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
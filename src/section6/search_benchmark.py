@@ -0,0 +1,137 @@
+"""
+ベクトルインデックスの設定ごとに、検索の再現率（recall@k）とレイテンシを測るベンチマーク。
+テーブルに保存済みのベクトルをクエリに使うので、埋め込みAPIは呼び出しません。
+
+```
+uv run python -m src.section6.search_benchmark --partitions 16 32 64 --sub-vectors 48 96 --nprobes 5 20 50
+```
+
+ベンチマーク中にインデックスを作り直すので、テーブルを一時ディレクトリにコピーして測ります。元のテーブルは変更しません。
+"""
+
+import argparse
+import itertools
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import polars as pl
+from loguru import logger
+
+from src.section6.transcript_search import (
+    DB_PATH,
+    TABLE_NAME,
+    IndexConfig,
+    SearchParams,
+    TranscriptSearch,
+)
+
+
+def sample_queries(
+    search: TranscriptSearch, n: int, seed: int = 0
+) -> list[list[float]]:
+    vectors = search.table.to_arrow()["vector"].to_pylist()
+    return random.Random(seed).sample(vectors, min(n, len(vectors)))
+
+
+def measure(
+    search: TranscriptSearch,
+    queries: list[list[float]],
+    truths: list[set[str]],
+    params: SearchParams,
+    exact: bool = False,
+) -> dict[str, float]:
+    latencies = []
+    recalls = []
+    for vector, truth in zip(queries, truths):
+        start = time.perf_counter()
+        hits = search.search_by_vector(vector, None, params, exact=exact)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({hit.id for hit in hits} & truth) / len(truth))
+    latencies.sort()
+    return {
+        "recall": statistics.mean(recalls),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--partitions", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--sub-vectors", type=int, nargs="+", default=[48, 96])
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--refine-factor", type=int, nargs="+", default=[0, 5])
+    parser.add_argument("--output", type=Path, help="結果を保存するCSVファイル")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        table_dir = f"{args.table}.lance"
+        shutil.copytree(args.db / table_dir, Path(directory) / table_dir)
+        search = TranscriptSearch(Path(directory), args.table)
+        queries = sample_queries(search, args.queries)
+        exact = SearchParams(top_k=args.top_k, mode="vector")
+        truths = [
+            {hit.id for hit in search.search_by_vector(vector, None, exact, exact=True)}
+            for vector in queries
+        ]
+        # インデックスを使わない全件検索を基準として最初の行に入れる
+        rows = [
+            {
+                "num_partitions": None,
+                "num_sub_vectors": None,
+                "nprobes": None,
+                "refine_factor": None,
+            }
+            | measure(search, queries, truths, exact, exact=True)
+        ]
+
+        for num_partitions, num_sub_vectors in itertools.product(
+            args.partitions, args.sub_vectors
+        ):
+            search.create_indexes(
+                IndexConfig(
+                    num_partitions=num_partitions, num_sub_vectors=num_sub_vectors
+                )
+            )
+            for nprobes, refine_factor in itertools.product(
+                args.nprobes, args.refine_factor
+            ):
+                params = SearchParams(
+                    top_k=args.top_k,
+                    mode="vector",
+                    nprobes=nprobes,
+                    refine_factor=refine_factor or None,
+                )
+                result = measure(search, queries, truths, params)
+                logger.info(
+                    f"partitions={num_partitions} sub_vectors={num_sub_vectors} "
+                    f"nprobes={nprobes} refine={refine_factor}: {result}"
+                )
+                rows.append(
+                    {
+                        "num_partitions": num_partitions,
+                        "num_sub_vectors": num_sub_vectors,
+                        "nprobes": nprobes,
+                        "refine_factor": refine_factor,
+                    }
+                    | result
+                )
+
+    df = pl.DataFrame(rows)
+    with pl.Config(tbl_rows=-1):
+        print(f"recall@{args.top_k} and latency ({len(queries)} queries)")
+        print(df)
+    if args.output is not None:
+        df.write_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
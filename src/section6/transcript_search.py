@@ -0,0 +1,417 @@
+"""
+`data/db`のLanceDBに保存した動画の文字起こし（`transcriptions`テーブル）を検索するための検索エンジン。
+エージェントからは`search_transcriptions`ツールとして使います。
+リポジトリのルートで`uv run python -m src.section6.transcript_search "質問"`のように実行すると、
+検索ツールを持ったエージェント（Agentic RAG）に質問できます。`--stream`を付けると回答を逐次表示します。
+"""
+
+import asyncio
+import functools
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Literal
+
+import lancedb
+from agents import Agent, function_tool
+from lancedb.rerankers import RRFReranker
+from lancedb.table import Table
+from loguru import logger
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from src.section7.stream_renderer import run_and_render
+from src.section7.tool_cache import make_key, normalize_text
+
+DB_PATH = Path(__file__).resolve().parents[2] / "data" / "db"
+TABLE_NAME = "transcriptions"
+
+# テーブルを作成したときと同じ埋め込みモデルを使う必要がある
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# 埋め込みAPIにまとめて送るクエリの数と、まとめるために待つ時間（秒）
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_BATCH_WAIT = 0.01
+
+# 他のプロセスが追加したデータを検索結果に反映するまでの間隔
+READ_CONSISTENCY_INTERVAL = timedelta(seconds=5)
+
+SearchMode = Literal["vector", "fts", "hybrid"]
+EmbedBatch = Callable[[list[str]], Awaitable[list[list[float]]]]
+
+
+class IndexConfig(BaseModel):
+    """
+    ベクトルインデックス（IVF-PQ）の設定。Noneの場合はLanceDBがデータ件数から決めます。
+    """
+
+    # IVFのクラスタ数。多いほど検索は速くなるが、同じnprobesでの再現率は下がる
+    num_partitions: int | None = None
+    # PQで1つのベクトルを分割する数。ベクトルの次元数（1536）の約数にする。多いほど正確だが遅い
+    num_sub_vectors: int | None = None
+    metric: Literal["l2", "cosine", "dot"] = "cosine"
+
+
+class SearchParams(BaseModel):
+    top_k: int = 5
+    mode: SearchMode = "hybrid"
+    # 検索するIVFのクラスタ数。多いほど再現率が上がるが遅くなる
+    nprobes: int = 20
+    # top_k * refine_factor件をPQで選んだあと、元のベクトルで並べ直す。Noneの場合は並べ直さない
+    refine_factor: int | None = None
+    # ベクトルインデックスを作ったときのmetricと同じにする
+    metric: Literal["l2", "cosine", "dot"] = "cosine"
+
+
+class TranscriptFilter(BaseModel):
+    """
+    検索するチャンクをメタデータで絞り込む条件。publishedはISO 8601形式の文字列として比較します。
+    """
+
+    channel_id: str | None = None
+    video_id: str | None = None
+    published_after: str | None = None
+    published_before: str | None = None
+
+    def to_where(self) -> str | None:
+        def quote(value: str) -> str:
+            return "'" + value.replace("'", "''") + "'"
+
+        conditions = []
+        if self.channel_id is not None:
+            conditions.append(f"channel_id = {quote(self.channel_id)}")
+        if self.video_id is not None:
+            conditions.append(f"video_id = {quote(self.video_id)}")
+        if self.published_after is not None:
+            conditions.append(f"published >= {quote(self.published_after)}")
+        if self.published_before is not None:
+            conditions.append(f"published < {quote(self.published_before)}")
+        return " AND ".join(conditions) or None
+
+
+class TranscriptHit(BaseModel):
+    id: str
+    title: str
+    url: str
+    video_id: str
+    channel_id: str
+    published: str
+    text: str
+    start: float
+    end: float
+    score: float
+
+    def format(self) -> str:
+        separator = "&" if "?" in self.url else "?"
+        return (
+            f"## {self.title} ({self.published})\n"
+            f"{self.url}{separator}t={int(self.start)}s\n"
+            f"{self.text}"
+        )
+
+
+async def openai_embed_batch(texts: list[str]) -> list[list[float]]:
+    response = await AsyncOpenAI().embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in response.data]
+
+
+class QueryEmbedder:
+    """
+    クエリをベクトルにするクラス。
+    同時に届いたクエリは`EMBEDDING_BATCH_WAIT`秒だけ待ってから1回のAPI呼び出しにまとめ、
+    一度ベクトルにしたクエリは`cache_size`件まで再利用します。
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatch = openai_embed_batch,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batch_wait: float = EMBEDDING_BATCH_WAIT,
+        cache_size: int = 1024,
+    ):
+        self.embed_batch = embed_batch
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.cache_size = cache_size
+        self.api_calls = 0
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future[list[float]]] = {}
+        self._flush_task: asyncio.Task[None] | None = None
+
+    async def embed(self, text: str) -> list[float]:
+        text = normalize_text(text)
+        vector = self._cache.get(text)
+        if vector is not None:
+            self._cache.move_to_end(text)
+            return vector
+        future = self._pending.get(text)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[text] = future
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_wait)
+        self._flush_task = None
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.create_task(self._embed(batch))
+
+    async def _embed(self, batch: dict[str, asyncio.Future[list[float]]]) -> None:
+        texts = list(batch)
+        try:
+            self.api_calls += 1
+            vectors = await self.embed_batch(texts)
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for text, vector in zip(texts, vectors):
+            self._cache[text] = vector
+            batch[text].set_result(vector)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+def create_indexes(table: Table, config: IndexConfig | None = None) -> None:
+    """
+    ベクトルインデックスと全文検索のインデックスを作り直します。
+    """
+    config = config or IndexConfig()
+    start = time.perf_counter()
+    table.create_index(
+        metric=config.metric,
+        num_partitions=config.num_partitions,
+        num_sub_vectors=config.num_sub_vectors,
+        vector_column_name="vector",
+        index_type="IVF_PQ",
+        replace=True,
+    )
+    create_fts_index(table)
+    logger.info(
+        f"Created indexes on {table.name} ({config}) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def create_fts_index(table: Table) -> None:
+    """
+    全文検索のインデックスを作り直します。
+    IVF-PQと違って学習が要らないので、行数が少ないテーブルにも作れます。
+    """
+    table.create_fts_index(
+        "text", use_tantivy=False, max_token_length=None, replace=True
+    )
+
+
+def has_fts_index(table: Table) -> bool:
+    # LanceDBのバージョンによって、全文検索のインデックスの種類の名前が異なる
+    return any(
+        index.index_type in ("FTS", "INVERTED") for index in table.list_indices()
+    )
+
+
+class TranscriptSearch:
+    """
+    文字起こしテーブルに対する検索エンジン。
+
+    - ベクトル検索・全文検索・その2つをRRFで統合したハイブリッド検索
+    - メタデータ（チャンネル・動画・公開日）による絞り込み
+    - 同じ条件の検索結果の再利用（テーブルが更新されると使わなくなります）
+
+    全文検索のインデックスはLanceDB組み込みの`simple`トークナイザを使います。
+    日本語の文は単語に分割されないため、全文検索が効くのは主に英数字のキーワード（製品名やAPI名など）で、
+    ベクトル検索が苦手な固有名詞の一致を補う役割になります。
+    """
+
+    def __init__(
+        self,
+        db_path: Path = DB_PATH,
+        table_name: str = TABLE_NAME,
+        embedder: QueryEmbedder | None = None,
+        cache_size: int = 256,
+    ):
+        self.db = lancedb.connect(
+            db_path, read_consistency_interval=READ_CONSISTENCY_INTERVAL
+        )
+        self.table: Table = self.db.open_table(table_name)
+        self.embedder = embedder or QueryEmbedder()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self._cache: OrderedDict[str, list[TranscriptHit]] = OrderedDict()
+        # 全文検索のインデックスの有無を確認したテーブルのバージョン
+        self._fts_checked: tuple[int, bool] | None = None
+
+    def create_indexes(self, config: IndexConfig | None = None) -> None:
+        create_indexes(self.table, config)
+
+    def has_fts_index(self) -> bool:
+        """
+        全文検索のインデックスがあるかを返します。
+        ない場合は全文検索・ハイブリッド検索ができないので、警告を出してベクトル検索で代用します。
+        """
+        version = self.table.version
+        if self._fts_checked is None or self._fts_checked[0] != version:
+            exists = has_fts_index(self.table)
+            if not exists:
+                logger.warning(
+                    f"{self.table.name} has no full-text index; falling back to vector search. "
+                    "Run create_indexes() or ingest to build it."
+                )
+            self._fts_checked = (version, exists)
+        return self._fts_checked[1]
+
+    async def search(
+        self,
+        query: str,
+        params: SearchParams | None = None,
+        filter: TranscriptFilter | None = None,
+    ) -> list[TranscriptHit]:
+        params = params or SearchParams()
+        filter = filter or TranscriptFilter()
+        if params.mode != "vector" and not self.has_fts_index():
+            params = params.model_copy(update={"mode": "vector"})
+        key = make_key(
+            normalize_text(query),
+            params.model_dump(),
+            filter.model_dump(),
+            self.table.version,
+        )
+        hits = self._cache.get(key)
+        if hits is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return hits
+
+        vector = await self.embedder.embed(query) if params.mode != "fts" else None
+        hits = await asyncio.to_thread(
+            self.search_by_vector, vector, query, params, filter
+        )
+        self._cache[key] = hits
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return hits
+
+    def search_by_vector(
+        self,
+        vector: list[float] | None,
+        text: str | None,
+        params: SearchParams | None = None,
+        filter: TranscriptFilter | None = None,
+        exact: bool = False,
+    ) -> list[TranscriptHit]:
+        """
+        埋め込み済みのベクトルで検索します（同期）。`exact=True`の場合はインデックスを使わずに全件と比較します。
+        """
+        params = params or SearchParams()
+        filter = filter or TranscriptFilter()
+        query: Any
+        match params.mode:
+            case "vector":
+                query = self.table.search(vector, vector_column_name="vector")
+            case "fts":
+                query = self.table.search(text, query_type="fts")
+            case "hybrid":
+                query = (
+                    self.table.search(query_type="hybrid", vector_column_name="vector")
+                    .vector(vector)
+                    .text(text)
+                    .rerank(RRFReranker())
+                )
+        if params.mode != "fts":
+            query = query.distance_type(params.metric).nprobes(params.nprobes)
+            if params.refine_factor is not None:
+                query = query.refine_factor(params.refine_factor)
+            if exact:
+                query = query.bypass_vector_index()
+        where = filter.to_where()
+        if where is not None:
+            query = query.where(where, prefilter=True)
+        rows = query.limit(params.top_k).to_list()
+        return [
+            TranscriptHit(
+                **{
+                    name: row[name]
+                    for name in TranscriptHit.model_fields
+                    if name != "score"
+                },
+                score=row.get(
+                    "_relevance_score", row.get("_score", -row.get("_distance", 0.0))
+                ),
+            )
+            for row in rows
+        ]
+
+
+@functools.cache
+def get_transcript_search() -> TranscriptSearch:
+    return TranscriptSearch()
+
+
+@function_tool
+async def search_transcriptions(
+    query: str,
+    top_k: int = 5,
+    channel_id: str | None = None,
+    published_after: str | None = None,
+) -> str:
+    """
+    動画の文字起こしから、質問に関連する部分を検索します。
+
+    Args:
+        query: 検索したい内容。自然文でもキーワードでも構いません
+        top_k: 取得する件数
+        channel_id: 特定のチャンネルの動画だけを検索する場合に指定します
+        published_after: この日付（YYYY-MM-DD）以降に公開された動画だけを検索する場合に指定します
+    """
+    hits = await get_transcript_search().search(
+        query,
+        SearchParams(top_k=min(top_k, 20)),
+        TranscriptFilter(channel_id=channel_id, published_after=published_after),
+    )
+    if not hits:
+        return "No results found."
+    return "\n\n".join(hit.format() for hit in hits)
+
+
+rag_agent = Agent(
+    name="Transcript RAG Agent",
+    instructions="""\
+あなたは動画の内容に詳しいアシスタントです。
+ユーザーの質問に答えるために、search_transcriptionsツールで動画の文字起こしを検索してください。
+1回の検索で十分な情報が見つからない場合は、言い換えやキーワードを変えて何度か検索してください。
+回答には根拠にした動画のURLを含めてください。
+""",
+    model="gpt-4.1",
+    tools=[search_transcriptions],
+)
+
+
+async def main():
+    questions = [arg for arg in sys.argv[1:] if arg != "--stream"]
+    user_input = (
+        questions[0]
+        if questions
+        else "エージェントの評価はどうやって行えばいいですか？"
+    )
+    await run_and_render(rag_agent, input=user_input)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
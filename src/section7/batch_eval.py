@@ -0,0 +1,309 @@
+"""
+問題セットに対してコーディングエージェントをまとめて評価するバッチランナー。
+リポジトリのルートで`uv run python -m src.section7.batch_eval problems.jsonl results.jsonl`のように実行します。
+
+問題セットは1行に1問のJSONLで、次の形式です。
+{"id": "abc001_a", "statement": "問題文", "tests": [{"input": "3 2\\n", "output": "1\\n"}]}
+
+結果は1問ごとに結果ファイルへ追記されるので、途中で落ちても同じコマンドを再実行すれば未評価の問題から再開します。
+"""
+
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+from agents import ModelProvider, RunConfig, RunContextWrapper, RunHooks, Runner, Usage
+from dotenv import load_dotenv
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.coding_agent import build_agent
+from src.section7.human_channel import StaticHumanChannel, set_human_channel
+from src.section7.judge import TestCase, judge
+from src.section7.package_cache import PackageCache, set_package_cache
+from src.section7.rate_limiter import ScheduledModelProvider, get_request_scheduler
+from src.section7.sandbox import SandboxContext
+from src.section7.sandbox_pool import SandboxPool
+
+# エージェントが解答を書き込むファイル
+SOLUTION_FILE = "main.py"
+
+# バッチ評価では人間が回答できないので、ask_userにはこの回答を返す
+AUTO_ANSWER = (
+    "ユーザーは不在です。確認は不要なので、自分の判断で作業を最後まで進めてください。"
+)
+
+PROMPT_TEMPLATE = """\
+次の競技プログラミングの問題を正解するためのPythonコードを作成してください。
+解答は`{solution_file}`に書き、標準入力から読み込んで標準出力に出力してください。
+
+{statement}"""
+
+
+class Problem(BaseModel):
+    id: str
+    statement: str
+    tests: list[TestCase]
+
+
+class EvalResult(BaseModel):
+    problem_id: str
+    passed: bool
+    tests_passed: int
+    tests_total: int
+    turns: int
+    input_tokens: int
+    output_tokens: int
+    total_tokens: int
+    wall_time: float
+    # パッケージのインストールにかかった時間と、共有キャッシュから入ったパッケージの数
+    install_time: float = 0.0
+    packages_installed: int = 0
+    package_cache_hits: int = 0
+    error: str | None = None
+
+
+def load_problems(path: Path) -> list[Problem]:
+    with path.open() as f:
+        return [Problem.model_validate_json(line) for line in f if line.strip()]
+
+
+def load_results(path: Path) -> dict[str, EvalResult]:
+    """
+    評価済みの結果を読み込みます。書き込み途中で落ちた最終行は読み飛ばします。
+    """
+    if not path.exists():
+        return {}
+    results: dict[str, EvalResult] = {}
+    with path.open() as f:
+        for line in f:
+            try:
+                result = EvalResult.model_validate_json(line)
+            except ValueError:
+                logger.warning(f"Skipping broken result line: {line[:80]!r}")
+                continue
+            results[result.problem_id] = result
+    return results
+
+
+def truncate_partial_line(path: Path) -> None:
+    """
+    書き込み途中で落ちた最終行を削除します。
+    残したまま追記すると、次の結果がその行につながって両方とも読めなくなるためです。
+    """
+    if not path.exists():
+        return
+    with path.open("rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning(f"Removing a partial line at the end of {path}")
+            f.truncate(end)
+
+
+async def run_hidden_tests(
+    context: SandboxContext, tests: list[TestCase], timeout: float
+) -> int:
+    """
+    エージェントが作成した解答を隠しテストで実行し、正解したテストの数を返します。
+    テストケースは並列に実行し、空白と改行の違いは無視して比較します。
+    """
+    if not context.resolve(SOLUTION_FILE).is_file():
+        return 0
+    report = await judge(context, SOLUTION_FILE, tests, time_limit=timeout)
+    return report.passed
+
+
+class UsageHooks(RunHooks[Any]):
+    """
+    実行中のコンテキストの使用量を保持するフック。
+    使用量はモデルの応答のたびにコンテキストに加算されるので、ターン数超過などの例外で実行が止まっても、そこまでの使用量がわかります。
+    """
+
+    def __init__(self):
+        self.usage: Usage | None = None
+
+    async def on_agent_start(self, context: RunContextWrapper[Any], agent: Any) -> None:
+        self.usage = context.usage
+
+
+async def evaluate(
+    problem: Problem,
+    pool: SandboxPool,
+    max_turns: int,
+    test_timeout: float,
+    provider: ModelProvider,
+) -> EvalResult:
+    """
+    1つの問題についてエージェントを実行し、隠しテストで採点します。
+    """
+    agent = build_agent()
+    start = time.perf_counter()
+    async with pool.sandbox() as context:
+        hooks = UsageHooks()
+        error = None
+        try:
+            await Runner.run(
+                agent,
+                input=PROMPT_TEMPLATE.format(
+                    solution_file=SOLUTION_FILE, statement=problem.statement
+                ),
+                context=context,
+                max_turns=max_turns,
+                run_config=RunConfig(model_provider=provider),
+                hooks=hooks,
+            )
+        except Exception as e:
+            # ターン数超過などで止まっても、そこまでに書かれた解答は採点する
+            logger.error(f"[{problem.id}] Agent run failed: {e!r}")
+            error = repr(e)
+        tests_passed = await run_hidden_tests(context, problem.tests, test_timeout)
+    # 失敗した実行も、止まるまでに使ったターン数とトークン数を記録する
+    usage = hooks.usage or Usage()
+    return EvalResult(
+        problem_id=problem.id,
+        passed=tests_passed == len(problem.tests),
+        tests_passed=tests_passed,
+        tests_total=len(problem.tests),
+        turns=usage.requests,
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        total_tokens=usage.total_tokens,
+        wall_time=time.perf_counter() - start,
+        install_time=context.installs.duration,
+        packages_installed=context.installs.installed,
+        package_cache_hits=context.installs.cache_hits,
+        error=error,
+    )
+
+
+async def run_batch(
+    problems_path: Path,
+    results_path: Path,
+    concurrency: int = 4,
+    max_turns: int = 50,
+    test_timeout: float = 10.0,
+    pool_root: Path = Path("agent_sandbox_pool"),
+    package_cache: PackageCache | None = None,
+) -> pl.DataFrame:
+    """
+    問題セットをまとめて評価し、結果の表を返します。
+
+    Args:
+        problems_path (Path): 問題セットのJSONL
+        results_path (Path): 結果を追記するJSONL。評価済みの問題はスキップします。
+        concurrency (int): 同時に実行するセッション数
+        max_turns (int): 1問あたりのエージェントの最大ターン数
+        test_timeout (float): 隠しテスト1件あたりの実行時間の上限（秒）
+        pool_root (Path): サンドボックスプールを配置するディレクトリ
+        package_cache (PackageCache | None): すべてのサンドボックスで共有するパッケージのキャッシュ
+    """
+    set_human_channel(StaticHumanChannel(AUTO_ANSWER))
+    if package_cache is not None:
+        set_package_cache(package_cache)
+    problems = load_problems(problems_path)
+    done = load_results(results_path)
+    todo = [problem for problem in problems if problem.id not in done]
+    logger.info(f"{len(done)} problems already evaluated, {len(todo)} remaining")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # モデルの呼び出しはプロセス全体のスケジューラを通し、対話的なセッションの呼び出しを先に通す
+    provider = ScheduledModelProvider("batch")
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    truncate_partial_line(results_path)
+    async with SandboxPool(pool_root, size=concurrency) as pool:
+        with results_path.open("a") as out:
+
+            async def worker(problem: Problem) -> None:
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        result = await evaluate(
+                            problem, pool, max_turns, test_timeout, provider
+                        )
+                    except Exception as e:
+                        # 採点やサンドボックスの失敗で、他の問題の評価まで止めないようにする
+                        logger.exception(f"[{problem.id}] Evaluation failed: {e!r}")
+                        result = EvalResult(
+                            problem_id=problem.id,
+                            passed=False,
+                            tests_passed=0,
+                            tests_total=len(problem.tests),
+                            turns=0,
+                            input_tokens=0,
+                            output_tokens=0,
+                            total_tokens=0,
+                            wall_time=time.perf_counter() - start,
+                            error=repr(e),
+                        )
+                # 1問ごとに書き出しておけば、落ちても再実行で続きから再開できる
+                out.write(result.model_dump_json() + "\n")
+                out.flush()
+                done[problem.id] = result
+                logger.info(
+                    f"[{problem.id}] {'PASS' if result.passed else 'FAIL'} "
+                    f"({result.tests_passed}/{result.tests_total}) "
+                    f"in {result.wall_time:.1f}s, {len(done)}/{len(problems)} done"
+                )
+
+            await asyncio.gather(*(worker(problem) for problem in todo))
+
+    logger.info(f"Model calls:\n{get_request_scheduler().summary()}")
+    table = pl.DataFrame([result.model_dump() for result in done.values()])
+    table.write_csv(results_path.with_suffix(".csv"))
+    return table
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("problems", type=Path)
+    parser.add_argument("results", type=Path)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-turns", type=int, default=50)
+    parser.add_argument("--test-timeout", type=float, default=10.0)
+    parser.add_argument(
+        "--package-cache",
+        type=Path,
+        default=Path(".cache/packages"),
+        help="サンドボックスで共有するパッケージのキャッシュ",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="ネットワークを使わず、パッケージのキャッシュだけからインストールします",
+    )
+    args = parser.parse_args()
+
+    table = await run_batch(
+        args.problems,
+        args.results,
+        concurrency=args.concurrency,
+        max_turns=args.max_turns,
+        test_timeout=args.test_timeout,
+        package_cache=PackageCache(args.package_cache, offline=args.offline),
+    )
+    if table.is_empty():
+        print("No problems were evaluated.")
+        return
+    with pl.Config(tbl_rows=-1):
+        print(table.drop("error"))
+    print(
+        f"pass rate: {table['passed'].mean():.1%}, "
+        f"mean turns: {table['turns'].mean():.1f}, "
+        f"total tokens: {table['total_tokens'].sum()}, "
+        f"mean wall time: {table['wall_time'].mean():.1f}s"
+    )
+    installed = table["packages_installed"].sum()
+    if installed:
+        print(
+            f"install time: {table['install_time'].sum():.1f}s, "
+            f"package cache hit ratio: {table['package_cache_hits'].sum() / installed:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
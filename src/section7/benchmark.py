@@ -0,0 +1,218 @@
+"""
+`ScriptedModel`を使ってエージェントのループそのもののオーバーヘッドを計測するベンチマーク。
+OpenAI APIは呼ばないので、APIキーがなくても実行できます。
+リポジトリのルートで`uv run python -m src.section7.benchmark`のように実行します。
+
+結果は`--output`のJSONLに追記され、前回の結果との差分が表示されます。
+"""
+
+import argparse
+import asyncio
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from importlib.metadata import version
+from pathlib import Path
+
+from agents import Agent, RunConfig, Runner, function_tool
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.coding_agent import build_agent
+from src.section7.offline_model import (
+    ScriptedModel,
+    ScriptedModelProvider,
+    ScriptedToolCall,
+    ScriptStep,
+)
+from src.section7.sandbox import SandboxContext
+
+# 各シナリオのエージェントの最大ターン数
+MAX_TURNS = 100
+
+
+class BenchmarkRecord(BaseModel):
+    timestamp: str
+    python: str
+    agents: str
+    metrics: dict[str, float]
+
+
+def tool_loop_script(turns: int, name: str = "echo") -> list[ScriptStep]:
+    """
+    `turns - 1`回ツールを呼んだ後に最終出力を返す応答の列を作ります。
+    """
+    steps = [
+        ScriptStep(tool_calls=[ScriptedToolCall(name=name, arguments={"text": str(i)})])
+        for i in range(turns - 1)
+    ]
+    return steps + [ScriptStep(message="done")]
+
+
+def coding_agent_script(turns: int) -> list[ScriptStep]:
+    """
+    コーディングエージェントのファイル操作ツールを順番に呼ぶ応答の列を作ります。
+    """
+    cycle = [
+        lambda i: ScriptedToolCall(
+            name="write_file",
+            arguments={"path": f"pkg/f{i % 8}.py", "content": f"x = {i}\n" * 50},
+        ),
+        lambda i: ScriptedToolCall(
+            name="read_file",
+            arguments={"path": f"pkg/f{i % 8}.py", "start_line": 0, "end_line": 20},
+        ),
+        lambda i: ScriptedToolCall(
+            name="grep_file", arguments={"path": f"pkg/f{i % 8}.py", "pattern": "x ="}
+        ),
+        lambda i: ScriptedToolCall(
+            name="list_dir", arguments={"path": ".", "depth": 2}
+        ),
+    ]
+    steps = [
+        ScriptStep(tool_calls=[cycle[i % len(cycle)](i)]) for i in range(turns - 1)
+    ]
+    return steps + [ScriptStep(message="done")]
+
+
+def echo_agent(invocations: list[float]) -> Agent:
+    @function_tool
+    def echo(text: str) -> str:
+        """
+        受け取った文字列をそのまま返すツール。
+        Args:
+            text (str): 返す文字列
+        """
+        invocations.append(time.perf_counter())
+        return text
+
+    return Agent(name="Echo Agent", instructions="echo", model="scripted", tools=[echo])
+
+
+def run_config(model: ScriptedModel) -> RunConfig:
+    return RunConfig(model_provider=ScriptedModelProvider(model), tracing_disabled=True)
+
+
+async def bench_turn_overhead(turns: int = MAX_TURNS) -> dict[str, float]:
+    """
+    モデルの待ち時間がない状態で、1ターンあたりにかかる時間と、
+    モデルが応答してからツールが呼ばれるまでの時間を計測します。
+    """
+    invocations: list[float] = []
+    model = ScriptedModel(tool_loop_script(turns))
+    start = time.perf_counter()
+    await Runner.run(
+        echo_agent(invocations), "start", max_turns=turns, run_config=run_config(model)
+    )
+    elapsed = time.perf_counter() - start
+    dispatch = [
+        invoked - responded
+        for invoked, responded in zip(invocations, model.response_times)
+    ]
+    return {
+        "turn_overhead_ms": elapsed / turns * 1000,
+        "tool_dispatch_p50_ms": statistics.median(dispatch) * 1000,
+        "tool_dispatch_max_ms": max(dispatch) * 1000,
+    }
+
+
+async def bench_memory_growth(turns: int = MAX_TURNS) -> dict[str, float]:
+    """
+    コーディングエージェントのツールを使って`turns`ターン実行したときのメモリの増加量を計測します。
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        context = SandboxContext(sandbox=Path(directory).resolve())
+        context.resolve("pkg").mkdir()
+        model = ScriptedModel(coding_agent_script(turns))
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        await Runner.run(
+            build_agent(),
+            "start",
+            context=context,
+            max_turns=turns,
+            run_config=run_config(model),
+        )
+        elapsed = time.perf_counter() - start
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "coding_agent_turn_ms": elapsed / turns * 1000,
+        "memory_growth_kb": (after - before) / 1024,
+        "memory_growth_per_turn_kb": (after - before) / 1024 / turns,
+        "memory_peak_kb": (peak - before) / 1024,
+    }
+
+
+async def bench_throughput(
+    sessions: int = 32, turns: int = 20, latency: float = 0.01
+) -> dict[str, float]:
+    """
+    `latency`秒で応答するモデルを使って、複数のセッションを同時に実行したときのスループットを計測します。
+    """
+    models = [
+        ScriptedModel(tool_loop_script(turns), latency=latency) for _ in range(sessions)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            Runner.run(
+                echo_agent([]), "start", max_turns=turns, run_config=run_config(model)
+            )
+            for model in models
+        )
+    )
+    elapsed = time.perf_counter() - start
+    # モデルの待ち時間だけで決まる理想的な実行時間との比。1に近いほどフレームワーク側の待ちが少ない
+    return {
+        "throughput_turns_per_s": sessions * turns / elapsed,
+        "throughput_efficiency": turns * latency / elapsed,
+    }
+
+
+def load_records(path: Path) -> list[BenchmarkRecord]:
+    if not path.exists():
+        return []
+    with path.open() as f:
+        return [BenchmarkRecord.model_validate_json(line) for line in f if line.strip()]
+
+
+def compare(current: BenchmarkRecord, previous: BenchmarkRecord | None) -> str:
+    lines = []
+    for name, value in current.metrics.items():
+        line = f"{name:>28}: {value:10.3f}"
+        if previous is not None and previous.metrics.get(name):
+            change = value / previous.metrics[name] - 1
+            line += f"  ({change:+.1%} vs {previous.timestamp})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.jsonl"))
+    args = parser.parse_args()
+
+    logger.remove()
+    metrics: dict[str, float] = {}
+    for bench in (bench_turn_overhead, bench_memory_growth, bench_throughput):
+        metrics |= await bench()
+
+    record = BenchmarkRecord(
+        timestamp=datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        agents=version("openai-agents"),
+        metrics=metrics,
+    )
+    previous = load_records(args.output)
+    print(compare(record, previous[-1] if previous else None))
+    with args.output.open("a") as f:
+        f.write(record.model_dump_json() + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
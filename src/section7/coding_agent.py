@@ -1,128 +1,195 @@
-import os
-import shutil
-import subprocess
-import types
+"""
+コーディングエージェント。
+リポジトリのルートで`uv run python -m src.section7.coding_agent`のように実行します。
+"""
+
+import asyncio
+import functools
+import re
+from datetime import datetime
 from pathlib import Path
-from typing import Self
 
 from agents import (
     Agent,
     ModelSettings,
+    RunConfig,
     RunContextWrapper,
-    Runner,
     WebSearchTool,
     function_tool,
 )
 from dotenv import load_dotenv
 from loguru import logger
-from pydantic import BaseModel
-
-
-class SandboxContext(BaseModel):
-    sandbox: Path
-    _old_cwd: Path | None = None
-
-    def __enter__(self):
-        """
-        ファイル操作のためのサンドボックス環境を作成するコンテキストマネージャー。
-        """
-        # Create the sandbox directory if it doesn't exist
-        self.sandbox.mkdir(parents=True, exist_ok=True)
-        self._old_cwd = Path.cwd()  # Store the current working directory
-        os.chdir(self.sandbox)  # Change the current working directory to the sandbox
-        return self
-
-    def __exit__(
-        self,
-        exc_type: type[BaseException] | None,
-        exc_val: BaseException | None,
-        exc_tb: types.TracebackType | None,
-    ) -> None:
-        """
-        コンテキストマネージャーを終了し、元の作業ディレクトリを復元します。
-
-        Args:
-            exc_type: 例外が発生した場合はその例外の型、そうでなければNone。
-            exc_val: 例外が発生した場合はその例外のインスタンス、そうでなければNone。
-            exc_tb: 例外が発生した場合はそのトレースバック、そうでなければNone。
-        """
-        assert self._old_cwd is not None, "Old cwd should not be None"
-        os.chdir(self._old_cwd)
-
-    @classmethod
-    def initialize(cls, sandbox: Path, force: bool = False) -> Self:
-        """
-        サンドボックスディレクトリを初期化します。
-
-        Args:
-            sandbox (Path): サンドボックスディレクトリへのパス。
-            force (bool): Trueの場合、新しいディレクトリを作成する前に既存のサンドボックスディレクトリを削除します。
-        """
-        if sandbox.exists():
-            logger.info(f"Sandbox already exists at {sandbox}")
-            if not force:
-                raise RuntimeError(
-                    f"Sandbox already exists at {sandbox}. Use force=True to remove it."
-                )
-            else:
-                logger.info(f"Removing existing sandbox at {sandbox}")
-                shutil.rmtree(sandbox)
-        sandbox.mkdir(parents=True, exist_ok=True)
-        cwd = Path.cwd()
-        os.chdir(sandbox)
-        ret = subprocess.run(
-            ["uv", "init", "--no-workspace"],
-        )
-        os.chdir(cwd)
 
-        if ret.returncode != 0:
-            logger.error(f"Failed to initialize sandbox: {ret.stderr}")
-            raise RuntimeError(f"Failed to initialize sandbox: {ret.stderr}")
-        logger.info(f"Sandbox initialized at {sandbox}")
-        return cls(sandbox=sandbox.resolve())
+from src.section7.command_runner import run_command
+from src.section7.dir_tree import format_listing
+from src.section7.file_index import line_index_cache
+from src.section7.human_channel import get_human_channel
+from src.section7.judge import CompareMode, TestCase, judge
+from src.section7.package_cache import PackageCache, set_package_cache
+from src.section7.patch import (
+    TextLines,
+    apply_hunks,
+    atomic_write,
+    diff_summary,
+    parse_unified_diff,
+    replace_range,
+)
+from src.section7.rate_limiter import ScheduledModelProvider
+from src.section7.sandbox import SandboxContext
+from src.section7.stream_renderer import run_and_render
+from src.section7.tool_cache import ResponseCache, cached_agent_tool
+from src.section7.tool_scheduler import tool_scheduler
 
-    @classmethod
-    def load(cls, sandbox: Path) -> Self:
-        """
-        既存のサンドボックスディレクトリを読み込みます。
+# exec_commandに指定できるタイムアウトの上限（秒）
+MAX_COMMAND_TIMEOUT = 600
 
-        Args:
-            sandbox (Path): 既存のサンドボックスディレクトリへのパス。
-        """
-        if not sandbox.exists():
-            raise RuntimeError(f"Sandbox does not exist at {sandbox}")
-        return cls(sandbox=sandbox.resolve())
+# プロセス全体で同時に実行するexec_commandの数の上限
+MAX_CONCURRENT_COMMANDS = 8
 
+# read_fileで一度に読み取れる最大行数
+MAX_READ_LINES = 500
 
-@function_tool
-def exec_command(
+# list_dirで辿る最大の深さと、一度に返す最大エントリ数
+MAX_LIST_DEPTH = 10
+MAX_LIST_ENTRIES = 1000
+
+# ask_userでユーザーの回答を待つ時間の上限（秒）と、回答がなかった場合の返答
+ASK_USER_TIMEOUT = 600
+ASK_USER_DEFAULT_ANSWER = (
+    "The user did not answer in time. Proceed with your best judgement."
+)
+
+# searchtoolの結果を保存するディレクトリと有効期限（秒）
+SEARCH_CACHE_DIR = Path(".cache/searchtool")
+SEARCH_CACHE_TTL = 7 * 24 * 60 * 60
+
+# サンドボックスで共有するパッケージのキャッシュ
+PACKAGE_CACHE_DIR = Path(".cache/packages")
+
+
+@tool_scheduler.tool(access="exclusive", max_concurrency=MAX_CONCURRENT_COMMANDS)
+async def exec_command(
     wrapper: RunContextWrapper[SandboxContext],
     command: str,
+    timeout_seconds: int = 120,
 ) -> str:
     """
     コマンドを実行するツール。
     Args:
         command (str): 実行するコマンド
+        timeout_seconds (int): コマンドの実行時間の上限（秒）。最大600秒。
     """
     context = wrapper.context
-    with context:
-        logger.info(f"Executing command: {command}")
-        # Use subprocess to execute the command in the sandbox
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            env=os.environ.copy() | {"VIRTUAL_ENV": str(context.sandbox / ".venv")},
+    await asyncio.to_thread(context.snapshot, f"exec_command: {command}")
+    logger.info(f"Executing command: {command}")
+    # asyncioのサブプロセスで実行するので、コマンドの実行中も他のセッションは止まらない
+    result = await run_command(
+        command,
+        cwd=context.sandbox,
+        env=context.command_env(),
+        timeout=min(max(timeout_seconds, 1), MAX_COMMAND_TIMEOUT),
+        on_output=lambda stream, text: logger.debug(f"[{stream}] {text.rstrip()}"),
+    )
+    # コマンドはサンドボックス内の任意のファイルを変更しうるので、キャッシュしたディレクトリ構成を破棄する
+    context.invalidate()
+    context.installs.observe(result)
+    if result.returncode != 0:
+        logger.error(f"Command failed: {result.to_tool_output()}")
+    else:
+        logger.info(f"Command finished in {result.duration:.2f}s")
+    return result.to_tool_output()
+
+
+@tool_scheduler.tool(access="exclusive", max_concurrency=MAX_CONCURRENT_COMMANDS)
+async def run_python(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str = "",
+    code: str = "",
+    stdin: str = "",
+    timeout_seconds: int = 120,
+) -> str:
+    """
+    Pythonのスクリプトまたはコードを実行するツール。
+    起動済みのPythonプロセスで実行するので、exec_commandで`uv run file.py`を実行するよりもすぐに結果が返る。
+    実行のたびにモジュールは読み込み直されるので、ファイルを編集した後もそのまま実行できる。
+    Args:
+        path (str): 実行するスクリプトのパス。codeを指定する場合は空にする
+        code (str): 実行するPythonのコード。pathを指定する場合は空にする
+        stdin (str): 標準入力に渡す内容
+        timeout_seconds (int): 実行時間の上限（秒）。最大600秒。
+    """
+    context = wrapper.context
+    if bool(path) == bool(code):
+        return "Specify either path or code."
+    if path:
+        try:
+            script = context.resolve(path)
+        except RuntimeError as e:
+            return str(e)
+        if not script.is_file():
+            return f"File {path} does not exist."
+    await asyncio.to_thread(context.snapshot, f"run_python: {path or 'code'}")
+    try:
+        result = await context.kernel.run(
+            path=str(script) if path else None,
+            code=code or None,
+            stdin=stdin,
+            timeout=min(max(timeout_seconds, 1), MAX_COMMAND_TIMEOUT),
         )
-        if result.returncode != 0:
-            logger.error(f"Command failed with error: {result.stderr}")
-            return f"Command failed with error: {result.stderr}"
-        logger.info(f"Command output: {result.stdout}")
-        return result.stdout
+    except RuntimeError as e:
+        # ワーカーを起動できない場合は、exec_commandで実行してもらう
+        return f"{e}\nUse exec_command with `uv run` instead."
+    # 実行したコードはサンドボックス内の任意のファイルを変更しうる
+    context.invalidate()
+    logger.info(f"{result.command} finished in {result.duration:.2f}s")
+    return result.to_tool_output()
 
 
-@function_tool
+@tool_scheduler.tool(access="read")
+async def judge_solution(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str,
+    cases: list[TestCase],
+    compare: CompareMode = "whitespace",
+    time_limit_seconds: float = 2.0,
+    memory_limit_mb: int = 1024,
+) -> str:
+    """
+    解答のスクリプトを複数のテストケースで実行し、出力が期待値と一致するかを判定するツール。
+    テストケースは並列に実行されるので、100件のケースでも1回の呼び出しですぐに結果が返る。
+    結果は判定ごとの件数と、失敗したケースの入力・期待値・実際の出力の表。
+    Args:
+        path (str): 解答のスクリプトのパス
+        cases (list[TestCase]): テストケース。inputは標準入力に渡す内容、outputは期待される標準出力
+        compare (CompareMode): 出力の比較方法。exactは完全一致、whitespaceは空白と改行の違いを無視、floatはさらに数値の誤差1e-6を許容
+        time_limit_seconds (float): 1ケースあたりの実行時間の上限（秒）
+        memory_limit_mb (int): 1ケースあたりのメモリの上限（MB）
+    """
+    context = wrapper.context
+    try:
+        solution = context.resolve(path)
+    except RuntimeError as e:
+        return str(e)
+    if not solution.is_file():
+        return f"File {path} does not exist."
+    if not cases:
+        return "No test cases were given."
+    try:
+        report = await judge(
+            context,
+            path,
+            cases,
+            compare=compare,
+            time_limit=min(max(time_limit_seconds, 0.1), MAX_COMMAND_TIMEOUT),
+            memory_limit_mb=memory_limit_mb,
+        )
+    except RuntimeError as e:
+        return str(e)
+    logger.info(f"Judged {path}: {report.passed}/{len(cases)} passed")
+    return report.format(cases)
+
+
+@tool_scheduler.tool(access="read")
 def read_file(
     wrapper: RunContextWrapper[SandboxContext],
     path: str,
@@ -140,20 +207,63 @@ def read_file(
     """
 
     context = wrapper.context
-    with context:
-        file_path = context.sandbox / path
-        if not file_path.exists():
-            return f"File {file_path} does not exist."
-        lines = file_path.read_text(encoding="utf-8").splitlines()
-        if start_line < 0 or start_line >= len(lines):
-            return "Start line must be greater than or equal to 0 and less than the number of lines in the file."
-        if end_line > len(lines):
-            end_line = len(lines)
-        logger.info(f"Reading lines {start_line} to {end_line} from {file_path}")
-        return "\n".join(lines[start_line:end_line])
+    try:
+        file_path = context.resolve(path)
+    except RuntimeError as e:
+        return str(e)
+    if not file_path.is_file():
+        return f"File {path} does not exist."
+    # 行のオフセットのインデックスはキャッシュされるので、2回目以降は指定した範囲だけを読み込む
+    index = line_index_cache.get(file_path)
+    if start_line < 0 or start_line >= index.line_count:
+        return "Start line must be greater than or equal to 0 and less than the number of lines in the file."
+    if end_line < start_line:
+        return "End line must be greater than or equal to start line."
+    if end_line - start_line > MAX_READ_LINES:
+        return f"Cannot read more than {MAX_READ_LINES} lines at once."
+    if end_line > index.line_count:
+        end_line = index.line_count
+    logger.info(f"Reading lines {start_line} to {end_line} from {file_path}")
+    return index.read_lines(start_line, end_line)
+
+
+@tool_scheduler.tool(access="read")
+def grep_file(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str,
+    pattern: str,
+    ignore_case: bool = False,
+    max_matches: int = 100,
+) -> str:
+    """
+    ファイルの中から正規表現にマッチする行を検索するツール。
+    大きなファイルの中から読むべき場所を探すときに使用し、見つかった行番号をread_fileに指定する。
+    Args:
+        path (str): 検索するファイルのパス
+        pattern (str): 検索する正規表現（Pythonのre形式）
+        ignore_case (bool): Trueの場合、大文字と小文字を区別しない
+        max_matches (int): 返す行数の上限
+    """
+    context = wrapper.context
+    try:
+        file_path = context.resolve(path)
+    except RuntimeError as e:
+        return str(e)
+    if not file_path.is_file():
+        return f"File {path} does not exist."
+    try:
+        matches = line_index_cache.get(file_path).search(
+            pattern, max_matches=max_matches, ignore_case=ignore_case
+        )
+    except re.error as e:
+        return f"Invalid pattern: {e}"
+    logger.info(f"Found {len(matches)} matches for {pattern!r} in {file_path}")
+    if not matches:
+        return f"No matches for {pattern!r} in {path}."
+    return "\n".join(f"{line}: {text}" for line, text in matches)
 
 
-@function_tool
+@tool_scheduler.tool(access="write")
 def write_file(
     wrapper: RunContextWrapper[SandboxContext],
     path: str,
@@ -161,53 +271,216 @@ def write_file(
 ) -> str:
     """
     ファイルに内容を書き込むツール。
+    新しいファイルを作成する場合や、ファイル全体を書き直す場合に使用する。
     Args:
         path (str): 書き込むファイルのパス
         content (str): 書き込む内容
     """
     context = wrapper.context
-    with context:
-        file_path = context.sandbox / path
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.write_text(content, encoding="utf-8")
-        logger.info(f"Writing to {file_path}")
-        return f"File {file_path} written successfully."
-
-
-@function_tool
-def list_dir(wrapper: RunContextWrapper[SandboxContext], path: str) -> str:
+    try:
+        file_path = context.resolve(path)
+    except RuntimeError as e:
+        return str(e)
+    context.snapshot(f"write_file: {path}")
+    try:
+        atomic_write(file_path, content)
+    except OSError as e:
+        return f"Failed to write {path}: {e}"
+    line_index_cache.invalidate(file_path)
+    context.touch(file_path)
+    logger.info(f"Writing to {file_path}")
+    return f"File {path} written successfully."
+
+
+@tool_scheduler.tool(access="write")
+def apply_patch(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str,
+    diff: str,
+) -> str:
+    """
+    ファイルにunified diff形式のパッチを適用するツール。
+    ファイル全体を書き直す必要がないので、既存ファイルの一部を変更する場合はwrite_fileよりもこちらを使用する。
+    コンテキスト行（先頭が空白の行）と削除行（先頭が-の行）は現在のファイルの内容と完全に一致している必要がある。
+    Args:
+        path (str): パッチを適用するファイルのパス
+        diff (str): 1ファイル分のunified diff（@@ -開始行,行数 +開始行,行数 @@ で始まるハンクを含む）
+    """
+    context = wrapper.context
+    try:
+        file_path = context.resolve(path)
+        text = TextLines.load(file_path)
+        new_lines = apply_hunks(text.lines, parse_unified_diff(diff))
+    except RuntimeError as e:
+        return str(e)
+    except UnicodeDecodeError:
+        return f"File {path} is not a UTF-8 text file."
+    except OSError as e:
+        return f"Failed to read {path}: {e}"
+    context.snapshot(f"apply_patch: {path}")
+    try:
+        atomic_write(file_path, text.dump(new_lines))
+    except OSError as e:
+        return f"Failed to write {path}: {e}"
+    line_index_cache.invalidate(file_path)
+    context.touch(file_path)
+    logger.info(f"Patched {file_path}")
+    return diff_summary(path, text.lines, new_lines)
+
+
+@tool_scheduler.tool(access="write")
+def edit_range(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str,
+    start_line: int,
+    end_line: int,
+    content: str,
+) -> str:
+    """
+    ファイルの指定した行範囲を置き換えるツール。
+    start_line行目からend_line行目の手前までがcontentに置き換わる（0から始まる）。start_lineとend_lineを同じにすると挿入になる。
+    Args:
+        path (str): 編集するファイルのパス
+        start_line (int): 置き換えを開始する行番号（0から始まる）
+        end_line (int): 置き換えを終了する行番号（この行は含まない）
+        content (str): 置き換え後の内容
+    """
+    context = wrapper.context
+    try:
+        file_path = context.resolve(path)
+        if not file_path.is_file():
+            return f"File {path} does not exist."
+        text = TextLines.load(file_path)
+        new_lines = replace_range(text.lines, start_line, end_line, content)
+    except RuntimeError as e:
+        return str(e)
+    except UnicodeDecodeError:
+        return f"File {path} is not a UTF-8 text file."
+    except OSError as e:
+        return f"Failed to read {path}: {e}"
+    context.snapshot(f"edit_range: {path}")
+    try:
+        atomic_write(file_path, text.dump(new_lines))
+    except OSError as e:
+        return f"Failed to write {path}: {e}"
+    line_index_cache.invalidate(file_path)
+    context.touch(file_path)
+    logger.info(f"Edited lines {start_line} to {end_line} of {file_path}")
+    return diff_summary(path, text.lines, new_lines)
+
+
+@tool_scheduler.tool(access="read")
+def list_dir(
+    wrapper: RunContextWrapper[SandboxContext],
+    path: str,
+    depth: int = 1,
+    pattern: str = "",
+    max_entries: int = 200,
+    cursor: str = "",
+) -> str:
     """
     指定されたパスのファイルをリストするツール。
+    depthを2以上にすると再帰的にリストする。.venv, .git, __pycache__の中はリストしない。
+    結果が多い場合は末尾にcursorが表示されるので、同じ引数にcursorを指定して続きを取得する。
     Args:
         path (str): リストするパス
+        depth (int): 再帰的にリストする深さ（1の場合は直下のみ、最大10）
+        pattern (str): 指定した場合、このglobにマッチするファイルだけをリストする（例: "*.py"）
+        max_entries (int): 一度に返すエントリ数の上限（最大1000）
+        cursor (str): 前回の結果の末尾に表示されたcursor
+    """
+    context = wrapper.context
+    try:
+        file_path = context.resolve(path)
+    except RuntimeError as e:
+        return str(e)
+    if not file_path.exists():
+        return f"Path {path} does not exist."
+    if not file_path.is_dir():
+        return f"Path {path} is not a directory."
+    logger.info(f"Listing files in {file_path}")
+    listing = format_listing(
+        context.tree,
+        file_path,
+        max_depth=min(max(depth, 1), MAX_LIST_DEPTH),
+        pattern=pattern,
+        max_entries=min(max(max_entries, 1), MAX_LIST_ENTRIES),
+        cursor=int(cursor) if cursor.isdigit() else 0,
+    )
+    return listing or f"Path {path} is empty."
+
+
+@tool_scheduler.tool(access="read")
+def list_snapshots(wrapper: RunContextWrapper[SandboxContext]) -> str:
+    """
+    サンドボックスのスナップショットの一覧を返すツール。
+    スナップショットはファイルを変更するツールとコマンドの実行前に自動で取られる。
+    """
+    tracker = wrapper.context.snapshots
+    if tracker is None or not tracker.history:
+        return "No snapshots."
+    return "\n".join(
+        f"{snapshot.id} {datetime.fromtimestamp(snapshot.created_at):%H:%M:%S} "
+        f"{len(snapshot.files)} files, before {snapshot.label}"
+        for snapshot in tracker.history
+    )
+
+
+@tool_scheduler.tool(access="exclusive")
+async def restore_snapshot(
+    wrapper: RunContextWrapper[SandboxContext],
+    snapshot_id: str,
+) -> str:
+    """
+    サンドボックスをスナップショットの時点の状態に戻すツール。
+    ライブラリのインストールやファイルの編集でサンドボックスを壊してしまったときに、壊す前の状態に戻すために使用する。
+    Args:
+        snapshot_id (str): list_snapshotsで確認したスナップショットのID
     """
     context = wrapper.context
-    with context:
-        file_path = context.sandbox / path
-        if not file_path.exists():
-            return f"Path {file_path} does not exist."
-        if not file_path.is_dir():
-            return f"Path {file_path} is not a directory."
-        files = [f for f in file_path.iterdir()]
-        logger.info(f"Listing files in {file_path}")
-        return "\n".join(file.name for file in files)
+    try:
+        changed = await asyncio.to_thread(context.restore, snapshot_id)
+    except (RuntimeError, KeyError) as e:
+        return str(e)
+    for relative in changed:
+        line_index_cache.invalidate(context.sandbox / relative)
+    if not changed:
+        return f"Sandbox is already at snapshot {snapshot_id}."
+    return f"Restored snapshot {snapshot_id} ({len(changed)} files changed)."
 
 
 @function_tool
-def ask_user(
+async def ask_user(
+    wrapper: RunContextWrapper[SandboxContext],
     question: str,
-):
+) -> str:
     """
     ユーザーに質問するツール。
     Args:
         question (str): 質問内容
     """
-    return input(f"{question}:\n")
+    context = wrapper.context
+    # 回答を待つ間もイベントループは止まらないので、他のセッションはそのまま進む
+    return await get_human_channel().ask(
+        context.session_id,
+        question,
+        timeout=ASK_USER_TIMEOUT,
+        default=ASK_USER_DEFAULT_ANSWER,
+    )
 
 
-async def main():
-    load_dotenv()
+@functools.cache
+def get_search_cache() -> ResponseCache:
+    """
+    searchtoolの結果のキャッシュ。同じライブラリについての調査はセッションをまたいで再利用する。
+    """
+    return ResponseCache(SEARCH_CACHE_DIR, ttl=SEARCH_CACHE_TTL)
 
+
+def build_agent() -> Agent[SandboxContext]:
+    """
+    コーディングエージェントを作成します。バッチ評価など、main以外から実行する場合にも使用します。
+    """
     library_search_agent = Agent(
         name="Library Search Agent",
         instructions="""\
@@ -219,7 +492,7 @@ async def main():
         tools=[WebSearchTool()],
     )
 
-    agent = Agent[SandboxContext](
+    return Agent[SandboxContext](
         name="Coding Assistant",
         instructions="""\
 あなたは「コーディングアシスタント」エージェントです。
@@ -229,21 +502,33 @@ async def main():
 - 重要：どのような状況においてもツールを呼び出してください
 - まずはタスクを理解し、ユーザーに作業内容を確認してください
 - プロジェクトは`uv`というパッケージマネージャーツールで管理されています
-    - python commandを実行する場合には`uv run file.py`のように実行してください
+    - pythonのファイルを実行する場合にはrun_pythonを使用してください。exec_commandで実行する場合は`uv run file.py`のように実行してください
     - ライブラリのインストールには`uv add package_name`を使用してください
 - あなたのすべてのアクションはsandboxディレクトリ内部で実行されます。pathは必ず相対パスを使用してください
+- 既存のファイルの一部を変更する場合はwrite_fileで全体を書き直さず、apply_patchかedit_rangeを使用してください
+- ライブラリのインストールやファイルの編集でサンドボックスを壊してしまった場合は、list_snapshotsとrestore_snapshotで壊す前の状態に戻してください
 - タスクが完了した際は最低でも１度は実行して動作確認をしてください
+- 入力と期待される出力が分かっている場合は、judge_solutionでまとめて確認してください
 - 有名でないライブラリを使用する場合にはsearchtoolを利用して使い方を調べてください
 - 実行後は必ずユーザーに意見をもとめてください
 """,
         model="o4-mini",
         tools=[
             exec_command,
+            run_python,
+            judge_solution,
             read_file,
+            grep_file,
             write_file,
+            apply_patch,
+            edit_range,
             list_dir,
+            list_snapshots,
+            restore_snapshot,
             ask_user,
-            library_search_agent.as_tool(
+            cached_agent_tool(
+                library_search_agent,
+                get_search_cache(),
                 tool_name="searchtool",
                 tool_description="ライブラリの使い方を調べるためのエージェントです。"
                 "LLMエージェントを使ったツールなので調査依頼は自然言語で詳細に行ってください。"
@@ -252,10 +537,17 @@ async def main():
         ],
         model_settings=ModelSettings(
             tool_choice="required",
+            # 1ターンに複数のツールを呼べるようにする。衝突しない呼び出しはtool_schedulerが並行に実行する
+            parallel_tool_calls=True,
         ),
         reset_tool_choice=False,
     )
 
+
+async def main():
+    load_dotenv()
+    agent = build_agent()
+
     # user_input = input("タスクを入力してください:\n")
     user_input = """\
 次の競技プログラミングの問題を正解するためのPythonコードを作成してください。
@@ -284,16 +576,21 @@ N 回以下行うことで上述の条件が満たされないようにするこ
 1≤Ai​≤M
 入力は全て整数"""
 
-    ret = await Runner.run(
+    # サンドボックスを作り直しても、インストールしたパッケージはキャッシュから再利用する
+    set_package_cache(PackageCache(PACKAGE_CACHE_DIR))
+    context = SandboxContext.initialize(sandbox=Path("agent_sandbox"), force=True)
+    context.enable_snapshots()
+    # `--stream`を付けて実行すると、モデルの出力やツールの実行を逐次表示する
+    # 同じプロセスでバッチ評価が動いていても、モデルの呼び出しは優先して送り出す
+    await run_and_render(
         agent,
         input=user_input,
-        context=SandboxContext.initialize(sandbox=Path("agent_sandbox"), force=True),
+        context=context,
         max_turns=100,
+        run_config=RunConfig(model_provider=ScheduledModelProvider("interactive")),
     )
-    print(ret.final_output)
+    logger.info(context.installs.summary())
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
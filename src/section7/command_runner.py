@@ -0,0 +1,235 @@
+import asyncio
+import codecs
+import os
+import signal
+import time
+from collections import deque
+from collections.abc import Callable
+from pathlib import Path
+
+from agents import SpanError, custom_span
+from loguru import logger
+from pydantic import BaseModel
+
+# 1回の read で読み取るバイト数
+READ_CHUNK_SIZE = 4096
+
+# タイムアウト時に SIGTERM を送ってから SIGKILL を送るまでの猶予（秒）
+KILL_GRACE_PERIOD = 2.0
+
+OutputCallback = Callable[[str, str], None]
+
+
+class OutputBuffer:
+    """
+    末尾の`capacity`バイトだけを保持するリングバッファ。
+    容量を超えた出力は先頭から捨てられ、`getvalue`の結果に切り詰めマーカーが付きます。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total_bytes = 0
+        self._chunks: deque[bytes] = deque()
+        self._size = 0
+
+    def append(self, data: bytes) -> None:
+        self.total_bytes += len(data)
+        if len(data) >= self.capacity:
+            # チャンク単体で容量を超える場合は末尾だけ残せば十分
+            self._chunks.clear()
+            self._chunks.append(data[-self.capacity :])
+            self._size = self.capacity
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.capacity:
+            head = self._chunks.popleft()
+            overflow = self._size - self.capacity
+            if len(head) > overflow:
+                self._chunks.appendleft(head[overflow:])
+                self._size -= overflow
+            else:
+                self._size -= len(head)
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - self._size
+
+    def getvalue(self) -> str:
+        text = b"".join(self._chunks).decode("utf-8", errors="replace")
+        if self.dropped_bytes > 0:
+            return f"...[{self.dropped_bytes} bytes truncated]...\n{text}"
+        return text
+
+
+class CommandResult(BaseModel):
+    command: str
+    returncode: int | None
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    output_limit_exceeded: bool = False
+    duration: float
+
+    def to_tool_output(self) -> str:
+        """
+        エージェントに返すための文字列に整形します。
+        """
+        if self.timed_out:
+            return (
+                f"Command timed out after {self.duration:.1f}s and was killed.\n"
+                f"stdout:\n{self.stdout}\nstderr:\n{self.stderr}"
+            )
+        if self.output_limit_exceeded:
+            return (
+                "Command produced too much output and was killed.\n"
+                f"stdout:\n{self.stdout}\nstderr:\n{self.stderr}"
+            )
+        if self.returncode != 0:
+            return f"Command failed with exit code {self.returncode}: {self.stderr}"
+        return self.stdout
+
+
+def _kill_process_group(process: asyncio.subprocess.Process, sig: int) -> None:
+    """
+    プロセスグループ全体にシグナルを送ります。
+    `uv run`のように子プロセスを起動するコマンドでも孫プロセスまで確実に止めるためです。
+    """
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _pump(
+    stream: asyncio.StreamReader,
+    name: str,
+    buffer: OutputBuffer,
+    on_output: OutputCallback | None,
+    on_chunk: Callable[[int], None],
+) -> None:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        buffer.append(data)
+        on_chunk(len(data))
+        if on_output is not None:
+            on_output(name, decoder.decode(data))
+    if on_output is not None:
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            on_output(name, tail)
+
+
+async def run_command(
+    command: str,
+    cwd: Path,
+    env: dict[str, str] | None = None,
+    timeout: float = 120.0,
+    max_buffer_bytes: int = 64 * 1024,
+    max_output_bytes: int = 16 * 1024 * 1024,
+    on_output: OutputCallback | None = None,
+) -> CommandResult:
+    """
+    シェルコマンドを非同期に実行します。
+    イベントループをブロックしないため、複数のサンドボックスで同時にコマンドを実行できます。
+
+    Args:
+        command (str): 実行するコマンド
+        cwd (Path): コマンドを実行するディレクトリ
+        env (dict[str, str] | None): 環境変数。Noneの場合は現在のプロセスの環境変数を引き継ぎます。
+        timeout (float): 実行時間の上限（秒）。超えた場合はプロセスグループごと終了させます。
+        max_buffer_bytes (int): stdout/stderrそれぞれについて保持する末尾のバイト数
+        max_output_bytes (int): stdoutとstderrの合計出力量の上限。超えた場合はプロセスグループごと終了させます。
+        on_output (OutputCallback | None): 出力を受け取るたびに`(stream名, テキスト)`で呼ばれるコールバック
+    """
+    # Agents SDKのトレースにサブプロセスの実行時間を記録する（トレースの外で呼ばれた場合は何もしない）
+    with custom_span("subprocess", data={"command": command}) as span:
+        result = await _run_command(
+            command, cwd, env, timeout, max_buffer_bytes, max_output_bytes, on_output
+        )
+        span.span_data.data["returncode"] = result.returncode
+        if result.timed_out or result.output_limit_exceeded or result.returncode != 0:
+            span.set_error(SpanError(message=result.to_tool_output()[:200], data=None))
+        return result
+
+
+async def _run_command(
+    command: str,
+    cwd: Path,
+    env: dict[str, str] | None = None,
+    timeout: float = 120.0,
+    max_buffer_bytes: int = 64 * 1024,
+    max_output_bytes: int = 16 * 1024 * 1024,
+    on_output: OutputCallback | None = None,
+) -> CommandResult:
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        # 新しいセッション（＝プロセスグループ）で起動し、終了時にグループごとkillできるようにする
+        start_new_session=True,
+    )
+    assert process.stdout is not None and process.stderr is not None
+
+    stdout = OutputBuffer(max_buffer_bytes)
+    stderr = OutputBuffer(max_buffer_bytes)
+    output_limit_exceeded = False
+
+    def on_chunk(_: int) -> None:
+        nonlocal output_limit_exceeded
+        if output_limit_exceeded:
+            return
+        if stdout.total_bytes + stderr.total_bytes > max_output_bytes:
+            output_limit_exceeded = True
+            logger.warning(f"Output limit exceeded, killing command: {command}")
+            _kill_process_group(process, signal.SIGKILL)
+
+    pumps = asyncio.gather(
+        _pump(process.stdout, "stdout", stdout, on_output, on_chunk),
+        _pump(process.stderr, "stderr", stderr, on_output, on_chunk),
+    )
+    timed_out = False
+    try:
+        async with asyncio.timeout(timeout):
+            # タイムアウト時に読み取りタスクまでキャンセルされないようshieldする
+            await asyncio.shield(pumps)
+            await process.wait()
+    except TimeoutError:
+        timed_out = True
+        logger.warning(f"Command timed out after {timeout}s: {command}")
+        _kill_process_group(process, signal.SIGTERM)
+        try:
+            async with asyncio.timeout(KILL_GRACE_PERIOD):
+                await process.wait()
+        except TimeoutError:
+            _kill_process_group(process, signal.SIGKILL)
+            await process.wait()
+        # グループ外に逃げたプロセスがパイプを握っていても戻れるよう、読み取りは打ち切る
+        try:
+            async with asyncio.timeout(KILL_GRACE_PERIOD):
+                await asyncio.shield(pumps)
+        except TimeoutError:
+            pumps.cancel()
+            # 取り消した読み取りの結果を受け取っておき、「例外が取得されなかった」警告を出さない
+            await asyncio.gather(pumps, return_exceptions=True)
+    finally:
+        if process.returncode is None:
+            _kill_process_group(process, signal.SIGKILL)
+            await process.wait()
+
+    return CommandResult(
+        command=command,
+        returncode=process.returncode,
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+        timed_out=timed_out,
+        output_limit_exceeded=output_limit_exceeded,
+        duration=time.perf_counter() - start,
+    )
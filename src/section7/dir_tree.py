@@ -0,0 +1,141 @@
+import os
+import threading
+from collections.abc import Iterator
+from fnmatch import fnmatch
+from pathlib import Path, PurePosixPath
+
+from pydantic import BaseModel
+
+# 指定がなくても再帰的に辿らないディレクトリ
+DEFAULT_IGNORES = (".venv", ".git", "__pycache__")
+
+
+class Entry(BaseModel):
+    name: str
+    is_dir: bool
+    size: int
+
+
+class DirTreeSnapshot:
+    """
+    ディレクトリごとのエントリ一覧をメモリ上にキャッシュするスナップショット。
+    ディレクトリの更新時刻が変わっていなければ`os.scandir`を呼ばずにキャッシュを返します。
+    ファイルを書き込むツールは`touch`で該当ファイルのエントリだけを更新します。
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._dirs: dict[Path, tuple[int, dict[str, Entry]]] = {}
+        self._lock = threading.Lock()
+
+    def entries(self, directory: Path) -> list[Entry]:
+        """
+        ディレクトリ直下のエントリを名前順で返します。
+        """
+        mtime_ns = directory.stat().st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            return sorted(cached[1].values(), key=lambda entry: entry.name)
+        entries: dict[str, Entry] = {}
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                is_dir = dir_entry.is_dir(follow_symlinks=False)
+                size = 0 if is_dir else dir_entry.stat(follow_symlinks=False).st_size
+                entries[dir_entry.name] = Entry(
+                    name=dir_entry.name, is_dir=is_dir, size=size
+                )
+        with self._lock:
+            self._dirs[directory] = (mtime_ns, entries)
+        return sorted(entries.values(), key=lambda entry: entry.name)
+
+    def touch(self, path: Path) -> None:
+        """
+        ファイルの作成・更新をスナップショットに反映します。
+        キャッシュ済みの祖先ディレクトリについて、該当するエントリだけを差し替えます。
+        """
+        with self._lock:
+            child = path
+            while child != self.root and self.root in child.parents:
+                parent = child.parent
+                cached = self._dirs.get(parent)
+                if cached is not None and child.exists():
+                    _, entries = cached
+                    is_dir = child.is_dir()
+                    entries[child.name] = Entry(
+                        name=child.name,
+                        is_dir=is_dir,
+                        size=0 if is_dir else child.stat().st_size,
+                    )
+                    self._dirs[parent] = (parent.stat().st_mtime_ns, entries)
+                child = parent
+
+    def clear(self) -> None:
+        """
+        キャッシュをすべて破棄します。任意のファイルを変更しうるコマンドの実行後に呼び出します。
+        """
+        with self._lock:
+            self._dirs.clear()
+
+    def walk(
+        self,
+        directory: Path,
+        max_depth: int,
+        pattern: str = "",
+        ignore: tuple[str, ...] = DEFAULT_IGNORES,
+    ) -> Iterator[tuple[str, Entry, bool]]:
+        """
+        ディレクトリを深さ優先で辿り、`(directoryからの相対パス, エントリ, 無視されたか)`を返します。
+        無視されたディレクトリは一覧には含めますが、その中へは降りません。
+
+        Args:
+            directory (Path): 辿り始めるディレクトリ
+            max_depth (int): 辿る深さ。1の場合は直下のみ
+            pattern (str): 指定した場合、このglobにマッチするファイルだけを返します（例: `*.py`）
+            ignore (tuple[str, ...]): 中へ降りないディレクトリ名のglob
+        """
+
+        def visit(current: Path, prefix: PurePosixPath, depth: int):
+            for entry in self.entries(current):
+                relative = prefix / entry.name
+                ignored = any(fnmatch(entry.name, name) for name in ignore)
+                if entry.is_dir:
+                    if not pattern:
+                        yield relative.as_posix(), entry, ignored
+                    if not ignored and depth < max_depth:
+                        yield from visit(current / entry.name, relative, depth + 1)
+                elif not ignored and (not pattern or relative.match(pattern)):
+                    yield relative.as_posix(), entry, False
+
+        yield from visit(directory, PurePosixPath(), 1)
+
+
+def format_listing(
+    snapshot: DirTreeSnapshot,
+    directory: Path,
+    max_depth: int,
+    pattern: str,
+    max_entries: int,
+    cursor: int,
+    ignore: tuple[str, ...] = DEFAULT_IGNORES,
+) -> str:
+    """
+    `walk`の結果をエージェント向けの文字列に整形します。
+    `max_entries`件を超える場合は続きを取得するためのcursorを末尾に付けます。
+    """
+    lines: list[str] = []
+    for i, (relative, entry, ignored) in enumerate(
+        snapshot.walk(directory, max_depth, pattern, ignore)
+    ):
+        if i < cursor:
+            continue
+        if len(lines) == max_entries:
+            lines.append(
+                f'[{max_entries} entries shown. Call again with cursor="{i}" to continue.]'
+            )
+            break
+        if entry.is_dir:
+            lines.append(f"{relative}/" + (" (not expanded)" if ignored else ""))
+        else:
+            lines.append(f"{relative} ({entry.size} bytes)")
+    return "\n".join(lines)
@@ -0,0 +1,148 @@
+import mmap
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+from loguru import logger
+
+from src.section7.patch import split_lines
+
+# grepの結果として1行あたりに返す最大文字数
+MAX_MATCH_LINE_LENGTH = 300
+
+
+class LineIndex:
+    """
+    ファイルの各行の開始位置（バイトオフセット）を保持するインデックス。
+    一度作成しておけば、任意の行範囲を読み込むときにその範囲のバイトだけを読めば済みます。
+    """
+
+    def __init__(self, path: Path):
+        stat = path.stat()
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        # 各行の開始位置。最後の要素はファイル末尾（番兵）
+        self.offsets = array("Q", [0])
+        if self.size == 0:
+            self.offsets = array("Q")
+            return
+        with (
+            path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            find = mm.find
+            append = self.offsets.append
+            position = find(b"\n")
+            while position != -1:
+                append(position + 1)
+                position = find(b"\n", position + 1)
+        if self.offsets[-1] != self.size:
+            self.offsets.append(self.size)
+        logger.debug(f"Built line index for {path}: {self.line_count} lines")
+
+    @property
+    def line_count(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def is_fresh(self) -> bool:
+        """
+        インデックス作成後にファイルが変更されていないかを確認します。
+        """
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+    def read_lines(self, start_line: int, end_line: int) -> str:
+        """
+        `start_line`行目から`end_line`行目の手前までを読み込みます（0から始まる）。
+        """
+        start = self.offsets[start_line]
+        end = self.offsets[end_line]
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, end - start, start)
+        finally:
+            os.close(fd)
+        # インデックスと同じく`\n`だけで行に分ける（`str.splitlines`は`\x0c`や`\u2028`でも分けてしまう）
+        return "\n".join(split_lines(data.decode("utf-8", errors="replace")))
+
+    def line_number(self, offset: int) -> int:
+        """
+        バイトオフセットが含まれる行番号（0から始まる）を返します。
+        """
+        return bisect_right(self.offsets, offset) - 1
+
+    def search(
+        self, pattern: str, max_matches: int = 100, ignore_case: bool = False
+    ) -> list[tuple[int, str]]:
+        """
+        正規表現にマッチする行を探します。
+        ファイルをmmapしたまま検索し、マッチした行だけをデコードします。
+
+        Args:
+            pattern (str): 検索する正規表現
+            max_matches (int): 返す行数の上限
+            ignore_case (bool): Trueの場合、大文字と小文字を区別しない
+        """
+        if self.size == 0:
+            return []
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        regex = re.compile(pattern.encode("utf-8"), flags)
+        matches: list[tuple[int, str]] = []
+        with (
+            self.path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            position = 0
+            while len(matches) < max_matches:
+                match = regex.search(mm, position)
+                # 改行で終わるファイルでは、`$`などがファイル末尾（番兵の行）にもマッチする
+                if match is None or match.start() >= self.size:
+                    break
+                line = self.line_number(match.start())
+                start, end = self.offsets[line], self.offsets[line + 1]
+                text = mm[start:end].decode("utf-8", errors="replace").rstrip("\r\n")
+                matches.append((line, text[:MAX_MATCH_LINE_LENGTH]))
+                # 同じ行で複数回マッチしても1行として扱うため、次の行から検索を再開する
+                position = end
+        return matches
+
+
+class LineIndexCache:
+    """
+    パスごとに`LineIndex`をキャッシュします。
+    ファイルの更新時刻とサイズが変わっていればインデックスを作り直します。
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Path, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> LineIndex:
+        with self._lock:
+            index = self._entries.get(path)
+            if index is not None and index.is_fresh():
+                self._entries.move_to_end(path)
+                return index
+        index = LineIndex(path)
+        with self._lock:
+            self._entries[path] = index
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, path: Path) -> None:
+        with self._lock:
+            self._entries.pop(path, None)
+
+
+line_index_cache = LineIndexCache()
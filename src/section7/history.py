@@ -0,0 +1,152 @@
+import json
+from collections.abc import Mapping
+from typing import Any, cast
+
+from agents import RunResult, TResponseInputItem
+from loguru import logger
+from pydantic import BaseModel
+
+# 古いツール出力を切り詰めるときに残す先頭と末尾の文字数
+STUB_HEAD_CHARS = 200
+STUB_TAIL_CHARS = 200
+
+# 古い会話を削除したことをモデルに伝えるメッセージ
+DROPPED_NOTICE = (
+    "（これより前の{count}件の会話履歴は、長くなりすぎたため省略されました）"
+)
+
+
+def estimate_tokens(item: Mapping[str, Any]) -> int:
+    """
+    入力アイテムのおおよそのトークン数を見積もります。
+    ASCII文字は4文字で1トークン、それ以外（日本語など）は1文字で1トークンとして数えます。
+    """
+    text = json.dumps(item, ensure_ascii=False)
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+class HistoryEntry(BaseModel):
+    item: dict[str, Any]
+    tokens: int
+    compacted: bool = False
+
+
+def _is_user_message(item: dict[str, Any]) -> bool:
+    return item.get("role") == "user" and item.get("type", "message") == "message"
+
+
+class ConversationHistory:
+    """
+    複数ターンの会話履歴をトークン数の上限に収まるよう管理します。
+
+    毎ターン`RunResult.to_input_list()`をそのまま次の入力にすると、履歴全体を毎回送り直すことになり、
+    会話が長くなるほどコストが増え続けます。このクラスは上限を超えたときだけ次の順で履歴を縮めます。
+
+    1. `keep_recent`件より古いツール出力を、先頭と末尾だけを残したスタブに置き換える
+    2. それでも収まらなければ、古い会話をユーザーメッセージの区切りで削除する
+
+    縮めるときは上限の`low_water`倍まで一度に減らすので、その後しばらくは履歴の先頭が変わらず、
+    プロバイダ側のプロンプトキャッシュが効き続けます。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 100_000,
+        low_water: float = 0.7,
+        keep_recent: int = 10,
+        max_tool_output_tokens: int = 500,
+    ):
+        """
+        Args:
+            max_tokens (int): 履歴全体のトークン数の上限
+            low_water (float): 上限を超えたときに縮める目標（上限に対する割合）
+            keep_recent (int): ツール出力をスタブに置き換えずに残す、末尾からのアイテム数
+            max_tool_output_tokens (int): これより大きいツール出力がスタブへの置き換えの対象になる
+        """
+        self.max_tokens = max_tokens
+        self.low_water = low_water
+        self.keep_recent = keep_recent
+        self.max_tool_output_tokens = max_tool_output_tokens
+        self.entries: list[HistoryEntry] = []
+        # 履歴の先頭が書き換わった回数。これが増えるとプロンプトキャッシュは効かなくなる
+        self.compactions = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(entry.tokens for entry in self.entries)
+
+    def to_input_list(self) -> list[TResponseInputItem]:
+        """
+        次の`Runner.run`に渡す入力を返します。
+        """
+        return cast(list[TResponseInputItem], [entry.item for entry in self.entries])
+
+    def add(self, items: list[TResponseInputItem]) -> None:
+        for item in items:
+            item = dict(item)
+            self.entries.append(HistoryEntry(item=item, tokens=estimate_tokens(item)))
+        if self.total_tokens > self.max_tokens:
+            self.compact()
+
+    def add_user_message(self, content: str) -> None:
+        self.add([{"role": "user", "content": content}])
+
+    def add_run(self, result: RunResult) -> None:
+        """
+        `to_input_list()`を入力にして実行した結果のうち、新しく増えたアイテムだけを履歴に追加します。
+        """
+        self.add(result.to_input_list()[len(self.entries) :])
+
+    def compact(self) -> None:
+        target = int(self.max_tokens * self.low_water)
+        before = self.total_tokens
+        self._stub_tool_outputs()
+        if self.total_tokens > target:
+            self._drop_oldest(target)
+        self.compactions += 1
+        logger.info(
+            f"Compacted conversation history from {before} to {self.total_tokens} tokens"
+        )
+
+    def _stub_tool_outputs(self) -> None:
+        for entry in self.entries[: -self.keep_recent or None]:
+            item = entry.item
+            if (
+                entry.compacted
+                or item.get("type") != "function_call_output"
+                or entry.tokens <= self.max_tool_output_tokens
+            ):
+                continue
+            output = str(item.get("output", ""))
+            omitted = len(output) - STUB_HEAD_CHARS - STUB_TAIL_CHARS
+            if omitted <= 0:
+                continue
+            item["output"] = (
+                f"{output[:STUB_HEAD_CHARS]}\n...[{omitted} chars omitted]...\n"
+                f"{output[-STUB_TAIL_CHARS:]}"
+            )
+            entry.tokens = estimate_tokens(item)
+            entry.compacted = True
+
+    def _drop_oldest(self, target: int) -> None:
+        # 関数呼び出しとその出力が離ればなれにならないよう、ユーザーメッセージの直前でのみ区切る
+        boundaries = [
+            i for i, entry in enumerate(self.entries) if _is_user_message(entry.item)
+        ]
+        total = self.total_tokens
+        cut = 0
+        for boundary in boundaries[1:]:
+            if total <= target:
+                break
+            total -= sum(entry.tokens for entry in self.entries[cut:boundary])
+            cut = boundary
+        if cut == 0:
+            return
+        notice: dict[str, Any] = {
+            "role": "user",
+            "content": DROPPED_NOTICE.format(count=cut),
+        }
+        self.entries = [
+            HistoryEntry(item=notice, tokens=estimate_tokens(notice), compacted=True)
+        ] + self.entries[cut:]
@@ -0,0 +1,300 @@
+import asyncio
+import os
+import sys
+import uuid
+from abc import ABC, abstractmethod
+
+from loguru import logger
+from pydantic import BaseModel, Field, ValidationError
+
+
+class Question(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex[:12])
+    session_id: str
+    text: str
+
+
+class Answer(BaseModel):
+    question_id: str
+    text: str
+
+
+class HumanChannel(ABC):
+    """
+    エージェントからユーザーへ質問し、回答を受け取るための経路。
+    `ask`はイベントループをブロックせずに回答を待つので、1つのプロセスで複数のセッションを扱えます。
+    """
+
+    @abstractmethod
+    async def ask(
+        self,
+        session_id: str,
+        question: str,
+        timeout: float | None = None,
+        default: str | None = None,
+    ) -> str:
+        """
+        ユーザーに質問し、回答を返します。
+
+        Args:
+            session_id (str): 質問しているセッションのID
+            question (str): 質問内容
+            timeout (float | None): 回答を待つ時間の上限（秒）。Noneの場合は無期限に待ちます。
+            default (str | None): タイムアウトした場合に返す回答。Noneの場合は`TimeoutError`を送出します。
+        """
+
+
+class QueueHumanChannel(HumanChannel):
+    """
+    `asyncio.Queue`で質問を受け渡すチャネル。
+    Webサーバーなどのフロントエンドは`next_question`で全セッションの質問を順に受け取り、
+    `answer`で回答を返します。`serve`を使うとTCPソケット経由で同じことができます。
+    """
+
+    def __init__(self):
+        self._questions: asyncio.Queue[Question] = asyncio.Queue()
+        self._pending: dict[str, tuple[Question, asyncio.Future[str]]] = {}
+
+    async def ask(
+        self,
+        session_id: str,
+        question: str,
+        timeout: float | None = None,
+        default: str | None = None,
+    ) -> str:
+        item = Question(session_id=session_id, text=question)
+        future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        self._pending[item.id] = (item, future)
+        self._questions.put_nowait(item)
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        except TimeoutError:
+            if default is None:
+                raise
+            logger.warning(f"[{session_id}] No answer within {timeout}s: {question}")
+            return default
+        finally:
+            self._pending.pop(item.id, None)
+
+    async def next_question(self) -> Question:
+        """
+        回答待ちの質問を1つ取り出します。タイムアウト済みの質問は読み飛ばします。
+        """
+        while True:
+            question = await self._questions.get()
+            if question.id in self._pending:
+                return question
+
+    def answer(self, question_id: str, text: str) -> bool:
+        """
+        質問に回答します。質問がすでにタイムアウトしていた場合はFalseを返します。
+        """
+        pending = self._pending.get(question_id)
+        if pending is None or pending[1].done():
+            logger.warning(f"Question {question_id} is no longer waiting for an answer")
+            return False
+        pending[1].set_result(text)
+        return True
+
+    def pending(self, session_id: str | None = None) -> list[Question]:
+        """
+        回答待ちの質問を返します。`session_id`を指定した場合はそのセッションの質問だけを返します。
+        """
+        return [
+            question
+            for question, _ in self._pending.values()
+            if session_id is None or question.session_id == session_id
+        ]
+
+    def requeue(self, question: Question) -> None:
+        """
+        フロントエンドに渡したものの回答されなかった質問を、再びキューに戻します。
+        """
+        if question.id in self._pending:
+            self._questions.put_nowait(question)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        """
+        TCPソケットで質問を配信するサーバーを起動します。
+        質問は`Question`、回答は`Answer`をJSONにした1行ずつのメッセージでやり取りします。
+        接続が切れた場合、その接続に送って回答されていない質問はキューに戻します。
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Human channel listening on {host}:{port}")
+        return server
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        sent: dict[str, Question] = {}
+
+        async def forward() -> None:
+            while True:
+                question = await self.next_question()
+                sent[question.id] = question
+                writer.write(question.model_dump_json().encode() + b"\n")
+                await writer.drain()
+
+        task = asyncio.create_task(forward())
+        try:
+            while line := await reader.readline():
+                try:
+                    answer = Answer.model_validate_json(line)
+                except ValidationError as e:
+                    logger.warning(f"Invalid answer message: {e}")
+                    continue
+                sent.pop(answer.question_id, None)
+                self.answer(answer.question_id, answer.text)
+        except ConnectionError as e:
+            logger.warning(f"Human channel connection lost: {e}")
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            for question in sent.values():
+                self.requeue(question)
+            writer.close()
+
+
+class StdinHumanChannel(QueueHumanChannel):
+    """
+    標準入力で回答を受け取るチャネル。
+    標準入力を読むのは1つのタスクだけで、複数のセッションの質問は届いた順に1つずつ表示します。
+
+    標準入力はスレッドでブロックして読むのではなくイベントループで待つので、キャンセルすれば読み取りも止まります。
+    読んだ行には、その行が届いたときに表示していた質問のIDを付けます。
+    端末から入力する場合、タイムアウトした質問への回答として入力された行は、次の質問への回答にせずに捨てます。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tasks: list[asyncio.Task[None]] = []
+        # (行が届いたときに表示していた質問のID, 行)。標準入力が閉じられたらNone
+        self._lines: asyncio.Queue[tuple[str | None, str] | None] = asyncio.Queue()
+        self._shown: str | None = None
+        self._buffer = b""
+
+    async def ask(
+        self,
+        session_id: str,
+        question: str,
+        timeout: float | None = None,
+        default: str | None = None,
+    ) -> str:
+        if not self._tasks or any(task.done() for task in self._tasks):
+            for task in self._tasks:
+                task.cancel()
+            self._tasks = [
+                asyncio.create_task(self._read_lines()),
+                asyncio.create_task(self._read_answers()),
+            ]
+        return await super().ask(session_id, question, timeout, default)
+
+    async def _readline(self) -> str | None:
+        """
+        標準入力から1行読みます。標準入力が閉じられた場合はNoneを返します。
+        """
+        loop = asyncio.get_running_loop()
+        fd = sys.stdin.fileno()
+        while b"\n" not in self._buffer:
+            readable: asyncio.Future[None] = loop.create_future()
+            try:
+                loop.add_reader(fd, _wake, readable)
+            except PermissionError:
+                # 通常のファイルはepollで待てないが、読み取りでブロックすることもない
+                pass
+            else:
+                try:
+                    await readable
+                finally:
+                    loop.remove_reader(fd)
+            data = os.read(fd, 4096)
+            if not data:
+                if not self._buffer:
+                    return None
+                break
+            self._buffer += data
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.decode("utf-8", errors="replace").rstrip("\r")
+
+    async def _read_lines(self) -> None:
+        while (line := await self._readline()) is not None:
+            self._lines.put_nowait((self._shown, line))
+        self._lines.put_nowait(None)
+
+    async def _read_answers(self) -> None:
+        while True:
+            question = await self.next_question()
+            _, answered = self._pending[question.id]
+            self._shown = question.id
+            print(f"[{question.session_id}] {question.text}:", flush=True)
+            get = asyncio.create_task(self._lines.get())
+            try:
+                while True:
+                    await asyncio.wait(
+                        [get, answered], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not get.done():
+                        # 回答が入力される前に質問がタイムアウトした
+                        break
+                    item = get.result()
+                    if item is None:
+                        logger.warning("Standard input was closed")
+                        return
+                    shown, text = item
+                    # パイプやファイルから読む場合は入力が前もって用意されているので、届いた順に回答とする
+                    if shown == question.id or not sys.stdin.isatty():
+                        self.answer(question.id, text)
+                        break
+                    logger.warning(
+                        f"Discarding an answer to an expired question: {text}"
+                    )
+                    get = asyncio.create_task(self._lines.get())
+            finally:
+                get.cancel()
+                self._shown = None
+
+
+def _wake(future: asyncio.Future[None]) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class StaticHumanChannel(HumanChannel):
+    """
+    常に同じ回答を返すチャネル。バッチ評価のように人間が介在しない実行で使います。
+    """
+
+    def __init__(self, answer: str):
+        self.answer = answer
+
+    async def ask(
+        self,
+        session_id: str,
+        question: str,
+        timeout: float | None = None,
+        default: str | None = None,
+    ) -> str:
+        logger.info(f"[{session_id}] Auto-answering: {question}")
+        return self.answer
+
+
+_channel: HumanChannel | None = None
+
+
+def get_human_channel() -> HumanChannel:
+    """
+    `ask_user`ツールが使うチャネルを返します。設定されていない場合は標準入力を使います。
+    """
+    global _channel
+    if _channel is None:
+        _channel = StdinHumanChannel()
+    return _channel
+
+
+def set_human_channel(channel: HumanChannel) -> None:
+    """
+    `ask_user`ツールが使うチャネルを差し替えます。サーバーとして動かす場合は`QueueHumanChannel`を設定します。
+    """
+    global _channel
+    _channel = channel
@@ -0,0 +1,238 @@
+"""
+解答のスクリプトを複数のテストケースで並列に実行し、出力を期待値と比べるジャッジ。
+テストケースはそれぞれ別のプロセスで実行し、時間とメモリの上限を超えたものはTLE・MLEとして判定します。
+
+```python
+report = await judge(context, "main.py", cases, compare="float")
+print(report.format(cases))
+```
+"""
+
+import asyncio
+import math
+import os
+import shlex
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Literal
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel
+
+from src.section7.command_runner import run_command
+from src.section7.python_kernel import sandbox_python
+from src.section7.sandbox import SandboxContext
+
+Verdict = Literal["AC", "WA", "TLE", "MLE", "RE", "OLE"]
+CompareMode = Literal["exact", "whitespace", "float"]
+
+# プロセス全体で同時に実行するテストケースの数の上限。複数のセッションのジャッジが同時に走ってもCPUを取り合わないようにする
+MAX_PARALLEL_CASES = os.cpu_count() or 4
+
+# テストケースを並列に実行するので、数値計算ライブラリが各プロセスでさらにスレッドを立てないようにする
+JUDGE_ENV = {
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+# 失敗したテストケースの表示で、入力と出力を切り詰める文字数
+PREVIEW_CHARS = 60
+
+# セマフォは最初に待ったイベントループに結び付くので、イベントループごとに作る
+_case_slots: WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = (
+    WeakKeyDictionary()
+)
+
+
+def _slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _case_slots:
+        _case_slots[loop] = asyncio.Semaphore(MAX_PARALLEL_CASES)
+    return _case_slots[loop]
+
+
+class TestCase(BaseModel):
+    input: str
+    output: str
+
+
+class CaseResult(BaseModel):
+    index: int
+    verdict: Verdict
+    time: float
+    stdout: str
+    stderr: str
+
+
+class JudgeReport(BaseModel):
+    cases: list[CaseResult]
+    wall_time: float
+
+    @property
+    def passed(self) -> int:
+        return sum(1 for case in self.cases if case.verdict == "AC")
+
+    def format(self, tests: list[TestCase], max_failures: int = 5) -> str:
+        """
+        エージェントに返すための、判定の集計と失敗したテストケースの表に整形します。
+        """
+        counts: dict[str, int] = {}
+        for case in self.cases:
+            counts[case.verdict] = counts.get(case.verdict, 0) + 1
+        max_time = max((case.time for case in self.cases), default=0.0)
+        lines = [
+            f"{self.passed}/{len(self.cases)} passed "
+            f"({', '.join(f'{verdict} {count}' for verdict, count in sorted(counts.items()))}), "
+            f"max time {max_time:.2f}s, wall time {self.wall_time:.2f}s"
+        ]
+        failures = [case for case in self.cases if case.verdict != "AC"]
+        if failures:
+            lines.append("case | verdict | time | input | expected | actual")
+        for case in failures[:max_failures]:
+            if case.verdict == "WA":
+                actual = case.stdout
+            elif case.verdict in ("RE", "MLE"):
+                # トレースバックの最後の行に例外の種類とメッセージがある
+                actual = (case.stderr.strip().splitlines() or [""])[-1]
+            else:
+                actual = "-"
+            lines.append(
+                f"{case.index} | {case.verdict} | {case.time:.2f}s | "
+                f"{_preview(tests[case.index].input)} | "
+                f"{_preview(tests[case.index].output)} | {_preview(actual)}"
+            )
+        if len(failures) > max_failures:
+            lines.append(f"... and {len(failures) - max_failures} more failures")
+        return "\n".join(lines)
+
+
+def _preview(text: str) -> str:
+    text = text.strip().replace("\n", "\\n")
+    return text if len(text) <= PREVIEW_CHARS else text[: PREVIEW_CHARS - 3] + "..."
+
+
+def outputs_match(
+    actual: str,
+    expected: str,
+    mode: CompareMode = "whitespace",
+    tolerance: float = 1e-6,
+) -> bool:
+    """
+    出力を期待値と比べます。
+
+    Args:
+        actual (str): 解答の出力
+        expected (str): 期待される出力
+        mode (CompareMode): `exact`は完全一致、`whitespace`は空白と改行の違いを無視、
+            `float`はさらに数値のトークンを絶対誤差または相対誤差`tolerance`以内で比較します
+        tolerance (float): `float`で許容する誤差
+    """
+    if mode == "exact":
+        return actual == expected
+    actual_tokens = actual.split()
+    expected_tokens = expected.split()
+    if mode == "whitespace" or len(actual_tokens) != len(expected_tokens):
+        return actual_tokens == expected_tokens
+    for a, e in zip(actual_tokens, expected_tokens, strict=True):
+        if a == e:
+            continue
+        try:
+            if not math.isclose(
+                float(a), float(e), rel_tol=tolerance, abs_tol=tolerance
+            ):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+async def judge(
+    context: SandboxContext,
+    path: str,
+    tests: list[TestCase],
+    compare: CompareMode = "whitespace",
+    tolerance: float = 1e-6,
+    time_limit: float = 2.0,
+    memory_limit_mb: int = 1024,
+) -> JudgeReport:
+    """
+    解答のスクリプトをテストケースごとに別のプロセスで並列に実行し、判定します。
+    `uv run`を経由せずにサンドボックスの仮想環境のPythonを直接起動するので、1ケースあたりの起動時間も短くなります。
+    仮想環境がまだない場合は、テストケースを実行する前に1度だけ`uv sync`で作成します。
+
+    Args:
+        context (SandboxContext): 解答のあるサンドボックス
+        path (str): 解答のスクリプトのサンドボックスからの相対パス
+        tests (list[TestCase]): テストケース
+        compare (CompareMode): 出力の比較方法
+        tolerance (float): `float`で比較するときに許容する誤差
+        time_limit (float): 1ケースあたりの実行時間の上限（秒）
+        memory_limit_mb (int): 1ケースあたりの仮想メモリの上限（MB）
+
+    Raises:
+        RuntimeError: 解答のパスがサンドボックスの外を指している場合、仮想環境を作成できなかった場合
+    """
+    solution = context.resolve(path)
+    env = context.command_env() | JUDGE_ENV
+    await _ensure_venv(context, env)
+    python = " ".join(shlex.quote(part) for part in sandbox_python(context.sandbox))
+    start = time.perf_counter()
+    # 入力ファイルはエージェントから見えないよう、サンドボックスの外に置く
+    with tempfile.TemporaryDirectory() as directory:
+
+        async def run_case(index: int, test: TestCase) -> CaseResult:
+            input_path = Path(directory) / f"{index}.in"
+            input_path.write_text(test.input)
+            command = (
+                f"ulimit -v {memory_limit_mb * 1024}; "
+                f"exec {python} {shlex.quote(str(solution))} "
+                f"< {shlex.quote(str(input_path))}"
+            )
+            async with _slots():
+                result = await run_command(
+                    command,
+                    cwd=context.sandbox,
+                    env=env,
+                    timeout=time_limit,
+                    # 期待値との比較に使うので、出力は切り詰めずに保持する
+                    max_buffer_bytes=max(64 * 1024, len(test.output.encode()) * 2),
+                )
+            if result.timed_out:
+                verdict: Verdict = "TLE"
+            elif result.output_limit_exceeded:
+                verdict = "OLE"
+            elif result.returncode != 0:
+                verdict = "MLE" if "MemoryError" in result.stderr else "RE"
+            elif outputs_match(result.stdout, test.output, compare, tolerance):
+                verdict = "AC"
+            else:
+                verdict = "WA"
+            return CaseResult(
+                index=index,
+                verdict=verdict,
+                time=result.duration,
+                stdout=result.stdout,
+                stderr=result.stderr,
+            )
+
+        cases = await asyncio.gather(
+            *(run_case(index, test) for index, test in enumerate(tests))
+        )
+    return JudgeReport(cases=list(cases), wall_time=time.perf_counter() - start)
+
+
+async def _ensure_venv(context: SandboxContext, env: dict[str, str]) -> None:
+    """
+    サンドボックスに仮想環境がなければ作成します。
+    各テストケースが`uv run`で仮想環境の作成を奪い合い、その時間まで実行時間の上限に数えられないようにします。
+    """
+    if (context.sandbox / ".venv" / "bin" / "python").exists() or not shutil.which(
+        "uv"
+    ):
+        return
+    result = await run_command("uv sync", cwd=context.sandbox, env=env, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to create the virtual environment: {result.stderr}")
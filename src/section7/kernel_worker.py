@@ -0,0 +1,122 @@
+"""
+`PythonKernel`がサンドボックスの仮想環境のPythonで起動するワーカープロセス。
+サンドボックスの仮想環境には`src`がインストールされていないため、ファイルのパスを指定して実行し、標準ライブラリだけを使います。
+
+リクエストとレスポンスは、4バイトのビッグエンディアンの長さに続くJSONで、引数で渡されたファイルディスクリプタを通してやり取りします。
+実行するコードの標準入出力は、リクエストで指定されたファイルにファイルディスクリプタごと付け替えるので、
+サブプロセスやC拡張の出力も取りこぼしません。
+"""
+
+import importlib
+import json
+import os
+import runpy
+import struct
+import sys
+import traceback
+from typing import Any, BinaryIO
+
+HEADER = struct.Struct(">I")
+
+
+def read_frame(stream: BinaryIO) -> dict[str, Any] | None:
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    return json.loads(stream.read(length))
+
+
+def write_frame(stream: BinaryIO, message: dict[str, Any]) -> None:
+    data = json.dumps(message).encode()
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def preload(modules: list[str]) -> list[str]:
+    """
+    よく使うモジュールを事前にインポートし、インポートできたモジュールの名前を返します。
+    """
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            continue
+        loaded.append(name)
+    return loaded
+
+
+def redirect(stdin: str, stdout: str, stderr: str) -> None:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for fd, path, flags in [
+        (0, stdin, os.O_RDONLY),
+        (1, stdout, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+        (2, stderr, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+    ]:
+        opened = os.open(path, flags, 0o644)
+        os.dup2(opened, fd)
+        os.close(opened)
+    sys.stdin = open(0, encoding="utf-8", closefd=False)
+    sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", closefd=False)
+
+
+def run(request: dict[str, Any], baseline: set[str]) -> dict[str, Any]:
+    """
+    1つのリクエストを、新しい名前空間で実行します。
+    実行中にインポートされたモジュールは実行後に破棄するので、サンドボックスのファイルを編集すれば次の実行に反映されます。
+    """
+    argv = list(sys.argv)
+    path = list(sys.path)
+    redirect(request["stdin"], request["stdout"], request["stderr"])
+    returncode = 0
+    try:
+        os.chdir(request["cwd"])
+        importlib.invalidate_caches()
+        if request.get("path") is not None:
+            script = os.path.abspath(request["path"])
+            sys.argv = [script]
+            sys.path.insert(0, os.path.dirname(script))
+            runpy.run_path(script, run_name="__main__")
+        else:
+            sys.argv = ["-c"]
+            sys.path.insert(0, request["cwd"])
+            code = compile(request["code"], "<run_python>", "exec")
+            exec(code, {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        redirect(os.devnull, os.devnull, os.devnull)
+        sys.argv = argv
+        sys.path[:] = path
+        for name in set(sys.modules) - baseline:
+            del sys.modules[name]
+    return {"returncode": returncode}
+
+
+def main() -> None:
+    request_fd, response_fd = int(sys.argv[1]), int(sys.argv[2])
+    requests = os.fdopen(request_fd, "rb")
+    responses = os.fdopen(response_fd, "wb")
+    loaded = preload(sys.argv[3].split(",") if len(sys.argv) > 3 else [])
+    baseline = set(sys.modules)
+    write_frame(responses, {"preloaded": loaded, "pid": os.getpid()})
+    while (request := read_frame(requests)) is not None:
+        write_frame(responses, run(request, baseline))
+
+
+if __name__ == "__main__":
+    main()
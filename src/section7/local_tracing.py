@@ -0,0 +1,265 @@
+"""
+トレースをOpenAIのダッシュボードに送らず、ローカルのParquetファイルに保存するトレースプロセッサ。
+保存したトレースは`uv run python -m src.section7.local_tracing traces/`のように実行すると集計できます。
+
+```python
+enable_local_tracing(Path("traces"))
+with trace("Multi-turn conversation"):
+    ...
+```
+"""
+
+import argparse
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+from agents import add_trace_processor, set_trace_processors
+from agents.tracing import Span, Trace, TracingProcessor
+from loguru import logger
+
+SCHEMA = {
+    "trace_id": pl.String,
+    "workflow": pl.String,
+    "span_id": pl.String,
+    "parent_id": pl.String,
+    "span_type": pl.String,
+    "name": pl.String,
+    "started_at": pl.Datetime("us", "UTC"),
+    "duration_ms": pl.Float64,
+    "input_tokens": pl.Int64,
+    "output_tokens": pl.Int64,
+    "error": pl.String,
+}
+
+
+def _span_name(span: Span[Any]) -> str:
+    data = span.span_data
+    match data.type:
+        case "agent" | "function" | "custom" | "guardrail":
+            return str(getattr(data, "name", data.type))
+        case "generation":
+            return str(getattr(data, "model", None) or data.type)
+        case "response":
+            response = getattr(data, "response", None)
+            return str(getattr(response, "model", None) or data.type)
+        case "handoff":
+            return f"{getattr(data, 'from_agent', None)} -> {getattr(data, 'to_agent', None)}"
+        case _:
+            return data.type
+
+
+def _span_usage(span: Span[Any]) -> tuple[int | None, int | None]:
+    data = span.span_data
+    if data.type == "response":
+        usage = getattr(getattr(data, "response", None), "usage", None)
+        if usage is not None:
+            return usage.input_tokens, usage.output_tokens
+    if data.type == "generation":
+        usage = getattr(data, "usage", None) or {}
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    return None, None
+
+
+def _parse_time(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+class ParquetTraceProcessor(TracingProcessor):
+    """
+    終了したスパンをメモリに溜めておき、`batch_size`件ごとにParquetファイルとして書き出すプロセッサ。
+    書き出しはバックグラウンドのスレッドで行うので、エージェントの実行はファイルの書き込みを待ちません。
+    ファイルは追記せずに1回の書き出しごとに新しく作るので、`pl.scan_parquet`でまとめて読み込めます。
+    """
+
+    def __init__(self, root: Path, batch_size: int = 1000):
+        """
+        Args:
+            root (Path): Parquetファイルを保存するディレクトリ
+            batch_size (int): 1つのファイルにまとめるスパンの数
+        """
+        self.root = root
+        self.batch_size = batch_size
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._rows: list[dict[str, Any]] = []
+        self._workflows: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace")
+
+    def on_trace_start(self, trace: Trace) -> None:
+        with self._lock:
+            self._workflows[trace.trace_id] = trace.name
+
+    def on_trace_end(self, trace: Trace) -> None:
+        with self._lock:
+            self._workflows.pop(trace.trace_id, None)
+
+    def on_span_start(self, span: Span[Any]) -> None:
+        pass
+
+    def on_span_end(self, span: Span[Any]) -> None:
+        started_at = _parse_time(span.started_at)
+        ended_at = _parse_time(span.ended_at)
+        duration_ms = (
+            (ended_at - started_at).total_seconds() * 1000
+            if started_at is not None and ended_at is not None
+            else None
+        )
+        input_tokens, output_tokens = _span_usage(span)
+        error = span.error
+        with self._lock:
+            self._rows.append(
+                {
+                    "trace_id": span.trace_id,
+                    "workflow": self._workflows.get(span.trace_id),
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "span_type": span.span_data.type,
+                    "name": _span_name(span),
+                    "started_at": started_at,
+                    "duration_ms": duration_ms,
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "error": error["message"] if error else None,
+                }
+            )
+            if len(self._rows) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        try:
+            self._writer.submit(self._write, rows)
+        except RuntimeError:
+            # インタプリタの終了処理中はスレッドを使えないので、その場で書き出す
+            self._write(rows)
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        path = self.root / f"spans-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+        try:
+            pl.DataFrame(rows, schema=SCHEMA).write_parquet(path)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} spans to {path}: {e!r}")
+
+    def force_flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+        # 書き出しの完了を待つ
+        try:
+            self._writer.submit(lambda: None).result()
+        except RuntimeError:
+            pass
+
+    def shutdown(self) -> None:
+        self.force_flush()
+        self._writer.shutdown(wait=True)
+
+
+def enable_local_tracing(
+    root: Path, offline: bool = True, batch_size: int = 1000
+) -> ParquetTraceProcessor:
+    """
+    トレースをローカルに保存するよう設定します。
+
+    Args:
+        root (Path): Parquetファイルを保存するディレクトリ
+        offline (bool): Trueの場合、OpenAIのダッシュボードへの送信をやめてローカルにだけ保存します
+        batch_size (int): 1つのファイルにまとめるスパンの数
+    """
+    processor = ParquetTraceProcessor(root, batch_size=batch_size)
+    if offline:
+        set_trace_processors([processor])
+    else:
+        add_trace_processor(processor)
+    return processor
+
+
+def load_spans(root: Path) -> pl.DataFrame:
+    return pl.scan_parquet(root / "*.parquet").collect()
+
+
+def latency_report(spans: pl.DataFrame) -> pl.DataFrame:
+    """
+    スパンの種類ごとのレイテンシのパーセンタイルを返します。
+    """
+    duration = pl.col("duration_ms")
+    return (
+        spans.group_by("span_type")
+        .agg(
+            pl.len().alias("count"),
+            duration.quantile(0.5).alias("p50_ms"),
+            duration.quantile(0.95).alias("p95_ms"),
+            duration.quantile(0.99).alias("p99_ms"),
+            duration.sum().alias("total_ms"),
+        )
+        .sort("total_ms", descending=True)
+    )
+
+
+def slowest_tools(spans: pl.DataFrame, limit: int = 10) -> pl.DataFrame:
+    """
+    ツール（functionスパン）とサブプロセス（customスパン）を、p95のレイテンシが大きい順に返します。
+    """
+    duration = pl.col("duration_ms")
+    return (
+        spans.filter(pl.col("span_type").is_in(["function", "custom"]))
+        .group_by("span_type", "name")
+        .agg(
+            pl.len().alias("count"),
+            duration.quantile(0.5).alias("p50_ms"),
+            duration.quantile(0.95).alias("p95_ms"),
+            duration.max().alias("max_ms"),
+            pl.col("error").is_not_null().sum().alias("errors"),
+        )
+        .sort("p95_ms", descending=True)
+        .head(limit)
+    )
+
+
+def token_report(spans: pl.DataFrame) -> pl.DataFrame:
+    """
+    実行（トレース）ごとのトークン使用量と所要時間を返します。
+    """
+    return (
+        spans.group_by("trace_id", "workflow")
+        .agg(
+            pl.col("started_at").min().alias("started_at"),
+            pl.col("input_tokens").sum(),
+            pl.col("output_tokens").sum(),
+            pl.col("span_type").eq("function").sum().alias("tool_calls"),
+            pl.col("duration_ms")
+            .filter(pl.col("span_type") == "agent")
+            .sum()
+            .alias("agent_ms"),
+        )
+        .sort("started_at")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ローカルに保存したトレースを集計します。"
+    )
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    spans = load_spans(args.root)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, fmt_str_lengths=60):
+        print("Latency by span type")
+        print(latency_report(spans))
+        print("Slowest tools")
+        print(slowest_tools(spans, args.limit))
+        print("Token usage by run")
+        print(token_report(spans))
+
+
+if __name__ == "__main__":
+    main()
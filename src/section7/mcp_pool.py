@@ -0,0 +1,301 @@
+"""
+MCPサーバーのプロセスを起動したまま使い回すためのプール。
+リポジトリのルートで`uv run python -m src.section7.mcp_pool`のように実行すると、
+Pythonで書いた代替サーバーを使ってプールの動作を確認できます。
+"""
+
+import asyncio
+import sys
+from collections.abc import Callable
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+
+from agents.mcp import MCPServer, MCPServerStdio
+from loguru import logger
+from mcp.types import CallToolResult, TextContent
+from mcp.types import Tool as MCPTool
+
+# プールのサーバーが応答しているかを確認する間隔（秒）
+HEALTH_CHECK_INTERVAL = 30.0
+
+# サーバーの起動とヘルスチェックを待つ時間の上限（秒）
+SERVER_START_TIMEOUT = 60.0
+HEALTH_CHECK_TIMEOUT = 5.0
+
+# リポジトリのルート。代替サーバーを`python -m`で起動するときの作業ディレクトリ
+REPOSITORY_ROOT = Path(__file__).resolve().parents[2]
+
+
+def npx_filesystem_server(root: Path) -> MCPServerStdio:
+    """
+    `npx`で`@modelcontextprotocol/server-filesystem`を起動するサーバーを作ります。
+    """
+    return MCPServerStdio(
+        params={
+            "command": "npx",
+            "args": ["-y", "@modelcontextprotocol/server-filesystem", str(root)],
+        }
+    )
+
+
+def stand_in_filesystem_server(root: Path) -> MCPServerStdio:
+    """
+    Node.jsを使わずに、Pythonで書いた代替サーバー（`mcp_stand_in_server`）を起動するサーバーを作ります。
+    """
+    return MCPServerStdio(
+        params={
+            "command": sys.executable,
+            "args": ["-m", "src.section7.mcp_stand_in_server", str(root.resolve())],
+            "cwd": str(REPOSITORY_ROOT),
+        }
+    )
+
+
+class _Slot:
+    """
+    プールの中の1プロセス分の枠。
+    MCPServerStdioは接続したタスクと同じタスクで切断する必要があるので、
+    サーバーの起動から停止までを専用のタスク（`task`）の中で行います。
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.server: MCPServer | None = None
+        self.in_flight = 0
+        self.ready = asyncio.Event()
+        self.stop = asyncio.Event()
+        self.task: asyncio.Task[None] | None = None
+        self.restart_lock = asyncio.Lock()
+
+
+class MCPServerPool(MCPServer):
+    """
+    同じMCPサーバーを`size`個起動しておき、複数のエージェント・セッションからの呼び出しを振り分けるプール。
+    プール自体が`MCPServer`なので、`Agent(mcp_servers=[pool])`のようにそのまま渡せます。
+
+    - `connect`で一度起動したサーバーは`cleanup`まで起動したままにし、実行のたびに起動し直しません
+    - 呼び出しは実行中の呼び出しが最も少ないサーバーに振り分けます
+    - `list_tools`の結果はキャッシュします
+    - 定期的にサーバーの応答を確認し、落ちたサーバーは起動し直します
+
+    ```python
+    pool = MCPServerPool(lambda: npx_filesystem_server(Path("./mcp_sandbox")), size=2)
+    await pool.connect()
+    agent = Agent(name="Assistant", mcp_servers=[pool])
+    ```
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], MCPServer],
+        size: int = 2,
+        name: str = "mcp-pool",
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+    ):
+        """
+        Args:
+            factory (Callable[[], MCPServer]): 未接続のサーバーを作る関数
+            size (int): 起動しておくサーバーの数
+            name (str): プールの名前
+            health_check_interval (float): サーバーの応答を確認する間隔（秒）
+        """
+        super().__init__()
+        self.factory = factory
+        self.size = size
+        self._name = name
+        self.health_check_interval = health_check_interval
+        self.restarts = 0
+        self._slots = [_Slot(i) for i in range(size)]
+        self._tools: list[MCPTool] | None = None
+        self._health_task: asyncio.Task[None] | None = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def connect(self) -> None:
+        """
+        すべてのサーバーを起動します。すでに起動している場合は何もしません。
+        """
+        if self._health_task is not None:
+            return
+        results = await asyncio.gather(
+            *(self._start(slot) for slot in self._slots), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # 起動できたサーバーのプロセスが残らないように、すべて停止してから送出する
+            await asyncio.gather(*(self._stop(slot) for slot in self._slots))
+            raise errors[0]
+        self._health_task = asyncio.create_task(self._health_check_loop())
+        logger.info(f"MCP server pool {self.name} started with {self.size} servers")
+
+    async def cleanup(self) -> None:
+        """
+        すべてのサーバーを停止します。
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        await asyncio.gather(*(self._stop(slot) for slot in self._slots))
+
+    async def list_tools(self, *args: Any, **kwargs: Any) -> list[MCPTool]:
+        if self._tools is None:
+            slot = await self._pick()
+            assert slot.server is not None
+            self._tools = await slot.server.list_tools()
+        return self._tools
+
+    def invalidate_tools_cache(self) -> None:
+        self._tools = None
+
+    async def call_tool(
+        self, tool_name: str, arguments: dict[str, Any] | None, *args: Any
+    ) -> CallToolResult:
+        for attempt in range(2):
+            slot = await self._pick()
+            server = slot.server
+            assert server is not None
+            slot.in_flight += 1
+            try:
+                return await server.call_tool(tool_name, arguments)
+            except Exception as e:
+                # サーバーが生きていれば、リクエスト自体がエラーになっただけなのでそのまま返す。
+                # 待っている間にヘルスチェックで再起動済みの場合は、新しいサーバーでやり直す
+                restarted = slot.server is not server
+                if attempt == 1 or (not restarted and await self._is_healthy(slot)):
+                    raise
+                logger.warning(
+                    f"MCP server {self.name}[{slot.index}] failed on {tool_name}: {e!r}"
+                )
+                await self._restart(slot, server)
+            finally:
+                slot.in_flight -= 1
+        raise AssertionError("unreachable")
+
+    async def list_prompts(self, *args: Any, **kwargs: Any) -> Any:
+        server = (await self._pick()).server
+        assert server is not None
+        return await server.list_prompts(*args, **kwargs)
+
+    async def get_prompt(self, *args: Any, **kwargs: Any) -> Any:
+        server = (await self._pick()).server
+        assert server is not None
+        return await server.get_prompt(*args, **kwargs)
+
+    async def _pick(self) -> _Slot:
+        ready = [slot for slot in self._slots if slot.ready.is_set()]
+        if not ready:
+            # すべて再起動中の場合は、どれかが起動するまで待つ
+            waiters = [asyncio.create_task(slot.ready.wait()) for slot in self._slots]
+            try:
+                await asyncio.wait(
+                    waiters,
+                    timeout=SERVER_START_TIMEOUT,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            ready = [slot for slot in self._slots if slot.ready.is_set()]
+            if not ready:
+                raise RuntimeError(f"No MCP server in pool {self.name} is available")
+        return min(ready, key=lambda slot: slot.in_flight)
+
+    async def _run_slot(self, slot: _Slot) -> None:
+        server = self.factory()
+        try:
+            await server.connect()
+            slot.server = server
+            slot.ready.set()
+            await slot.stop.wait()
+        except Exception as e:
+            logger.error(f"MCP server {self.name}[{slot.index}] stopped: {e!r}")
+        finally:
+            slot.ready.clear()
+            with suppress(Exception):
+                await server.cleanup()
+
+    async def _start(self, slot: _Slot) -> None:
+        slot.stop = asyncio.Event()
+        slot.task = asyncio.create_task(self._run_slot(slot))
+        ready = asyncio.create_task(slot.ready.wait())
+        await asyncio.wait(
+            [ready, slot.task],
+            timeout=SERVER_START_TIMEOUT,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        ready.cancel()
+        if not slot.ready.is_set():
+            # 起動が終わらないまま時間切れになった場合は、起動中のプロセスを止める
+            slot.task.cancel()
+            await asyncio.gather(slot.task, return_exceptions=True)
+            raise RuntimeError(f"Failed to start MCP server {self.name}[{slot.index}]")
+
+    async def _stop(self, slot: _Slot) -> None:
+        slot.stop.set()
+        if slot.task is not None:
+            await asyncio.gather(slot.task, return_exceptions=True)
+        slot.server = None
+
+    async def _restart(self, slot: _Slot, failed: MCPServer | None) -> None:
+        async with slot.restart_lock:
+            # 同じサーバーの失敗で複数の呼び出しが待っていた場合、再起動は1回だけ行う
+            if failed is not None and slot.server is not failed:
+                return
+            logger.warning(f"Restarting MCP server {self.name}[{slot.index}]")
+            await self._stop(slot)
+            self.restarts += 1
+            await self._start(slot)
+
+    async def _is_healthy(self, slot: _Slot) -> bool:
+        if not slot.ready.is_set() or slot.server is None:
+            return False
+        session = getattr(slot.server, "session", None)
+        try:
+            async with asyncio.timeout(HEALTH_CHECK_TIMEOUT):
+                if session is not None:
+                    await session.send_ping()
+                else:
+                    await slot.server.list_tools()
+        except Exception as e:
+            logger.warning(f"MCP server {self.name}[{slot.index}] is unhealthy: {e!r}")
+            return False
+        return True
+
+    async def _health_check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for slot in self._slots:
+                if not await self._is_healthy(slot):
+                    try:
+                        await self._restart(slot, slot.server)
+                    except RuntimeError as e:
+                        logger.error(str(e))
+
+
+async def main():
+    root = Path("mcp_sandbox")
+    pool = MCPServerPool(lambda: stand_in_filesystem_server(root), size=2)
+    await pool.connect()
+    try:
+        tools = await pool.list_tools()
+        print(f"tools: {[tool.name for tool in tools]}")
+        results = await asyncio.gather(
+            *(pool.call_tool("server_pid", {}) for _ in range(8))
+        )
+        pids = {
+            content.text
+            for result in results
+            for content in result.content
+            if isinstance(content, TextContent)
+        }
+        print(f"8 calls served by processes: {sorted(pids)}")
+    finally:
+        await pool.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""
+`@modelcontextprotocol/server-filesystem`の代わりに使える、Pythonだけで動く小さなMCPサーバー。
+Node.jsがない環境でMCPサーバープールの動作を確認するために使います。
+`python -m src.section7.mcp_stand_in_server ./mcp_sandbox`のように、操作するディレクトリを指定して起動します。
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from mcp.server.fastmcp import FastMCP
+
+from src.section7.sandbox import SandboxContext
+
+mcp = FastMCP("stand-in-filesystem")
+context = SandboxContext(
+    sandbox=Path(sys.argv[1] if len(sys.argv) > 1 else ".").resolve()
+)
+
+
+@mcp.tool()
+def read_file(path: str) -> str:
+    """
+    ファイルの内容を読み取ります。
+    """
+    return context.resolve(path).read_text(encoding="utf-8")
+
+
+@mcp.tool()
+def write_file(path: str, content: str) -> str:
+    """
+    ファイルに内容を書き込みます。
+    """
+    file_path = context.resolve(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_text(content, encoding="utf-8")
+    return f"File {path} written successfully."
+
+
+@mcp.tool()
+def list_directory(path: str = ".") -> str:
+    """
+    ディレクトリ直下のファイルとディレクトリを列挙します。
+    """
+    return "\n".join(
+        f"[DIR] {entry.name}" if entry.is_dir() else f"[FILE] {entry.name}"
+        for entry in sorted(context.resolve(path).iterdir())
+    )
+
+
+@mcp.tool()
+def server_pid() -> int:
+    """
+    このサーバーのプロセスIDを返します。プールがどのプロセスに振り分けたかの確認に使います。
+    """
+    return os.getpid()
+
+
+if __name__ == "__main__":
+    context.sandbox.mkdir(parents=True, exist_ok=True)
+    mcp.run()
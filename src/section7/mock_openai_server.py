@@ -0,0 +1,224 @@
+"""
+OpenAIのResponses APIのレート制限を模擬するローカルのサーバー。
+モデルごとに直近`period`秒のリクエスト数とトークン数を数え、上限を超えたリクエストには`retry-after-ms`を付けて429を返します。
+レート制限のスケジューラの動作を、APIキーも料金もなしに確認するために使います。
+
+`mcp`が依存しているstarletteとuvicornで動きます。
+`python -m src.section7.mock_openai_server --port 8000`で単独で起動し、`base_url="http://127.0.0.1:8000/v1"`のクライアントから呼び出せます。
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+
+import uvicorn
+from pydantic import BaseModel
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from src.section7.rate_limiter import DEFAULT_LIMIT, RateLimit
+
+
+class ServerStats(BaseModel):
+    served: int = 0
+    rejected: int = 0
+
+
+class MockOpenAIServer:
+    """
+    `POST /v1/responses`だけを実装したサーバー。ストリーミングには対応していません。
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, RateLimit] | None = None,
+        default_limit: RateLimit = DEFAULT_LIMIT,
+        latency: float = 0.05,
+        output_tokens: int = 20,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Args:
+            limits (dict[str, RateLimit] | None): モデル名ごとに課す上限
+            default_limit (RateLimit): `limits`にないモデルの上限
+            latency (float): 1回の応答にかける秒数
+            output_tokens (int): 応答の出力トークン数
+            host (str): 待ち受けるホスト
+            port (int): 待ち受けるポート。0の場合は空いているポートを使います
+        """
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.stats = ServerStats()
+        # モデル名 -> 直近に受け付けたリクエストの(時刻, トークン数)
+        self._windows: defaultdict[str, deque[tuple[float, int]]] = defaultdict(deque)
+        self._ids = itertools.count()
+        self.app = Starlette(
+            routes=[Route("/v1/responses", self.responses, methods=["POST"])]
+        )
+        self._server = uvicorn.Server(
+            uvicorn.Config(
+                self.app,
+                host=host,
+                port=port,
+                log_level="warning",
+                # 待ち行列で待っている間にクライアントの接続が切られないようにする
+                timeout_keep_alive=60,
+            )
+        )
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset(self) -> None:
+        self.stats = ServerStats()
+        self._windows.clear()
+
+    def _check(self, model: str, tokens: int) -> float | None:
+        """
+        リクエストを受け付けられれば記録してNoneを、受け付けられなければ待つべき秒数を返します。
+        """
+        limit = self.limits.get(model, self.default_limit)
+        window = self._windows[model]
+        now = time.monotonic()
+        while window and window[0][0] <= now - limit.period:
+            window.popleft()
+        used = sum(count for _, count in window)
+        if len(window) < limit.requests and used + tokens <= limit.tokens:
+            window.append((now, tokens))
+            return None
+        # 古いリクエストが窓から外れて、空きができるまでの時間
+        freed = 0
+        for index, (start, count) in enumerate(window):
+            freed += count
+            if (
+                len(window) - index - 1 < limit.requests
+                and used - freed + tokens <= limit.tokens
+            ):
+                return start + limit.period - now
+        return limit.period
+
+    async def responses(self, request: Request) -> JSONResponse:
+        body = await request.json()
+        if body.get("stream"):
+            return _error(
+                400,
+                "Streaming is not supported by the mock server.",
+                "invalid_request_error",
+            )
+        model = body.get("model", "default")
+        # APIと同じく、入力の見込みと出力の上限の合計で数える
+        input_tokens = (
+            len(json.dumps(body.get("input", ""), ensure_ascii=False)) // 4
+            + len(body.get("instructions") or "") // 4
+        )
+        tokens = input_tokens + (body.get("max_output_tokens") or self.output_tokens)
+        retry_after = self._check(model, tokens)
+        if retry_after is not None:
+            self.stats.rejected += 1
+            return _error(
+                429,
+                f"Rate limit reached for {model}. Please try again in {retry_after:.3f}s.",
+                "requests",
+                code="rate_limit_exceeded",
+                headers={"retry-after-ms": str(int(retry_after * 1000))},
+            )
+        await asyncio.sleep(self.latency)
+        self.stats.served += 1
+        index = next(self._ids)
+        return JSONResponse(
+            {
+                "id": f"resp_{index}",
+                "object": "response",
+                "created_at": int(time.time()),
+                "model": model,
+                "status": "completed",
+                "output": [
+                    {
+                        "type": "message",
+                        "id": f"msg_{index}",
+                        "role": "assistant",
+                        "status": "completed",
+                        "content": [
+                            {"type": "output_text", "text": "OK", "annotations": []}
+                        ],
+                    }
+                ],
+                "parallel_tool_calls": True,
+                "tool_choice": "auto",
+                "tools": [],
+                "usage": {
+                    "input_tokens": input_tokens,
+                    "output_tokens": self.output_tokens,
+                    "total_tokens": input_tokens + self.output_tokens,
+                    "input_tokens_details": {"cached_tokens": 0},
+                    "output_tokens_details": {"reasoning_tokens": 0},
+                },
+            }
+        )
+
+    async def serve(self) -> None:
+        """
+        終了されるまでリクエストを受け付けます。
+        """
+        await self._server.serve()
+
+    async def __aenter__(self) -> "MockOpenAIServer":
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                # 起動に失敗した場合は例外をそのまま送出する
+                await self._task
+            await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self._server.should_exit = True
+        if self._task is not None:
+            await self._task
+
+
+def _error(
+    status: int,
+    message: str,
+    type: str,
+    code: str | None = None,
+    headers: dict[str, str] | None = None,
+) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"message": message, "type": type, "param": None, "code": code}},
+        status_code=status,
+        headers=headers,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="レート制限を模擬するOpenAI互換のサーバーを起動します。"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--requests", type=int, default=60, help="periodあたりのリクエスト数の上限"
+    )
+    parser.add_argument(
+        "--tokens", type=int, default=30_000, help="periodあたりのトークン数の上限"
+    )
+    parser.add_argument("--period", type=float, default=60.0)
+    args = parser.parse_args()
+    limit = RateLimit(requests=args.requests, tokens=args.tokens, period=args.period)
+    print(f"Listening on http://127.0.0.1:{args.port}/v1")
+    await MockOpenAIServer(default_limit=limit, port=args.port).serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
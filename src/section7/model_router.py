@@ -0,0 +1,407 @@
+"""
+ターンごとに使うモデルを選ぶモデルルーター。
+`RunConfig(model_provider=ModelRouter(...))`として渡すと、エージェントに設定されたモデル名の代わりに、
+ポリシーに従って選んだモデルで各ターンを実行します。
+
+- ツールの結果を受けて次の行動を決めるターンは安いモデル、最終回答は性能の高いモデルのように使い分けます
+- タイムアウトやレート制限で失敗したときは、同じルートの次のモデルで実行し直します
+- 一定時間応答がなければ次のモデルにも同じリクエストを送り、先に返ってきた応答を使います（ヘッジ）
+- ルートとモデルごとのレイテンシ・トークン数・料金を記録し、ポリシーの調整に使えるようにします
+"""
+
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+import openai
+from agents import Model, ModelProvider, ModelResponse, ModelSettings
+from agents.models.openai_provider import OpenAIProvider
+from loguru import logger
+from openai.types.responses import ResponseFunctionToolCall
+from pydantic import BaseModel
+
+# 100万トークンあたりの料金（USD）。入力・出力の順
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "o4-mini": (1.10, 4.40),
+}
+
+# 次のモデルで実行し直すエラー。それ以外のエラー（リクエストの内容の誤りなど）はそのまま送出する
+FALLBACK_ERRORS: tuple[type[BaseException], ...] = (
+    TimeoutError,
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class RoutingPolicy(BaseModel):
+    # ルート名 -> 使うモデルの優先順位。先頭のモデルが失敗したら次のモデルを使う
+    routes: dict[str, list[str]] = {
+        "fast": ["gpt-4.1-mini", "gpt-4.1-nano"],
+        "strong": ["gpt-4.1", "o4-mini"],
+    }
+    # ユーザーのメッセージを受けた最初のターン
+    default_route: str = "strong"
+    # ツールの結果を受けたターン
+    tool_result_route: str = "fast"
+    # 特定のツールの結果を受けたターン（ツール名 -> ルート名）
+    tool_routes: dict[str, str] = {}
+    # 安いルートのモデルが最終回答を返したときに、このルートで回答し直す。Noneの場合はそのまま使う
+    final_route: str | None = "strong"
+    # 1回の呼び出しのタイムアウト（秒）
+    timeout: float = 120.0
+    # この秒数が経っても応答がなければ次のモデルにも送る。Noneの場合はヘッジしない
+    hedge_after: float | None = 20.0
+
+    def select(self, input: str | list[Any]) -> str:
+        """
+        モデルへの入力の最後の項目から、このターンのルートを決めます。
+        """
+        if isinstance(input, str) or not input:
+            return self.default_route
+        last = input[-1]
+        if _get(last, "type") != "function_call_output":
+            return self.default_route
+        call_id = _get(last, "call_id")
+        name = next(
+            (
+                _get(item, "name")
+                for item in reversed(input)
+                if _get(item, "type") == "function_call"
+                and _get(item, "call_id") == call_id
+            ),
+            None,
+        )
+        return self.tool_routes.get(name or "", self.tool_result_route)
+
+
+def _get(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+class RouteStats(BaseModel):
+    calls: int = 0
+    errors: int = 0
+    # ヘッジで他のモデルが先に応答した呼び出しの数。取り消さずに最後まで実行し、使用量も記録する
+    lost: int = 0
+    # 呼び出し元がキャンセルされたため取り消した呼び出しの数
+    cancelled: int = 0
+    latencies: list[float] = []
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+
+    def add_usage(self, model: str, input_tokens: int, output_tokens: int) -> None:
+        input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += (
+            input_tokens * input_price + output_tokens * output_price
+        ) / 1_000_000
+
+    def summary(self) -> str:
+        latency = (
+            f"p50 {statistics.median(self.latencies):.2f}s, max {max(self.latencies):.2f}s"
+            if self.latencies
+            else "-"
+        )
+        return (
+            f"{self.calls} calls ({self.errors} errors, {self.lost} lost, "
+            f"{self.cancelled} cancelled), "
+            f"latency {latency}, tokens {self.input_tokens}/{self.output_tokens}, "
+            f"${self.cost:.4f}"
+        )
+
+
+class ModelRouter(ModelProvider):
+    """
+    ポリシーに従ってターンごとにモデルを選ぶプロバイダ。
+    エージェントのモデル名がルート名（`fast`など）の場合は、そのエージェントは常にそのルートを使います。
+    それ以外のモデル名は無視し、`RoutingPolicy.select`でルートを選びます。
+    """
+
+    def __init__(
+        self,
+        policy: RoutingPolicy | None = None,
+        provider: ModelProvider | None = None,
+    ):
+        """
+        Args:
+            policy (RoutingPolicy | None): ルーティングのポリシー
+            provider (ModelProvider | None): モデル名から実際のモデルを作るプロバイダ。Noneの場合はOpenAIのモデルを使います
+        """
+        self.policy = policy or RoutingPolicy()
+        self.provider = provider or OpenAIProvider()
+        # (ルート名, モデル名) -> 統計
+        self.stats: defaultdict[tuple[str, str], RouteStats] = defaultdict(RouteStats)
+        # 安いルートの最終回答を回答し直した回数
+        self.escalations = 0
+        # ヘッジで負けたあとも実行を続けている呼び出し
+        self._losers: set[asyncio.Task[ModelResponse]] = set()
+
+    def get_model(self, model_name: str | None) -> Model:
+        route = model_name if model_name in self.policy.routes else None
+        return RouterModel(self, route)
+
+    def summary(self) -> str:
+        lines = [
+            f"{route}/{model}: {stats.summary()}"
+            for (route, model), stats in sorted(self.stats.items())
+        ]
+        lines.append(f"escalations to final route: {self.escalations}")
+        return "\n".join(lines)
+
+    async def join(self) -> None:
+        """
+        ヘッジで負けて実行を続けている呼び出しの完了を待ちます。
+        `summary`の前に呼ぶと、それらの使用量と料金も含めて集計できます。
+        """
+        await asyncio.gather(*self._losers, return_exceptions=True)
+
+    async def _call(
+        self, route: str, call: Callable[[Model], Awaitable[ModelResponse]]
+    ) -> ModelResponse:
+        """
+        ルートのモデルを優先順に試し、最初に成功した応答を返します。
+        """
+        names = self.policy.routes[route]
+        pending: dict[asyncio.Task[ModelResponse], str] = {}
+        errors: list[BaseException] = []
+
+        def launch() -> None:
+            name = names[len(pending) + len(errors)]
+            pending[asyncio.create_task(self._timed(route, name, call))] = name
+
+        launch()
+        try:
+            while pending:
+                can_hedge = len(pending) + len(errors) < len(names)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.policy.hedge_after if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info(
+                        f"Hedging {route} request with {names[len(pending) + len(errors)]}"
+                    )
+                    launch()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except FALLBACK_ERRORS as e:
+                        logger.warning(f"{route}/{name} failed: {e!r}")
+                        errors.append(e)
+                        continue
+                    # 接続を切ってもAPIはリクエストの処理を続けて料金がかかるので、負けた呼び出しは取り消さずに
+                    # 最後まで実行し、ヘッジのコストとして使用量を記録する
+                    for loser, loser_name in pending.items():
+                        self.stats[(route, loser_name)].lost += 1
+                        self._losers.add(loser)
+                        loser.add_done_callback(self._finish_loser)
+                    pending.clear()
+                    return response
+                if not pending and len(errors) < len(names):
+                    launch()
+            raise errors[-1]
+        finally:
+            for task, name in pending.items():
+                task.cancel()
+                self.stats[(route, name)].cancelled += 1
+
+    def _finish_loser(self, task: asyncio.Task[ModelResponse]) -> None:
+        self._losers.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Hedged request failed after losing: {task.exception()!r}")
+
+    async def _timed(
+        self,
+        route: str,
+        name: str,
+        call: Callable[[Model], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        stats = self.stats[(route, name)]
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.policy.timeout):
+                response = await call(self.provider.get_model(name))
+        except FALLBACK_ERRORS:
+            stats.errors += 1
+            raise
+        stats.latencies.append(time.perf_counter() - start)
+        stats.add_usage(name, response.usage.input_tokens, response.usage.output_tokens)
+        return response
+
+
+class RouterModel(Model):
+    """
+    `ModelRouter`が返すモデル。呼び出されるたびにルートを選び、そのルートのモデルで実行します。
+    """
+
+    def __init__(self, router: ModelRouter, route: str | None):
+        self.router = router
+        self.route = route
+
+    async def get_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> ModelResponse:
+        def call(model: Model) -> Awaitable[ModelResponse]:
+            return model.get_response(
+                system_instructions,
+                input,
+                model_settings,
+                tools,
+                output_schema,
+                handoffs,
+                tracing,
+                **kwargs,
+            )
+
+        policy = self.router.policy
+        route = self.route or policy.select(input)
+        response = await self.router._call(route, call)
+        final_route = policy.final_route
+        if (
+            self.route is None
+            and final_route is not None
+            and route != final_route
+            and not any(
+                isinstance(item, ResponseFunctionToolCall) for item in response.output
+            )
+        ):
+            # 安いモデルがツールを呼ばずに回答した = 最終回答なので、性能の高いモデルで回答し直す
+            self.router.escalations += 1
+            response = await self.router._call(final_route, call)
+        return response
+
+    async def stream_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> AsyncIterator[Any]:
+        """
+        ストリーミングでは、最初のイベントが届く前に失敗した場合だけ次のモデルに切り替えます。
+        出力を表示し始めてからは切り替えられないため、ヘッジと最終回答のやり直しは行いません。
+        """
+        route = self.route or self.router.policy.select(input)
+        names = self.router.policy.routes[route]
+        for i, name in enumerate(names):
+            stats = self.router.stats[(route, name)]
+            stats.calls += 1
+            start = time.perf_counter()
+            stream = self.router.provider.get_model(name).stream_response(
+                system_instructions,
+                input,
+                model_settings,
+                tools,
+                output_schema,
+                handoffs,
+                tracing,
+                **kwargs,
+            )
+            try:
+                async with asyncio.timeout(self.router.policy.timeout):
+                    first = await anext(stream)
+            except FALLBACK_ERRORS as e:
+                stats.errors += 1
+                # 使わなくなったストリームを閉じて、HTTPの接続などを解放する
+                await stream.aclose()
+                if i == len(names) - 1:
+                    raise
+                logger.warning(f"{route}/{name} failed: {e!r}")
+                continue
+            try:
+                yield first
+                async for event in stream:
+                    if event.type == "response.completed" and event.response.usage:
+                        usage = event.response.usage
+                        stats.add_usage(name, usage.input_tokens, usage.output_tokens)
+                    yield event
+            finally:
+                # 呼び出し元が途中で読むのをやめた場合も閉じる
+                await stream.aclose()
+            stats.latencies.append(time.perf_counter() - start)
+            return
+
+
+async def main():
+    """
+    APIを呼ばずに、遅延やエラーを挟んだモデルでルーティングの動作を確認します。
+    `uv run python -m src.section7.model_router`で実行します。
+    """
+    from agents import Agent, RunConfig, Runner, function_tool
+
+    from src.section7.offline_model import (
+        FaultyModel,
+        MockModelProvider,
+        ScriptedModel,
+        ScriptedToolCall,
+        ScriptStep,
+    )
+
+    @function_tool
+    def think(thought: str) -> str:
+        """
+        考えを整理するためのツールです。
+        """
+        return thought
+
+    steps = [
+        ScriptStep(
+            tool_calls=[ScriptedToolCall(name="think", arguments={"thought": "..."})]
+        ),
+        ScriptStep(message="下書きの回答"),
+        ScriptStep(message="最終回答"),
+    ]
+    script = ScriptedModel(steps)
+    provider = MockModelProvider(
+        {
+            # 最初の呼び出しだけ、タイムアウトで失敗する
+            "gpt-4.1": FaultyModel(script, latency=0.05, errors=[TimeoutError()]),
+            "o4-mini": FaultyModel(script, latency=0.08),
+            # 応答が遅いので、ヘッジした2番目のモデルが先に返す。
+            # 負けたあとも最後まで実行されるので、台本を進めないように別の応答を返させる
+            "gpt-4.1-mini": FaultyModel(
+                ScriptedModel([ScriptStep(message="遅い回答")]), latency=1.0
+            ),
+            "gpt-4.1-nano": FaultyModel(script, latency=0.02),
+        }
+    )
+    router = ModelRouter(RoutingPolicy(hedge_after=0.2), provider)
+    agent = Agent(name="Assistant", instructions="...", model="gpt-4.1", tools=[think])
+    result = await Runner.run(
+        agent,
+        input="質問",
+        run_config=RunConfig(model_provider=router, tracing_disabled=True),
+    )
+    print(result.final_output)
+    await router.join()
+    print(router.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
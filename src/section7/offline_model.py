@@ -0,0 +1,259 @@
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any, Self
+
+from agents import Model, ModelProvider, ModelResponse, ModelSettings, Usage
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+from pydantic import BaseModel
+
+# ストリーミングで1回に送るテキストの文字数
+STREAM_CHUNK_CHARS = 4
+
+
+class ScriptedToolCall(BaseModel):
+    name: str
+    arguments: dict[str, Any] = {}
+
+
+class ScriptStep(BaseModel):
+    """
+    モデルの1回分の応答。`tool_calls`があればツールを呼び出し、なければ`message`を最終出力として返します。
+    """
+
+    tool_calls: list[ScriptedToolCall] = []
+    message: str = ""
+
+
+class ScriptedModel(Model):
+    """
+    あらかじめ用意した応答を順番に返すモデル。
+    OpenAI APIを呼ばずにエージェントのループを動かせるので、フレームワーク側のオーバーヘッドを計測できます。
+    応答は呼び出された順に返すので、同時に動かすセッションごとに別のインスタンスを使ってください。
+    """
+
+    def __init__(self, steps: list[ScriptStep], latency: float = 0.0):
+        """
+        Args:
+            steps (list[ScriptStep]): 返す応答の列
+            latency (float): 1回の応答にかける時間（秒）。APIの応答時間を模擬します。
+        """
+        self.steps = steps
+        self.latency = latency
+        self.calls = 0
+        # 各応答を返した時刻（time.perf_counter）。ツール呼び出しまでの時間の計測に使います
+        self.response_times: list[float] = []
+
+    @classmethod
+    def from_jsonl(cls, path: Path, latency: float = 0.0) -> Self:
+        with path.open() as f:
+            steps = [ScriptStep.model_validate_json(line) for line in f if line.strip()]
+        return cls(steps, latency=latency)
+
+    def next_step(self) -> ScriptStep:
+        if self.calls >= len(self.steps):
+            raise RuntimeError(f"Script exhausted after {len(self.steps)} responses")
+        step = self.steps[self.calls]
+        self.calls += 1
+        return step
+
+    async def get_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> ModelResponse:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        step = self.next_step()
+        output: list[Any]
+        if step.tool_calls:
+            output = [
+                ResponseFunctionToolCall(
+                    type="function_call",
+                    id=f"fc_{uuid.uuid4().hex}",
+                    call_id=f"call_{uuid.uuid4().hex}",
+                    name=call.name,
+                    arguments=json.dumps(call.arguments),
+                    status="completed",
+                )
+                for call in step.tool_calls
+            ]
+        else:
+            output = [
+                ResponseOutputMessage(
+                    type="message",
+                    id=f"msg_{uuid.uuid4().hex}",
+                    role="assistant",
+                    status="completed",
+                    content=[
+                        ResponseOutputText(
+                            type="output_text", text=step.message, annotations=[]
+                        )
+                    ],
+                )
+            ]
+        self.response_times.append(time.perf_counter())
+        return ModelResponse(output=output, usage=Usage(requests=1), response_id=None)
+
+    async def stream_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> AsyncIterator[Any]:
+        """
+        `get_response`と同じ応答を、テキストを`STREAM_CHUNK_CHARS`文字ずつのイベントに分けて返します。
+        イベントのフィールドはopenaiのバージョンによって異なるため、検証せずに作ります。
+        """
+        response = await self.get_response(
+            system_instructions,
+            input,
+            model_settings,
+            tools,
+            output_schema,
+            handoffs,
+            tracing,
+        )
+        sequence_number = 0
+        for output_index, item in enumerate(response.output):
+            if not isinstance(item, ResponseOutputMessage):
+                continue
+            for content_index, content in enumerate(item.content):
+                if not isinstance(content, ResponseOutputText):
+                    continue
+                for i in range(0, len(content.text), STREAM_CHUNK_CHARS):
+                    yield ResponseTextDeltaEvent.model_construct(
+                        type="response.output_text.delta",
+                        item_id=item.id,
+                        output_index=output_index,
+                        content_index=content_index,
+                        delta=content.text[i : i + STREAM_CHUNK_CHARS],
+                        logprobs=[],
+                        sequence_number=sequence_number,
+                    )
+                    sequence_number += 1
+        yield ResponseCompletedEvent.model_construct(
+            type="response.completed",
+            sequence_number=sequence_number,
+            response=Response(
+                id=f"resp_{uuid.uuid4().hex}",
+                created_at=time.time(),
+                model="scripted",
+                object="response",
+                output=response.output,
+                parallel_tool_calls=True,
+                tool_choice="auto",
+                tools=[],
+            ),
+        )
+
+
+class ScriptedModelProvider(ModelProvider):
+    """
+    モデル名によらず同じ`ScriptedModel`を返すプロバイダ。
+    `RunConfig(model_provider=...)`に渡すと、エージェントに設定されたモデル名を書き換えずにオフラインで実行できます。
+    """
+
+    def __init__(self, model: ScriptedModel):
+        self.model = model
+
+    def get_model(self, model_name: str | None) -> Model:
+        return self.model
+
+
+class FaultyModel(Model):
+    """
+    別のモデルの応答の前に、遅延やエラーを挟むモデル。
+    モデルのルーティングやフォールバックの動作をオフラインで確認するために使います。
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        latency: float = 0.0,
+        errors: list[BaseException] | None = None,
+    ):
+        """
+        Args:
+            model (Model): 応答を返すモデル。複数のFaultyModelで同じScriptedModelを共有できます
+            latency (float): 応答を返すまでに待つ時間（秒）
+            errors (list[BaseException] | None): 先頭から順に、呼び出しのたびに1つずつ送出するエラー
+        """
+        self.model = model
+        self.latency = latency
+        self.errors = list(errors or [])
+
+    async def _before_call(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        await self._before_call()
+        return await self.model.get_response(*args, **kwargs)
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        await self._before_call()
+        async for event in self.model.stream_response(*args, **kwargs):
+            yield event
+
+
+class MockModelProvider(ModelProvider):
+    """
+    モデル名ごとに用意したモデルを返すプロバイダ。
+    """
+
+    def __init__(self, models: dict[str, Model]):
+        self.models = models
+
+    def get_model(self, model_name: str | None) -> Model:
+        if model_name not in self.models:
+            raise KeyError(f"Unknown model: {model_name}")
+        return self.models[model_name]
+
+
+def script_from_responses(responses: list[ModelResponse]) -> list[ScriptStep]:
+    """
+    実際の実行結果（`RunResult.raw_responses`）から応答の列を作ります。
+    `ScriptedModel`に渡すと、APIを呼ばずに同じ実行を再生できます。
+    """
+    steps: list[ScriptStep] = []
+    for response in responses:
+        step = ScriptStep()
+        for item in response.output:
+            if isinstance(item, ResponseFunctionToolCall):
+                step.tool_calls.append(
+                    ScriptedToolCall(
+                        name=item.name, arguments=json.loads(item.arguments or "{}")
+                    )
+                )
+            elif isinstance(item, ResponseOutputMessage):
+                step.message += "".join(
+                    content.text
+                    for content in item.content
+                    if isinstance(content, ResponseOutputText)
+                )
+        steps.append(step)
+    return steps
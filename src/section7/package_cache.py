@@ -0,0 +1,196 @@
+"""
+サンドボックスで共有するパッケージのキャッシュ。
+すべてのサンドボックスの`uv`が同じキャッシュディレクトリとローカルのwheel置き場（wheelhouse）を使うように環境変数を設定するので、
+同じパッケージを何度も解決・ダウンロードせずに、キャッシュから各`.venv`へハードリンクでインストールできます。
+ネットワークのない評価環境では`offline=True`にして、事前に用意したwheelhouseだけからインストールします。
+
+```
+uv run python -m src.section7.package_cache uv.lock --root .cache/packages
+```
+
+キャッシュのハードリンクを使うため、キャッシュはサンドボックスと同じファイルシステム上に置いてください。
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import shlex
+import tempfile
+import time
+from pathlib import Path
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.command_runner import CommandResult, run_command
+
+# パッケージをインストールするコマンド
+INSTALL_COMMAND = re.compile(r"\buv\s+(add|sync|pip\s+install)\b")
+
+# uvが出力する「Resolved 3 packages in 12ms」のような行
+UV_SUMMARY = re.compile(
+    r"^\s*(Resolved|Prepared|Installed|Uninstalled|Audited) (\d+) packages?\b",
+    re.MULTILINE,
+)
+
+
+class InstallStats(BaseModel):
+    """
+    1つのセッションでのパッケージのインストールの記録。
+    uvはキャッシュにないパッケージだけをダウンロード・ビルドして「Prepared」と数えるので、
+    インストールしたパッケージのうちPreparedでないものをキャッシュヒットとみなします。
+    """
+
+    commands: int = 0
+    duration: float = 0.0
+    resolved: int = 0
+    prepared: int = 0
+    installed: int = 0
+
+    @property
+    def cache_hits(self) -> int:
+        return max(self.installed - self.prepared, 0)
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cache_hits / self.installed if self.installed else 0.0
+
+    def observe(self, result: CommandResult) -> None:
+        """
+        コマンドの実行結果がパッケージのインストールであれば記録します。
+        """
+        if not INSTALL_COMMAND.search(result.command):
+            return
+        self.commands += 1
+        self.duration += result.duration
+        for action, count in UV_SUMMARY.findall(result.stderr + result.stdout):
+            match action:
+                case "Resolved":
+                    self.resolved += int(count)
+                case "Prepared":
+                    self.prepared += int(count)
+                case "Installed":
+                    self.installed += int(count)
+
+    def summary(self) -> str:
+        return (
+            f"{self.commands} install commands in {self.duration:.1f}s, "
+            f"{self.installed} packages installed, "
+            f"cache hit ratio {self.hit_ratio:.1%} ({self.cache_hits} hits / {self.prepared} prepared)"
+        )
+
+
+class PackageCache:
+    """
+    サンドボックスで共有するuvのキャッシュとwheelhouse。
+    """
+
+    def __init__(self, root: Path, offline: bool = False):
+        """
+        Args:
+            root (Path): キャッシュを置くディレクトリ
+            offline (bool): Trueの場合はネットワークを使わず、キャッシュとwheelhouseだけからインストールします
+        """
+        self.root = root.resolve()
+        self.offline = offline
+        self.uv_cache = self.root / "uv"
+        self.wheelhouse = self.root / "wheels"
+        self.uv_cache.mkdir(parents=True, exist_ok=True)
+        self.wheelhouse.mkdir(parents=True, exist_ok=True)
+
+    def env(self, offline: bool | None = None) -> dict[str, str]:
+        """
+        サンドボックスで実行するuvに設定する環境変数を返します。
+        """
+        env = {
+            "UV_CACHE_DIR": str(self.uv_cache),
+            # キャッシュから.venvへはコピーせずにハードリンクでインストールする
+            "UV_LINK_MODE": "hardlink",
+            "UV_FIND_LINKS": str(self.wheelhouse),
+        }
+        if self.offline if offline is None else offline:
+            env |= {
+                "UV_OFFLINE": "1",
+                # PyPIを参照せず、wheelhouseだけから解決する
+                "UV_NO_INDEX": "1",
+                "UV_PYTHON_DOWNLOADS": "never",
+            }
+        return env
+
+    async def seed(self, lock_file: Path) -> None:
+        """
+        ロックファイル（uv.lockまたはrequirements.txt）のパッケージをwheelhouseにダウンロードし、uvのキャッシュにも展開しておきます。
+        ネットワークを使えるマシンで実行し、できたディレクトリを評価環境にコピーします。
+        """
+        start = time.perf_counter()
+        env = os.environ.copy() | self.env(offline=False)
+        if lock_file.name == "uv.lock":
+            result = await run_command(
+                "uv export --frozen --no-hashes --no-emit-project --format requirements-txt",
+                cwd=lock_file.parent.resolve(),
+                env=env,
+                max_buffer_bytes=4 * 1024 * 1024,
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to export {lock_file}: {result.stderr}")
+            requirements = result.stdout
+        else:
+            requirements = lock_file.read_text()
+        with tempfile.TemporaryDirectory() as directory:
+            requirements_path = Path(directory) / "requirements.txt"
+            requirements_path.write_text(requirements)
+            wheelhouse = shlex.quote(str(self.wheelhouse))
+            for command in [
+                f"uvx pip download --dest {wheelhouse} -r requirements.txt",
+                # 一時的な仮想環境にインストールして、キャッシュに展開済みのwheelを作っておく
+                "uv venv venv && uv pip install --python venv -r requirements.txt",
+            ]:
+                result = await run_command(
+                    command, cwd=Path(directory), env=env, timeout=1800
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"Failed to seed package cache: {result.stderr}")
+        logger.info(
+            f"Seeded {self.root} with {len(list(self.wheelhouse.iterdir()))} distributions "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+
+_cache: PackageCache | None = None
+
+
+def get_package_cache() -> PackageCache | None:
+    """
+    サンドボックスが使うパッケージのキャッシュを返します。設定されていない場合はNoneで、uvの既定のキャッシュを使います。
+    """
+    return _cache
+
+
+def set_package_cache(cache: PackageCache | None) -> None:
+    """
+    すべてのサンドボックスが使うパッケージのキャッシュを設定します。
+    """
+    global _cache
+    _cache = cache
+
+
+def package_cache_env() -> dict[str, str]:
+    """
+    設定されているパッケージのキャッシュを使うための環境変数を返します。
+    """
+    return _cache.env() if _cache is not None else {}
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="共有のパッケージキャッシュを準備します。"
+    )
+    parser.add_argument("lock_file", type=Path, help="uv.lockまたはrequirements.txt")
+    parser.add_argument("--root", type=Path, default=Path(".cache/packages"))
+    args = parser.parse_args()
+    await PackageCache(args.root).seed(args.lock_file)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
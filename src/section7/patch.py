@@ -0,0 +1,214 @@
+import difflib
+import os
+import re
+import stat
+import tempfile
+from pathlib import Path
+from typing import Self
+
+from pydantic import BaseModel
+
+# ハンクの位置がずれていた場合に前後を探索する最大行数
+MAX_HUNK_OFFSET = 50
+
+# diffの要約として返す最大行数
+MAX_SUMMARY_LINES = 40
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# 新しいファイルに付けるパーミッションの計算に使うumask。
+# 取得するには一度書き換えるしかなく、ツールを実行するスレッドと競合しないようimport時に1度だけ読む
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+class PatchError(RuntimeError):
+    """パッチを適用できなかったことを表す例外。"""
+
+
+class Hunk(BaseModel):
+    old_start: int
+    old_lines: list[str]
+    new_lines: list[str]
+    header: str
+
+
+def split_lines(text: str) -> list[str]:
+    """
+    文字列を改行（LFまたはCRLF）だけで行に分けます。
+    `str.splitlines`と違い、`\\x0c`や`\\x85`、`\\u2028`などの文字では分けません。
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line.removesuffix("\r") for line in lines]
+
+
+def parse_unified_diff(diff: str) -> list[Hunk]:
+    """
+    unified diff形式の文字列をハンクのリストに変換します。
+    `---`/`+++`のファイル名ヘッダーは無視するので、1ファイル分のdiffを渡してください。
+
+    Args:
+        diff (str): unified diff形式の文字列
+    """
+    hunks: list[Hunk] = []
+    current: Hunk | None = None
+    for line in split_lines(diff):
+        if line.startswith(("--- ", "+++ ", "diff ", "index ")) and current is None:
+            continue
+        match = HUNK_HEADER.match(line)
+        if match:
+            old_start = int(match.group(1))
+            # 変更前の行数が0のハンク（純粋な挿入）は「その行の後ろ」を指すので、1始まりの補正は不要
+            if match.group(2) != "0":
+                old_start -= 1
+            current = Hunk(old_start=old_start, old_lines=[], new_lines=[], header=line)
+            hunks.append(current)
+            continue
+        if current is None:
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        tag, text = (line[0], line[1:]) if line else (" ", "")
+        if tag == " ":
+            current.old_lines.append(text)
+            current.new_lines.append(text)
+        elif tag == "-":
+            current.old_lines.append(text)
+        elif tag == "+":
+            current.new_lines.append(text)
+        else:
+            raise PatchError(f"Unexpected line in hunk {current.header}: {line!r}")
+    if not hunks:
+        raise PatchError("No hunks found in the diff.")
+    return hunks
+
+
+def _find_hunk(lines: list[str], hunk: Hunk, expected: int) -> int:
+    """
+    ハンクの変更前の行が一致する位置を、期待位置に近い順に探します。
+    """
+    size = len(hunk.old_lines)
+    for offset in range(MAX_HUNK_OFFSET + 1):
+        for position in (expected - offset, expected + offset):
+            if (
+                0 <= position <= len(lines) - size
+                and lines[position : position + size] == hunk.old_lines
+            ):
+                return position
+    raise PatchError(
+        f"Hunk {hunk.header} does not match the file. "
+        "Context and removed lines must match the current content exactly; re-read the file and retry."
+    )
+
+
+def apply_hunks(lines: list[str], hunks: list[Hunk]) -> list[str]:
+    """
+    ハンクを順番に適用した結果を返します。元のリストは変更しません。
+
+    Args:
+        lines (list[str]): 改行を含まないファイルの各行
+        hunks (list[Hunk]): 適用するハンク
+    """
+    result = list(lines)
+    # 前のハンクで見つかった位置のずれと行数の増減を、後続ハンクの期待位置に反映する
+    delta = 0
+    for hunk in hunks:
+        position = _find_hunk(result, hunk, hunk.old_start + delta)
+        result[position : position + len(hunk.old_lines)] = hunk.new_lines
+        delta = position - hunk.old_start + len(hunk.new_lines) - len(hunk.old_lines)
+    return result
+
+
+def replace_range(
+    lines: list[str], start_line: int, end_line: int, content: str
+) -> list[str]:
+    """
+    `start_line`行目から`end_line`行目の手前までを`content`で置き換えた結果を返します（0から始まる）。
+    `start_line`と`end_line`が同じ場合は挿入になります。
+    """
+    if not 0 <= start_line <= end_line <= len(lines):
+        raise PatchError(
+            f"Invalid line range [{start_line}, {end_line}) for a file with {len(lines)} lines."
+        )
+    return lines[:start_line] + split_lines(content) + lines[end_line:]
+
+
+def atomic_write(path: Path, content: str) -> None:
+    """
+    一時ファイルに書き込んでからrenameすることで、ファイルをアトミックに置き換えます。
+    途中で失敗しても書きかけのファイルが残ることはありません。
+    `mkstemp`の一時ファイルは0600で作られるので、既存のファイルのパーミッションを引き継ぎ、
+    新しいファイルは`open`で作った場合と同じくumaskに従わせます。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        try:
+            mode = stat.S_IMODE(path.stat().st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(temp_name, mode)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+class TextLines(BaseModel):
+    """
+    改行コードと末尾の改行の有無を保ったまま、ファイルを行単位で扱うためのクラス。
+    すべての改行がCRLFのファイルはCRLFで、それ以外は`\\n`だけで行に分けるので、
+    変更しなかった行は単独の`\\r`などの文字も含めて元のまま書き戻されます。
+    """
+
+    lines: list[str]
+    newline: str = "\n"
+    trailing_newline: bool = True
+
+    @classmethod
+    def load(cls, path: Path) -> Self:
+        if not path.exists():
+            return cls(lines=[])
+        # 改行コードを変換せずに読む
+        with path.open(encoding="utf-8", newline="") as f:
+            text = f.read()
+        newline = (
+            "\r\n" if "\n" in text and text.count("\n") == text.count("\r\n") else "\n"
+        )
+        lines = text.split(newline)
+        trailing_newline = lines[-1] == ""
+        if trailing_newline:
+            lines.pop()
+        return cls(lines=lines, newline=newline, trailing_newline=trailing_newline)
+
+    def dump(self, lines: list[str]) -> str:
+        content = self.newline.join(lines)
+        if lines and self.trailing_newline:
+            content += self.newline
+        return content
+
+
+def diff_summary(path: str, old_lines: list[str], new_lines: list[str]) -> str:
+    """
+    変更内容をエージェント向けに短くまとめます。
+    """
+    diff = list(
+        difflib.unified_diff(
+            old_lines, new_lines, f"a/{path}", f"b/{path}", n=0, lineterm=""
+        )
+    )
+    added = sum(1 for line in diff[2:] if line.startswith("+"))
+    removed = sum(1 for line in diff[2:] if line.startswith("-"))
+    body = diff[2:]
+    if len(body) > MAX_SUMMARY_LINES:
+        body = body[:MAX_SUMMARY_LINES] + [
+            f"... ({len(diff) - 2 - MAX_SUMMARY_LINES} more diff lines)"
+        ]
+    return "\n".join([f"{path}: +{added} -{removed} lines", *body])
@@ -0,0 +1,421 @@
+"""
+サンドボックスの中で起動したままにしておくPythonのワーカープロセス（カーネル）。
+`uv run file.py`は実行のたびに依存関係の確認、インタプリタの起動、モジュールのインポートを行いますが、
+カーネルはこれらを起動時の1回だけ行い、以降はスクリプトを新しい名前空間で実行するだけなので、すぐに結果が返ります。
+
+```python
+result = await context.kernel.run(path="main.py", stdin="3 2\\n")
+```
+
+`uv run`との比較は`uv run python -m src.section7.python_kernel`で実行します。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.command_runner import (
+    KILL_GRACE_PERIOD,
+    CommandResult,
+    OutputBuffer,
+    run_command,
+)
+
+# ワーカーとして起動するスクリプト。サンドボックスの仮想環境のPythonでパスを指定して実行する
+WORKER_SCRIPT = Path(__file__).with_name("kernel_worker.py")
+
+# リクエストとレスポンスの先頭に付ける、JSONの長さ
+HEADER = struct.Struct(">I")
+
+# ワーカーの起動時にインポートしておくモジュール。インストールされていないものは無視する
+DEFAULT_PRELOAD = (
+    "bisect",
+    "collections",
+    "functools",
+    "heapq",
+    "itertools",
+    "json",
+    "math",
+    "re",
+    "numpy",
+)
+
+# 出力ファイルの大きさを確認する間隔（秒）
+OUTPUT_POLL_INTERVAL = 0.05
+
+# ワーカーの起動を待つ時間の上限（秒）。仮想環境がない場合は`uv run`が環境を作るのを待つ
+STARTUP_TIMEOUT = 300.0
+
+
+def sandbox_python(sandbox: Path) -> list[str]:
+    """
+    サンドボックスの仮想環境のPythonを起動するコマンドを返します。
+    `uv run`を経由しないので、依存関係の確認を待たずにすぐに起動します。
+    """
+    python = sandbox / ".venv" / "bin" / "python"
+    if python.exists():
+        return [str(python)]
+    if shutil.which("uv"):
+        # 仮想環境がまだない場合は、uvに作らせる
+        return ["uv", "run", "python"]
+    return [sys.executable]
+
+
+class KernelStats(BaseModel):
+    runs: int = 0
+    starts: int = 0
+    # 異常終了・タイムアウト・出力量の超過でワーカーを止めた回数
+    crashes: int = 0
+    # 実行回数の上限に達してワーカーを入れ替えた回数
+    recycles: int = 0
+    startup_times: list[float] = []
+
+
+class PythonKernel:
+    """
+    サンドボックスの仮想環境のPythonで起動したワーカーに、スクリプトやコードの実行を依頼するクラス。
+
+    - 実行は1つずつ順番に行い、実行するたびにモジュールの名前空間とインポートしたモジュールをリセットします
+    - 標準出力と標準エラー出力はファイルに書き出し、末尾の`max_buffer_bytes`バイトだけを返します
+    - ワーカーが異常終了した場合やタイムアウトした場合は、次の実行で新しいワーカーを起動します
+    - 前の実行の状態（グローバル変数の書き換えなど）が残らないよう、`max_runs`回実行するとワーカーを入れ替えます
+    """
+
+    def __init__(
+        self,
+        sandbox: Path,
+        env: dict[str, str] | None = None,
+        preload: tuple[str, ...] = DEFAULT_PRELOAD,
+        max_runs: int = 100,
+        max_buffer_bytes: int = 64 * 1024,
+        max_output_bytes: int = 16 * 1024 * 1024,
+    ):
+        """
+        Args:
+            sandbox (Path): コードを実行するサンドボックス
+            env (dict[str, str] | None): ワーカーの環境変数
+            preload (tuple[str, ...]): ワーカーの起動時にインポートしておくモジュール
+            max_runs (int): 1つのワーカーで実行する回数の上限
+            max_buffer_bytes (int): stdout/stderrそれぞれについて返す末尾のバイト数
+            max_output_bytes (int): stdoutとstderrの合計出力量の上限。超えた場合はワーカーを止めます
+        """
+        self.sandbox = sandbox
+        self.env = env
+        self.preload = preload
+        self.max_runs = max_runs
+        self.max_buffer_bytes = max_buffer_bytes
+        self.max_output_bytes = max_output_bytes
+        self.stats = KernelStats()
+        self._process: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.StreamReader | None = None
+        self._transport: asyncio.BaseTransport | None = None
+        self._request_fd: int | None = None
+        self._runs = 0
+        self._workdir: Path | None = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        """
+        ワーカーを起動し、事前のインポートが終わるまで待ちます。
+        """
+        if self._workdir is None:
+            # 入出力のファイルはエージェントから見えないよう、サンドボックスの外に置く
+            self._workdir = Path(tempfile.mkdtemp(prefix="python-kernel-"))
+        start = time.perf_counter()
+        request_read, request_write = os.pipe()
+        response_read, response_write = os.pipe()
+        log_path = self._workdir / "worker.log"
+        with log_path.open("wb") as log:
+            self._process = await asyncio.create_subprocess_exec(
+                *sandbox_python(self.sandbox),
+                str(WORKER_SCRIPT),
+                str(request_read),
+                str(response_write),
+                ",".join(self.preload),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=log,
+                cwd=self.sandbox,
+                env=self.env,
+                pass_fds=(request_read, response_write),
+                start_new_session=True,
+            )
+        os.close(request_read)
+        os.close(response_write)
+        self._request_fd = request_write
+        self._reader = asyncio.StreamReader()
+        self._transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(self._reader),
+            os.fdopen(response_read, "rb", buffering=0),
+        )
+        self._runs = 0
+        try:
+            async with asyncio.timeout(STARTUP_TIMEOUT):
+                hello = await self._read_frame()
+        except (asyncio.IncompleteReadError, TimeoutError):
+            await self._kill()
+            raise RuntimeError(
+                f"Failed to start Python kernel: {log_path.read_text(errors='replace')}"
+            ) from None
+        elapsed = time.perf_counter() - start
+        self.stats.starts += 1
+        self.stats.startup_times.append(elapsed)
+        logger.info(
+            f"Python kernel started in {self.sandbox} in {elapsed:.2f}s "
+            f"(pid {hello['pid']}, preloaded {', '.join(hello['preloaded'])})"
+        )
+
+    async def close(self) -> None:
+        """
+        ワーカーを終了し、入出力のファイルを削除します。
+        """
+        async with self._lock:
+            if self._process is not None:
+                # リクエストのパイプを閉じると、ワーカーは読み取りを終えて自分で終了する
+                os.close(self._request_fd)
+                self._request_fd = None
+                try:
+                    async with asyncio.timeout(KILL_GRACE_PERIOD):
+                        await self._process.wait()
+                except TimeoutError:
+                    pass
+                await self._kill()
+            if self._workdir is not None:
+                shutil.rmtree(self._workdir, ignore_errors=True)
+                self._workdir = None
+
+    async def run(
+        self,
+        path: str | None = None,
+        code: str | None = None,
+        stdin: str = "",
+        timeout: float = 120.0,
+    ) -> CommandResult:
+        """
+        スクリプトまたはコードを実行します。`path`と`code`のどちらか一方を指定します。
+
+        Args:
+            path (str | None): 実行するスクリプトのパス（サンドボックスからの相対パスまたは絶対パス）
+            code (str | None): 実行するコード
+            stdin (str): 標準入力に渡す内容
+            timeout (float): 実行時間の上限（秒）。超えた場合はワーカーを止めます
+        """
+        if (path is None) == (code is None):
+            raise ValueError("Specify either path or code.")
+        async with self._lock:
+            if self._process is None:
+                await self.start()
+            assert self._workdir is not None
+            run_id = uuid.uuid4().hex[:12]
+            files = {
+                name: self._workdir / f"{run_id}.{name}"
+                for name in ("stdin", "stdout", "stderr")
+            }
+            files["stdin"].write_text(stdin)
+            command = f"run_python {path}" if path is not None else "run_python <code>"
+            start = time.perf_counter()
+            self._write_frame(
+                {
+                    "path": path,
+                    "code": code,
+                    "cwd": str(self.sandbox),
+                    **{name: str(file) for name, file in files.items()},
+                }
+            )
+            returncode, timed_out, output_limit_exceeded = await self._wait(
+                files["stdout"], files["stderr"], timeout
+            )
+            duration = time.perf_counter() - start
+            self.stats.runs += 1
+            self._runs += 1
+            if returncode is None or self._process.returncode is not None:
+                if timed_out:
+                    logger.warning(
+                        f"Python kernel timed out after {timeout}s: {command}"
+                    )
+                self.stats.crashes += 1
+                await self._kill()
+                returncode = returncode if returncode is not None else -signal.SIGKILL
+            elif self._runs >= self.max_runs:
+                self.stats.recycles += 1
+                await self._kill()
+            result = CommandResult(
+                command=command,
+                returncode=returncode,
+                stdout=self._read_output(files["stdout"]),
+                stderr=self._read_output(files["stderr"]),
+                timed_out=timed_out,
+                output_limit_exceeded=output_limit_exceeded,
+                duration=duration,
+            )
+            for file in files.values():
+                file.unlink(missing_ok=True)
+            return result
+
+    async def _wait(
+        self, stdout: Path, stderr: Path, timeout: float
+    ) -> tuple[int | None, bool, bool]:
+        """
+        レスポンスを待ち、(終了コード, タイムアウトしたか, 出力量を超えたか)を返します。
+        ワーカーが異常終了した場合は、ワーカーの終了コードを返します。
+        """
+        response = asyncio.ensure_future(self._read_frame())
+        watcher = asyncio.ensure_future(self._watch_output(stdout, stderr))
+        try:
+            done, _ = await asyncio.wait(
+                {response, watcher},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            watcher.cancel()
+            response.cancel()
+        if response in done:
+            try:
+                return response.result()["returncode"], False, False
+            except asyncio.IncompleteReadError:
+                assert self._process is not None
+                return await self._process.wait(), False, False
+        if watcher in done:
+            return None, False, True
+        return None, True, False
+
+    async def _watch_output(self, stdout: Path, stderr: Path) -> None:
+        while True:
+            await asyncio.sleep(OUTPUT_POLL_INTERVAL)
+            size = sum(
+                path.stat().st_size for path in (stdout, stderr) if path.exists()
+            )
+            if size > self.max_output_bytes:
+                return
+
+    def _read_output(self, path: Path) -> str:
+        buffer = OutputBuffer(self.max_buffer_bytes)
+        if path.exists():
+            with path.open("rb") as f:
+                while data := f.read(self.max_buffer_bytes):
+                    buffer.append(data)
+        return buffer.getvalue()
+
+    def _write_frame(self, message: dict[str, Any]) -> None:
+        assert self._request_fd is not None
+        data = json.dumps(message).encode()
+        view = memoryview(HEADER.pack(len(data)) + data)
+        # ワーカーは次のリクエストを待っている状態なので、パイプが詰まることはない
+        while view:
+            view = view[os.write(self._request_fd, view) :]
+
+    async def _read_frame(self) -> dict[str, Any]:
+        assert self._reader is not None
+        (length,) = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+        return json.loads(await self._reader.readexactly(length))
+
+    async def _kill(self) -> None:
+        process = self._process
+        if process is None:
+            return
+        if process.returncode is None:
+            try:
+                # 実行したコードが起動した子プロセスもまとめて止める
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await process.wait()
+        if self._request_fd is not None:
+            os.close(self._request_fd)
+        if self._transport is not None:
+            self._transport.close()
+        self._process = None
+        self._reader = None
+        self._transport = None
+        self._request_fd = None
+
+
+BENCHMARK_SOLUTION = """\
+import sys
+from collections import Counter
+
+n, m = map(int, input().split())
+a = list(map(int, sys.stdin.read().split()))
+counts = Counter(a)
+print(sum(1 for k in range(1, m + 1) if counts[k]))
+"""
+
+
+async def _measure(
+    name: str, runs: int, func: Callable[[], Awaitable[CommandResult]]
+) -> None:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await func()
+        latencies.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{name} failed: {result.to_tool_output()}")
+    latencies.sort()
+    print(
+        f"{name:24s} p50 {statistics.median(latencies) * 1000:8.1f}ms "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.1f}ms"
+    )
+
+
+async def main():
+    """
+    同じ解答を`uv run`、仮想環境のPythonの直接実行、カーネルの3通りで繰り返し実行し、レイテンシを比べます。
+    """
+    from src.section7.sandbox import SandboxContext
+
+    parser = argparse.ArgumentParser(
+        description="カーネルとuv runの実行時間を比べます。"
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        context = SandboxContext.initialize(Path(directory) / "sandbox")
+        result = await run_command(
+            "uv sync", cwd=context.sandbox, env=context.command_env(), timeout=300
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to sync sandbox: {result.stderr}")
+        context.resolve("main.py").write_text(BENCHMARK_SOLUTION)
+        stdin = "5 3\n" + " ".join(str(i % 4) for i in range(100_000)) + "\n"
+        context.resolve("input.txt").write_text(stdin)
+
+        def shell(command: str) -> Callable[[], Awaitable[CommandResult]]:
+            return lambda: run_command(
+                command, cwd=context.sandbox, env=context.command_env()
+            )
+
+        await _measure("uv run", args.runs, shell("uv run main.py < input.txt"))
+        await _measure(
+            ".venv/bin/python", args.runs, shell(".venv/bin/python main.py < input.txt")
+        )
+        await context.kernel.start()
+        await _measure(
+            "kernel", args.runs, lambda: context.kernel.run(path="main.py", stdin=stdin)
+        )
+        print(
+            f"kernel startup: {context.kernel.stats.startup_times[0] * 1000:.1f}ms "
+            "(once per worker)"
+        )
+        await context.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
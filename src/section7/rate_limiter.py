@@ -0,0 +1,536 @@
+"""
+プロセス全体で共有する、モデル呼び出しのスケジューラ。
+多数のエージェントを`asyncio.gather`で同時に動かすと、APIのレート制限（429）に当たった呼び出しが一斉にリトライして、また制限に当たります。
+スケジューラはモデルごとにリクエスト数とトークン数のトークンバケットを持ち、上限を超えないペースで呼び出しを送り出します。
+
+- 待っている呼び出しは優先度（`interactive`が`batch`より先）と到着順に並べ、先頭から送り出します
+- 429を受けたら、そのモデルへの送り出しを`retry-after`の間止めてから、ジッター付きの指数バックオフでリトライします
+- モデルと優先度ごとに、待ち行列の長さと待ち時間、リトライの回数を記録します
+
+```python
+provider = ScheduledModelProvider(priority="batch")
+result = await Runner.run(agent, input, run_config=RunConfig(model_provider=provider))
+```
+
+`python -m src.section7.rate_limiter`で、制限を模擬するローカルのサーバーに対して動作を確認できます。
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import statistics
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any, Literal, TypeVar
+
+import openai
+from agents import Model, ModelProvider, ModelResponse, ModelSettings
+from agents.models.openai_provider import OpenAIProvider
+from loguru import logger
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+Priority = Literal["interactive", "batch"]
+PRIORITY_ORDER: dict[str, int] = {"interactive": 0, "batch": 1}
+
+# リトライする例外。429のほか、一時的な接続エラーとサーバーエラー
+RETRY_ERRORS: tuple[type[BaseException], ...] = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# 出力の上限（max_tokens）が指定されていないときに、1回の応答で見込んでおく出力トークン数
+DEFAULT_OUTPUT_TOKENS = 1024
+
+
+class RateLimit(BaseModel):
+    # `period`秒あたりのリクエスト数とトークン数（入力と出力の合計）の上限
+    requests: int
+    tokens: int
+    period: float = 60.0
+
+
+# モデルごとの上限。アカウントのティアに合わせて`RequestScheduler`に渡す値を調整する
+DEFAULT_LIMITS: dict[str, RateLimit] = {
+    "gpt-4.1": RateLimit(requests=500, tokens=30_000),
+    "gpt-4.1-mini": RateLimit(requests=500, tokens=200_000),
+    "gpt-4.1-nano": RateLimit(requests=500, tokens=200_000),
+    "o4-mini": RateLimit(requests=500, tokens=200_000),
+}
+DEFAULT_LIMIT = RateLimit(requests=500, tokens=30_000)
+
+
+class TokenBucket:
+    """
+    `capacity`まで貯まり、1秒あたり`rate`ずつ補充されるトークンバケット。
+    実際の使用量が見込みより多かった場合は残量が負になり、その分だけ次の送り出しが遅れます。
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        `amount`を取り出せるようになるまでの秒数を返します。
+        """
+        self._refill()
+        # 上限より大きな呼び出しも、バケットが満杯になれば送り出す
+        amount = min(amount, self.capacity)
+        return max(amount - self.tokens, 0.0) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def give(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class QueueStats(BaseModel):
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    max_queue_depth: int = 0
+    wait_times: list[float] = []
+
+    def summary(self) -> str:
+        if self.wait_times:
+            waits = sorted(self.wait_times)
+            p95 = waits[max(int(len(waits) * 0.95) - 1, 0)]
+            wait = f"wait p50 {statistics.median(waits):.2f}s, p95 {p95:.2f}s"
+        else:
+            wait = "wait -"
+        return (
+            f"{self.requests} requests, {self.retries} retries "
+            f"({self.rate_limited} rate limited), max queue depth {self.max_queue_depth}, {wait}"
+        )
+
+
+class _Waiter:
+    def __init__(self, priority: Priority, seq: int, tokens: int):
+        self.key = (PRIORITY_ORDER[priority], seq)
+        self.priority = priority
+        self.tokens = tokens
+        self.future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+
+class _ModelQueue:
+    def __init__(self, limit: RateLimit):
+        self.requests = TokenBucket(limit.requests, limit.requests / limit.period)
+        self.tokens = TokenBucket(limit.tokens, limit.tokens / limit.period)
+        self.waiters: list[_Waiter] = []
+        # 429を受けたときに、この時刻まで送り出しを止める
+        self.paused_until = 0.0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class RequestScheduler:
+    """
+    モデルごとのレート制限を守って、呼び出しを優先度順に送り出すスケジューラ。
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, RateLimit] | None = None,
+        default_limit: RateLimit = DEFAULT_LIMIT,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        """
+        Args:
+            limits (dict[str, RateLimit] | None): モデル名ごとの上限。Noneの場合は`DEFAULT_LIMITS`を使います
+            default_limit (RateLimit): `limits`にないモデルの上限
+            max_retries (int): 1回の呼び出しでリトライする回数の上限
+            base_delay (float): バックオフの基準の秒数。n回目のリトライは0から`base_delay * 2**n`秒の間で待ちます
+            max_delay (float): バックオフの上限（秒）
+        """
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.default_limit = default_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # (モデル名, 優先度) -> 統計
+        self.stats: defaultdict[tuple[str, str], QueueStats] = defaultdict(QueueStats)
+        self._queues: dict[str, _ModelQueue] = {}
+        self._seq = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        if model not in self._queues:
+            self._queues[model] = _ModelQueue(
+                self.limits.get(model, self.default_limit)
+            )
+        return self._queues[model]
+
+    def queue_depth(self, model: str) -> int:
+        return len(self._queue(model).waiters)
+
+    async def acquire(self, model: str, tokens: int, priority: Priority) -> None:
+        """
+        呼び出しを送り出せるようになるまで待ち、リクエスト数と`tokens`をバケットから取り出します。
+        """
+        queue = self._queue(model)
+        waiter = _Waiter(priority, next(self._seq), tokens)
+        heapq.heappush(queue.waiters, waiter)
+        stats = self.stats[(model, priority)]
+        stats.max_queue_depth = max(stats.max_queue_depth, len(queue.waiters))
+        self._dispatch(queue)
+        await waiter.future
+        stats.requests += 1
+        stats.wait_times.append(time.monotonic() - waiter.enqueued)
+
+    def adjust(self, model: str, reserved: int, actual: int) -> None:
+        """
+        見込みで取り出したトークン数を、実際の使用量に合わせて補正します。
+        """
+        queue = self._queue(model)
+        if actual > reserved:
+            queue.tokens.take(actual - reserved)
+        else:
+            queue.tokens.give(reserved - actual)
+            self._dispatch(queue)
+
+    def backoff(
+        self, model: str, priority: Priority, error: BaseException, attempt: int
+    ) -> float:
+        """
+        失敗した呼び出しをリトライするまでの秒数を返します。
+        429の場合は、同じモデルを待っている他の呼び出しも同じ時間だけ止め、一斉にリトライしないようにします。
+        """
+        stats = self.stats[(model, priority)]
+        stats.retries += 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if isinstance(error, openai.RateLimitError):
+            stats.rate_limited += 1
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.base_delay)
+            queue = self._queue(model)
+            queue.paused_until = max(queue.paused_until, time.monotonic() + delay)
+        return delay
+
+    async def call(
+        self,
+        model: str,
+        tokens: int,
+        priority: Priority,
+        func: Callable[[], Awaitable[T]],
+        usage: Callable[[T], int],
+    ) -> T:
+        """
+        レート制限を守って`func`を呼び出し、一時的なエラーはバックオフしてリトライします。
+
+        Args:
+            model (str): モデル名
+            tokens (int): 見込みのトークン数
+            priority (Priority): 優先度
+            func (Callable[[], Awaitable[T]]): APIを呼び出す関数
+            usage (Callable[[T], int]): 結果から実際に使ったトークン数を取り出す関数
+        """
+        for attempt in itertools.count():
+            await self.acquire(model, tokens, priority)
+            try:
+                result = await func()
+            except RETRY_ERRORS as e:
+                # 失敗した呼び出しの見込みのトークンを返し、リトライのたびに二重に数えないようにする
+                self.adjust(model, tokens, 0)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(model, priority, e, attempt)
+                logger.warning(f"{model} call failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.adjust(model, tokens, usage(result))
+            return result
+        raise AssertionError("unreachable")
+
+    def summary(self) -> str:
+        return "\n".join(
+            f"{model}/{priority}: {stats.summary()}"
+            for (model, priority), stats in sorted(self.stats.items())
+        )
+
+    def _dispatch(self, queue: _ModelQueue) -> None:
+        """
+        待ち行列の先頭から、バケットに残量がある限り送り出します。
+        残量が足りなければ、足りるようになる時刻に自分自身を呼び直します。
+        """
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        while queue.waiters:
+            waiter = queue.waiters[0]
+            if waiter.future.done():
+                # 待っている間にキャンセルされた呼び出し
+                heapq.heappop(queue.waiters)
+                continue
+            wait = max(
+                queue.paused_until - time.monotonic(),
+                queue.requests.wait_time(1),
+                queue.tokens.wait_time(waiter.tokens),
+            )
+            if wait > 0:
+                queue.timer = asyncio.get_running_loop().call_later(
+                    wait, self._dispatch, queue
+                )
+                return
+            heapq.heappop(queue.waiters)
+            queue.requests.take(1)
+            queue.tokens.take(min(waiter.tokens, queue.tokens.capacity))
+            waiter.future.set_result(None)
+
+
+def _retry_after(error: openai.APIStatusError) -> float | None:
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def estimate_tokens(
+    system_instructions: str | None, input: Any, model_settings: ModelSettings
+) -> int:
+    """
+    呼び出しで使うトークン数を見込みます。APIの制限と同じく、入力の見込みに出力の上限を足します。
+    """
+    text = json.dumps(input, ensure_ascii=False, default=str)
+    characters = len(text) + len(system_instructions or "")
+    # 英語ではおよそ4文字で1トークン。日本語はもっと多くなるが、応答後に実際の使用量で補正する
+    return characters // 4 + (model_settings.max_tokens or DEFAULT_OUTPUT_TOKENS)
+
+
+class ScheduledModel(Model):
+    """
+    `RequestScheduler`を通してモデルを呼び出すラッパー。
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        name: str,
+        priority: Priority,
+        scheduler: RequestScheduler,
+    ):
+        self.model = model
+        self.name = name
+        self.priority = priority
+        self.scheduler = scheduler
+
+    async def get_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> ModelResponse:
+        return await self.scheduler.call(
+            self.name,
+            estimate_tokens(system_instructions, input, model_settings),
+            self.priority,
+            lambda: self.model.get_response(
+                system_instructions,
+                input,
+                model_settings,
+                tools,
+                output_schema,
+                handoffs,
+                tracing,
+                **kwargs,
+            ),
+            lambda response: response.usage.total_tokens,
+        )
+
+    async def stream_response(
+        self,
+        system_instructions: str | None,
+        input: Any,
+        model_settings: ModelSettings,
+        tools: list[Any],
+        output_schema: Any,
+        handoffs: list[Any],
+        tracing: Any,
+        **kwargs: Any,
+    ) -> AsyncIterator[Any]:
+        """
+        ストリーミングでは、最初のイベントが届く前に失敗した場合だけリトライします。
+        """
+        tokens = estimate_tokens(system_instructions, input, model_settings)
+        for attempt in itertools.count():
+            await self.scheduler.acquire(self.name, tokens, self.priority)
+            stream = self.model.stream_response(
+                system_instructions,
+                input,
+                model_settings,
+                tools,
+                output_schema,
+                handoffs,
+                tracing,
+                **kwargs,
+            )
+            try:
+                first = await anext(stream)
+            except RETRY_ERRORS as e:
+                # 使わなくなったストリームを閉じ、見込みのトークンも返す
+                await stream.aclose()
+                self.scheduler.adjust(self.name, tokens, 0)
+                if attempt >= self.scheduler.max_retries:
+                    raise
+                await asyncio.sleep(
+                    self.scheduler.backoff(self.name, self.priority, e, attempt)
+                )
+                continue
+            try:
+                yield first
+                async for event in stream:
+                    if event.type == "response.completed" and event.response.usage:
+                        self.scheduler.adjust(
+                            self.name, tokens, event.response.usage.total_tokens
+                        )
+                    yield event
+            finally:
+                # 呼び出し元が途中で読むのをやめた場合も閉じる
+                await stream.aclose()
+            return
+
+
+_scheduler: RequestScheduler | None = None
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """
+    プロセス全体で共有するスケジューラを返します。設定されていない場合は`DEFAULT_LIMITS`で作成します。
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler()
+    return _scheduler
+
+
+def set_request_scheduler(scheduler: RequestScheduler) -> None:
+    """
+    プロセス全体で共有するスケジューラを差し替えます。
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+
+class ScheduledModelProvider(ModelProvider):
+    """
+    すべてのモデル呼び出しを、プロセス全体で共有する`RequestScheduler`に通すプロバイダ。
+    対話的なセッションは`interactive`、バッチ評価は`batch`のように、優先度ごとにインスタンスを作ります。
+    """
+
+    def __init__(
+        self,
+        priority: Priority = "interactive",
+        provider: ModelProvider | None = None,
+        scheduler: RequestScheduler | None = None,
+    ):
+        """
+        Args:
+            priority (Priority): このプロバイダから呼び出すときの優先度
+            provider (ModelProvider | None): 実際のモデルを作るプロバイダ。
+                Noneの場合はOpenAIのモデルを使い、リトライはスケジューラに任せるためクライアント自身のリトライは無効にします
+            scheduler (RequestScheduler | None): Noneの場合はプロセス全体で共有するスケジューラを使います
+        """
+        self.priority = priority
+        self._provider = provider
+        self._scheduler = scheduler
+
+    def get_model(self, model_name: str | None) -> Model:
+        if self._provider is None:
+            # APIキーの読み込みを待つため、クライアントは最初に使うときに作る
+            self._provider = OpenAIProvider(
+                openai_client=openai.AsyncOpenAI(max_retries=0)
+            )
+        return ScheduledModel(
+            self._provider.get_model(model_name),
+            model_name or "default",
+            self.priority,
+            self._scheduler or get_request_scheduler(),
+        )
+
+
+async def main():
+    """
+    制限を模擬するローカルのサーバーに、多数のエージェントを同時に実行します。
+    スケジューラを通さない場合と通した場合で、429の回数と完了までの時間を比べます。
+    """
+    from agents import Agent, RunConfig, Runner
+
+    from src.section7.mock_openai_server import MockOpenAIServer
+
+    limit = RateLimit(requests=20, tokens=20_000, period=5.0)
+    async with MockOpenAIServer(limits={"gpt-4.1": limit}) as server:
+        client = openai.AsyncOpenAI(base_url=server.base_url, api_key="mock")
+        agent = Agent(
+            name="Assistant", instructions="短く答えてください。", model="gpt-4.1"
+        )
+
+        async def run_all(providers: list[ModelProvider], label: str) -> None:
+            server.reset()
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(
+                    Runner.run(
+                        agent,
+                        f"質問{i}",
+                        run_config=RunConfig(
+                            model_provider=providers[i % len(providers)],
+                            tracing_disabled=True,
+                        ),
+                    )
+                    for i in range(60)
+                ),
+                return_exceptions=True,
+            )
+            failed = sum(isinstance(result, Exception) for result in results)
+            print(
+                f"{label}: {time.perf_counter() - start:.1f}s, {failed} failed, "
+                f"{server.stats.rejected} rate limited by server"
+            )
+
+        # SDKの既定の動作：クライアントが2回までリトライし、429を受けた呼び出しが一斉にやり直す
+        await run_all([OpenAIProvider(openai_client=client)], "without scheduler")
+
+        # 6回に1回は対話的なセッションからの呼び出しとして、バッチより先に送り出す
+        scheduler = RequestScheduler({"gpt-4.1": limit}, base_delay=0.5)
+        no_retry = OpenAIProvider(openai_client=client.with_options(max_retries=0))
+        interactive = ScheduledModelProvider("interactive", no_retry, scheduler)
+        batch = ScheduledModelProvider("batch", no_retry, scheduler)
+        await run_all([interactive] + [batch] * 5, "with scheduler")
+        print(scheduler.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
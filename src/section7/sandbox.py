@@ -0,0 +1,213 @@
+import os
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+from typing import Self
+
+from loguru import logger
+from pydantic import BaseModel, Field, PrivateAttr
+
+from src.section7.dir_tree import DirTreeSnapshot
+from src.section7.package_cache import InstallStats, package_cache_env
+from src.section7.python_kernel import PythonKernel
+from src.section7.sandbox_snapshot import Snapshot, SnapshotStore, SnapshotTracker
+
+
+class SandboxContext(BaseModel):
+    """
+    エージェントがファイル操作やコマンド実行を行うサンドボックス。
+    `os.chdir`のようなプロセス全体に影響する操作は行わず、すべてのパスを`sandbox`基準で解決するため、
+    1つのプロセスの中で複数のサンドボックスを同時に扱うことができます。
+    """
+
+    sandbox: Path
+    # ask_userなど、複数のセッションを同じプロセスで扱う仕組みがセッションを区別するためのID
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex[:12])
+    _tree: DirTreeSnapshot | None = PrivateAttr(default=None)
+    _snapshots: SnapshotTracker | None = PrivateAttr(default=None)
+    _kernel: PythonKernel | None = PrivateAttr(default=None)
+    _installs: InstallStats = PrivateAttr(default_factory=InstallStats)
+
+    @property
+    def tree(self) -> DirTreeSnapshot:
+        """
+        サンドボックス内のディレクトリ構成のスナップショット。
+        """
+        if self._tree is None:
+            self._tree = DirTreeSnapshot(self.sandbox)
+        return self._tree
+
+    @property
+    def installs(self) -> InstallStats:
+        """
+        このサンドボックスで実行したパッケージのインストールの記録。
+        """
+        return self._installs
+
+    @property
+    def kernel(self) -> PythonKernel:
+        """
+        サンドボックスの仮想環境で起動したままにしておくPythonのワーカー。最初の実行時に起動します。
+        """
+        if self._kernel is None:
+            self._kernel = PythonKernel(self.sandbox, env=self.command_env())
+        return self._kernel
+
+    async def aclose(self) -> None:
+        """
+        サンドボックスで起動したワーカーを終了します。
+        """
+        if self._kernel is not None:
+            await self._kernel.close()
+            self._kernel = None
+
+    @property
+    def snapshots(self) -> SnapshotTracker | None:
+        """
+        スナップショットのトラッカー。`enable_snapshots`を呼ぶまではNoneです。
+        """
+        return self._snapshots
+
+    def enable_snapshots(self, store: SnapshotStore | None = None) -> None:
+        """
+        スナップショットを有効にします。有効にすると、ファイルを変更するツールは実行前に自動でスナップショットを取ります。
+
+        Args:
+            store (SnapshotStore | None): スナップショットの保存先。Noneの場合はサンドボックスの隣のディレクトリに保存します
+        """
+        if store is None:
+            store = SnapshotStore(
+                self.sandbox.parent / f".{self.sandbox.name}.snapshots"
+            )
+        self._snapshots = SnapshotTracker(self.sandbox, store)
+
+    def touch(self, path: Path) -> None:
+        """
+        ツールがファイルを作成・更新したことを、ディレクトリ構成とスナップショットに反映します。
+        """
+        self.tree.touch(path)
+        if self._snapshots is not None:
+            self._snapshots.touch(path)
+
+    def invalidate(self) -> None:
+        """
+        コマンドの実行などで、サンドボックス内の任意のファイルが変更された可能性があることを伝えます。
+        """
+        self.tree.clear()
+        if self._snapshots is not None:
+            self._snapshots.invalidate()
+
+    def snapshot(self, label: str = "") -> Snapshot | None:
+        """
+        現在のサンドボックスのスナップショットを取ります。スナップショットが無効な場合は何もしません。
+        """
+        if self._snapshots is None:
+            return None
+        return self._snapshots.snapshot(label)
+
+    def restore(self, snapshot_id: str) -> list[str]:
+        """
+        サンドボックスをスナップショットの状態に戻し、変更したパスを返します。
+
+        Raises:
+            RuntimeError: スナップショットが無効な場合
+            KeyError: スナップショットが存在しない場合
+        """
+        if self._snapshots is None:
+            raise RuntimeError("Snapshots are not enabled for this sandbox.")
+        changed = self._snapshots.restore(snapshot_id)
+        self.tree.clear()
+        return changed
+
+    def fork(self, snapshot_id: str, destination: Path) -> "SandboxContext":
+        """
+        スナップショットの状態を新しいディレクトリに複製し、そのサンドボックスを返します。
+        `uv init`や`uv sync`をやり直さずに、同じ状態から複数の解答を試すときに使います。
+        ファイルはストアからコピーするので、複製先での変更は元のサンドボックスやスナップショットに影響しません。
+
+        Raises:
+            RuntimeError: スナップショットが無効な場合
+        """
+        if self._snapshots is None:
+            raise RuntimeError("Snapshots are not enabled for this sandbox.")
+        tracker = self._snapshots.fork(snapshot_id, destination)
+        context = type(self)(sandbox=tracker.sandbox)
+        context._snapshots = tracker
+        return context
+
+    def resolve(self, path: str | Path) -> Path:
+        """
+        サンドボックスからの相対パスを絶対パスに解決します。
+
+        Args:
+            path (str | Path): サンドボックスからの相対パス
+
+        Raises:
+            RuntimeError: 解決したパスがサンドボックスの外を指している場合
+        """
+        resolved = (self.sandbox / path).resolve()
+        if not resolved.is_relative_to(self.sandbox):
+            raise RuntimeError(f"Path {path} is outside of the sandbox.")
+        return resolved
+
+    def relative(self, path: Path) -> str:
+        """
+        絶対パスをサンドボックスからの相対パスに変換します。エージェントに返すメッセージで使用します。
+        """
+        return path.relative_to(self.sandbox).as_posix() or "."
+
+    def command_env(self) -> dict[str, str]:
+        """
+        サンドボックス内でコマンドを実行するときの環境変数を返します。
+        """
+        return (
+            os.environ.copy()
+            | package_cache_env()
+            | {"VIRTUAL_ENV": str(self.sandbox / ".venv")}
+        )
+
+    @classmethod
+    def initialize(cls, sandbox: Path, force: bool = False) -> Self:
+        """
+        サンドボックスディレクトリを初期化します。
+
+        Args:
+            sandbox (Path): サンドボックスディレクトリへのパス。
+            force (bool): Trueの場合、新しいディレクトリを作成する前に既存のサンドボックスディレクトリを削除します。
+        """
+        if sandbox.exists():
+            logger.info(f"Sandbox already exists at {sandbox}")
+            if not force:
+                raise RuntimeError(
+                    f"Sandbox already exists at {sandbox}. Use force=True to remove it."
+                )
+            else:
+                logger.info(f"Removing existing sandbox at {sandbox}")
+                shutil.rmtree(sandbox)
+        sandbox.mkdir(parents=True, exist_ok=True)
+        ret = subprocess.run(
+            ["uv", "init", "--no-workspace"],
+            cwd=sandbox,
+            env=os.environ.copy() | package_cache_env(),
+            capture_output=True,
+            text=True,
+        )
+
+        if ret.returncode != 0:
+            logger.error(f"Failed to initialize sandbox: {ret.stderr}")
+            raise RuntimeError(f"Failed to initialize sandbox: {ret.stderr}")
+        logger.info(f"Sandbox initialized at {sandbox}")
+        return cls(sandbox=sandbox.resolve())
+
+    @classmethod
+    def load(cls, sandbox: Path) -> Self:
+        """
+        既存のサンドボックスディレクトリを読み込みます。
+
+        Args:
+            sandbox (Path): 既存のサンドボックスディレクトリへのパス。
+        """
+        if not sandbox.exists():
+            raise RuntimeError(f"Sandbox does not exist at {sandbox}")
+        return cls(sandbox=sandbox.resolve())
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import shutil
+import statistics
+import time
+import uuid
+from collections.abc import AsyncIterator, Coroutine
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Self
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.command_runner import run_command
+from src.section7.package_cache import package_cache_env
+from src.section7.sandbox import SandboxContext
+
+# テンプレートの仮想環境のディレクトリ
+VENV_DIR = ".venv"
+
+
+class PoolMetrics(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    acquisition_latencies: list[float] = []
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def latency_percentile(self, q: int) -> float:
+        """
+        取得レイテンシのパーセンタイル（秒）を返します。
+
+        Args:
+            q (int): 1から99までのパーセンタイル
+        """
+        if len(self.acquisition_latencies) < 2:
+            return self.acquisition_latencies[0] if self.acquisition_latencies else 0.0
+        return statistics.quantiles(self.acquisition_latencies, n=100)[q - 1]
+
+    def summary(self) -> str:
+        return (
+            f"hit rate: {self.hit_rate:.1%} ({self.hits} hits / {self.misses} misses), "
+            f"acquire p50: {self.latency_percentile(50) * 1000:.1f}ms, "
+            f"p95: {self.latency_percentile(95) * 1000:.1f}ms"
+        )
+
+
+def _clone_tree(template: Path, destination: Path, path_files: set[Path]) -> None:
+    """
+    テンプレートのサンドボックスを複製します。テンプレートの絶対パスを含むファイルは書き換えてコピーします。
+    `.venv`以下もハードリンクで共有せずにコピーします。エージェントがsite-packagesのファイルをその場で編集したり、
+    uvが既存のファイルに上書きしたりすると、ハードリンクではテンプレートと他のすべてのサンドボックスまで変わってしまうためです。
+    テンプレートの仮想環境はパッケージを入れていない小さなものなので、コピーしても複製の時間はほとんど変わりません。
+    """
+    template_bytes = str(template).encode()
+    destination_bytes = str(destination).encode()
+
+    def copy(src: str, dst: str) -> None:
+        src_path = Path(src)
+        relative = src_path.relative_to(template)
+        if relative in path_files:
+            # .pthやエントリポイントスクリプトにはテンプレートの絶対パスが書かれているので書き換える
+            data = src_path.read_bytes().replace(template_bytes, destination_bytes)
+            Path(dst).write_bytes(data)
+            shutil.copymode(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+    shutil.copytree(template, destination, symlinks=True, copy_function=copy)
+
+
+def _find_path_files(template: Path) -> set[Path]:
+    """
+    テンプレートの仮想環境のうち、テンプレートの絶対パスを含むファイルを探します。
+    """
+    template_bytes = str(template).encode()
+    path_files: set[Path] = set()
+    for root, _, files in os.walk(template / VENV_DIR):
+        for name in files:
+            path = Path(root) / name
+            if path.is_symlink():
+                continue
+            if template_bytes in path.read_bytes():
+                path_files.add(path.relative_to(template))
+    return path_files
+
+
+class SandboxPool:
+    """
+    初期化済みのサンドボックスを事前に用意しておくプール。
+    `uv init`と仮想環境の作成はテンプレートに対して1度だけ行い、
+    各サンドボックスはテンプレートを複製して作成するので、セッション開始時の待ち時間がほぼなくなります。
+    """
+
+    def __init__(self, root: Path, size: int = 4):
+        """
+        Args:
+            root (Path): テンプレートとサンドボックスを配置するディレクトリ
+            size (int): 常に用意しておくサンドボックスの数
+        """
+        self.root = root.resolve()
+        self.size = size
+        self.template = self.root / "template"
+        self.metrics = PoolMetrics()
+        self._ready: asyncio.Queue[SandboxContext] = asyncio.Queue()
+        self._path_files: set[Path] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._pending = 0
+
+    async def start(self) -> None:
+        """
+        テンプレートを作成し、バックグラウンドでプールを満たします。
+        """
+        if self.root.exists():
+            logger.info(f"Removing existing sandbox pool at {self.root}")
+            await asyncio.to_thread(shutil.rmtree, self.root)
+        self.template.mkdir(parents=True)
+        result = await run_command(
+            "uv init --no-workspace && uv sync",
+            cwd=self.template,
+            env=os.environ.copy() | package_cache_env(),
+            timeout=300,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Failed to initialize sandbox template: {result.stderr}"
+            )
+        self._path_files = await asyncio.to_thread(_find_path_files, self.template)
+        logger.info(f"Sandbox template initialized at {self.template}")
+        self._refill()
+
+    async def close(self) -> None:
+        """
+        バックグラウンドタスクを停止し、プールのディレクトリを削除します。
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.to_thread(shutil.rmtree, self.root, ignore_errors=True)
+
+    async def __aenter__(self) -> Self:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args: object) -> None:
+        await self.close()
+
+    async def acquire(self) -> SandboxContext:
+        """
+        サンドボックスを1つ取り出します。プールが空の場合はその場で作成します。
+        """
+        start = time.perf_counter()
+        try:
+            sandbox = self._ready.get_nowait()
+            self.metrics.hits += 1
+        except asyncio.QueueEmpty:
+            sandbox = await self._create()
+            self.metrics.misses += 1
+        self.metrics.acquisition_latencies.append(time.perf_counter() - start)
+        self._refill()
+        return sandbox
+
+    async def release(self, sandbox: SandboxContext) -> None:
+        """
+        使い終わったサンドボックスを返却します。
+        返却されたサンドボックスは退避ディレクトリへ移動してバックグラウンドで削除し、
+        代わりにテンプレートから新しいサンドボックスを補充します。
+        """
+        await sandbox.aclose()
+        trash = self.root / "trash" / sandbox.sandbox.name
+        trash.parent.mkdir(exist_ok=True)
+        # 同じファイルシステム内のrenameなのでサンドボックスの大きさによらず一瞬で終わる
+        sandbox.sandbox.rename(trash)
+        self._spawn(asyncio.to_thread(shutil.rmtree, trash, ignore_errors=True))
+        self._refill()
+
+    @asynccontextmanager
+    async def sandbox(self) -> AsyncIterator[SandboxContext]:
+        """
+        `async with pool.sandbox() as context:`の形でサンドボックスを借りるためのヘルパー。
+        """
+        sandbox = await self.acquire()
+        try:
+            yield sandbox
+        finally:
+            await self.release(sandbox)
+
+    async def _create(self) -> SandboxContext:
+        destination = self.root / f"sandbox-{uuid.uuid4().hex[:12]}"
+        await asyncio.to_thread(
+            _clone_tree, self.template, destination, self._path_files
+        )
+        return SandboxContext(sandbox=destination)
+
+    def _refill(self) -> None:
+        while self._ready.qsize() + self._pending < self.size:
+            self._pending += 1
+            self._spawn(self._fill_one())
+
+    async def _fill_one(self) -> None:
+        try:
+            sandbox = await self._create()
+            self._ready.put_nowait(sandbox)
+        except Exception as e:
+            logger.error(f"Failed to create sandbox: {e}")
+        finally:
+            self._pending -= 1
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, Any]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,333 @@
+"""
+サンドボックスのスナップショット。
+ファイルの内容はハッシュをキーにしたオブジェクトストアに1度だけ保存し、スナップショットはパスとハッシュの対応表（マニフェスト）として記録します。
+同じ内容のファイルは何度スナップショットを取っても1つしか保存されず、復元では内容が変わったファイルだけを書き戻します。
+
+```python
+context.enable_snapshots()
+snapshot_id = context.snapshot("before uv add")
+...
+context.restore(snapshot_id)
+```
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from loguru import logger
+from pydantic import BaseModel
+
+# スナップショットに含めないディレクトリ（実行時に再生成される）
+SNAPSHOT_IGNORES = ("__pycache__",)
+
+
+class FileEntry(BaseModel):
+    digest: str
+    mode: int
+    size: int
+    mtime_ns: int
+    # シンボリックリンクの場合のリンク先
+    link: str | None = None
+    # サンドボックスの絶対パスを含むファイル（.pthやエントリポイントスクリプト）。別の場所に複製するときに書き換える
+    has_root: bool = False
+
+    def same_stat(self, st: os.stat_result) -> bool:
+        return (
+            self.size == st.st_size
+            and self.mtime_ns == st.st_mtime_ns
+            and self.mode == stat.S_IMODE(st.st_mode)
+        )
+
+
+class Snapshot(BaseModel):
+    id: str
+    label: str = ""
+    parent: str | None = None
+    created_at: float
+    # スナップショットを取ったサンドボックスの絶対パス
+    root: str
+    files: dict[str, FileEntry] = {}
+    dirs: list[str] = []
+
+
+class SnapshotStore:
+    """
+    スナップショットのマニフェストとファイルの内容を保存するストア。
+    同じサンドボックスから複製（フォーク）したサンドボックスどうしは、1つのストアを共有できます。
+    `.venv`以下も含めてファイルはすべてコピーで保存・復元します。ハードリンクにすると、
+    site-packagesのファイルをその場で編集したときに保存した内容や他のサンドボックスまで変わってしまうためです。
+    """
+
+    def __init__(self, root: Path):
+        self.root = root.resolve()
+        self.objects = self.root / "objects"
+        self.manifests = self.root / "manifests"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.manifests.mkdir(parents=True, exist_ok=True)
+        self._cache: dict[str, Snapshot] = {}
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def put_bytes(self, data: bytes) -> str:
+        """
+        内容をストアに保存し、そのハッシュを返します。同じ内容がすでにあれば何もしません。
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.object_path(digest)
+        if not target.exists():
+            target.parent.mkdir(exist_ok=True)
+            tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}")
+            tmp.write_bytes(data)
+            os.replace(tmp, target)
+        return digest
+
+    def save(self, snapshot: Snapshot) -> None:
+        path = self.manifests / f"{snapshot.id}.json"
+        path.write_text(snapshot.model_dump_json())
+        self._cache[snapshot.id] = snapshot
+
+    def load(self, snapshot_id: str) -> Snapshot:
+        """
+        Raises:
+            KeyError: スナップショットが存在しない場合
+        """
+        if snapshot_id not in self._cache:
+            path = self.manifests / f"{snapshot_id}.json"
+            if not path.is_file():
+                raise KeyError(f"Snapshot {snapshot_id} does not exist.")
+            self._cache[snapshot_id] = Snapshot.model_validate_json(path.read_bytes())
+        return self._cache[snapshot_id]
+
+
+class SnapshotTracker:
+    """
+    1つのサンドボックスのスナップショットを取り、復元するクラス。
+
+    直前のスナップショット（head）を覚えておき、サイズ・更新時刻・パーミッションが変わっていないファイルはハッシュを計算し直しません。
+    ツールがどのファイルを書き換えたかを`touch`で伝えておけば、次のスナップショットではそのファイルだけを調べます。
+    任意のファイルを変更しうるコマンドを実行した後は`invalidate`を呼び、次のスナップショットでサンドボックス全体を調べます。
+    """
+
+    def __init__(self, sandbox: Path, store: SnapshotStore):
+        self.sandbox = sandbox
+        self.store = store
+        self.head: Snapshot | None = None
+        self.history: list[Snapshot] = []
+        self._dirty: set[str] = set()
+        self._all_dirty = True
+        self._lock = threading.RLock()
+
+    def touch(self, path: Path) -> None:
+        with self._lock:
+            self._dirty.add(path.relative_to(self.sandbox).as_posix())
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._all_dirty = True
+
+    def snapshot(self, label: str = "") -> Snapshot:
+        """
+        現在のサンドボックスのスナップショットを取ります。
+        直前のスナップショットから何も変わっていなければ、新しいスナップショットは作らずに直前のものを返します。
+        """
+        with self._lock:
+            start = time.perf_counter()
+            head = self.head
+            if head is not None and not self._all_dirty and not self._dirty:
+                return head
+            if head is None or self._all_dirty:
+                files, dirs = self._scan_all(head)
+            else:
+                files, dirs = self._scan_dirty(head)
+            self._dirty.clear()
+            self._all_dirty = False
+            if head is not None and files == head.files and dirs == head.dirs:
+                return head
+            snapshot = Snapshot(
+                id=uuid.uuid4().hex[:12],
+                label=label,
+                parent=head.id if head else None,
+                created_at=time.time(),
+                root=str(self.sandbox),
+                files=files,
+                dirs=dirs,
+            )
+            self.store.save(snapshot)
+            self.head = snapshot
+            self.history.append(snapshot)
+            logger.debug(
+                f"Snapshot {snapshot.id} of {self.sandbox} ({len(files)} files) "
+                f"taken in {(time.perf_counter() - start) * 1000:.1f}ms"
+            )
+            return snapshot
+
+    def restore(self, snapshot_id: str) -> list[str]:
+        """
+        サンドボックスをスナップショットの状態に戻し、書き戻したり削除したりしたパスを返します。
+        現在の状態もスナップショットとして残すので、復元自体を取り消すこともできます。
+        """
+        with self._lock:
+            target = self.store.load(snapshot_id)
+            self.snapshot(f"restore {snapshot_id}")
+            changed = self._apply(target)
+            logger.info(
+                f"Restored {self.sandbox} to snapshot {snapshot_id} "
+                f"({len(changed)} paths changed)"
+            )
+            return changed
+
+    def fork(self, snapshot_id: str, destination: Path) -> "SnapshotTracker":
+        """
+        スナップショットの状態を新しいディレクトリに複製し、そのディレクトリのトラッカーを返します。
+        ストアは共有するので、複製先でも同じIDのスナップショットを復元できます。
+        """
+        destination = destination.resolve()
+        destination.mkdir(parents=True)
+        tracker = SnapshotTracker(destination, self.store)
+        tracker.head = Snapshot(id="", created_at=time.time(), root=str(destination))
+        tracker._apply(self.store.load(snapshot_id))
+        tracker._all_dirty = False
+        return tracker
+
+    def _scan_all(
+        self, head: Snapshot | None
+    ) -> tuple[dict[str, FileEntry], list[str]]:
+        files: dict[str, FileEntry] = {}
+        dirs: list[str] = []
+        previous = head.files if head else {}
+        for root, dirnames, filenames in os.walk(self.sandbox):
+            root_path = Path(root)
+            relative_root = root_path.relative_to(self.sandbox).as_posix()
+            prefix = "" if relative_root == "." else relative_root + "/"
+            for name in list(dirnames):
+                path = root_path / name
+                if name in SNAPSHOT_IGNORES:
+                    dirnames.remove(name)
+                elif path.is_symlink():
+                    # ディレクトリへのシンボリックリンクは辿らず、リンクとして記録する
+                    dirnames.remove(name)
+                    filenames.append(name)
+                else:
+                    dirs.append(prefix + name)
+            for name in filenames:
+                relative = prefix + name
+                entry = self._entry(root_path / name, relative, previous.get(relative))
+                if entry is not None:
+                    files[relative] = entry
+        return files, sorted(dirs)
+
+    def _scan_dirty(self, head: Snapshot) -> tuple[dict[str, FileEntry], list[str]]:
+        files = dict(head.files)
+        dirs = set(head.dirs)
+        for relative in self._dirty:
+            path = self.sandbox / relative
+            entry = self._entry(path, relative, head.files.get(relative))
+            if entry is None:
+                files.pop(relative, None)
+                continue
+            files[relative] = entry
+            parent = Path(relative).parent
+            while parent != Path("."):
+                dirs.add(parent.as_posix())
+                parent = parent.parent
+        return files, sorted(dirs)
+
+    def _entry(
+        self, path: Path, relative: str, previous: FileEntry | None
+    ) -> FileEntry | None:
+        try:
+            st = path.lstat()
+        except FileNotFoundError:
+            return None
+        if previous is not None and previous.same_stat(st):
+            return previous
+        mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            link = os.readlink(path)
+            return FileEntry(
+                digest=hashlib.sha256(link.encode()).hexdigest(),
+                mode=mode,
+                size=st.st_size,
+                mtime_ns=st.st_mtime_ns,
+                link=link,
+            )
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        # 読んだ内容をそのまま保存するので、読んだ後にファイルが書き換えられてもハッシュと内容はずれない
+        digest = self.store.put_bytes(data)
+        return FileEntry(
+            digest=digest,
+            mode=mode,
+            size=st.st_size,
+            mtime_ns=st.st_mtime_ns,
+            has_root=str(self.sandbox).encode() in data,
+        )
+
+    def _apply(self, target: Snapshot) -> list[str]:
+        """
+        headとの差分だけを書き戻して、サンドボックスを`target`の状態にします。
+        """
+        assert self.head is not None
+        current = self.head.files
+        changed: list[str] = []
+        # 消えるファイルとディレクトリを先に削除してから、ファイルを書き戻す
+        for relative in sorted(set(current) - set(target.files)):
+            (self.sandbox / relative).unlink(missing_ok=True)
+            changed.append(relative)
+        for relative in sorted(set(self.head.dirs) - set(target.dirs), reverse=True):
+            shutil.rmtree(self.sandbox / relative, ignore_errors=True)
+        for relative in target.dirs:
+            (self.sandbox / relative).mkdir(parents=True, exist_ok=True)
+        rewrite = target.root != str(self.sandbox)
+        files: dict[str, FileEntry] = {}
+        for relative, entry in target.files.items():
+            if entry.has_root and rewrite:
+                entry = self._rewrite(entry, target.root)
+            files[relative] = entry
+            old = current.get(relative)
+            if (
+                old is not None
+                and old.digest == entry.digest
+                and old.mode == entry.mode
+            ):
+                continue
+            self._materialize(relative, entry)
+            changed.append(relative)
+        # 書き戻したファイルの更新時刻はスナップショットの時点に揃えてあるので、そのままheadとして使える
+        self.head = target.model_copy(update={"files": files})
+        return changed
+
+    def _rewrite(self, entry: FileEntry, root: str) -> FileEntry:
+        data = self.store.object_path(entry.digest).read_bytes()
+        data = data.replace(root.encode(), str(self.sandbox).encode())
+        return entry.model_copy(
+            update={"digest": self.store.put_bytes(data), "size": len(data)}
+        )
+
+    def _materialize(self, relative: str, entry: FileEntry) -> None:
+        path = self.sandbox / relative
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        else:
+            path.unlink(missing_ok=True)
+        if entry.link is not None:
+            os.symlink(entry.link, path)
+        else:
+            self._copy(entry, path)
+        # 更新時刻をスナップショットの時点に戻しておけば、次のスナップショットでハッシュを計算し直さずに済む
+        os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns), follow_symlinks=False)
+
+    def _copy(self, entry: FileEntry, path: Path) -> None:
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}")
+        shutil.copyfile(self.store.object_path(entry.digest), tmp)
+        os.chmod(tmp, entry.mode)
+        os.replace(tmp, path)
@@ -0,0 +1,288 @@
+"""
+エージェントの実行を途中から再開できるよう、実行中に生成されたアイテムをディスクに記録するセッションストア。
+セッションごとに追記専用のJSONLファイルを作り、ツールの呼び出しと結果が出るたびに1行ずつ書き込みます。
+"""
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Literal, cast
+
+from agents import (
+    Agent,
+    RunConfig,
+    RunItemStreamEvent,
+    Runner,
+    RunResultStreaming,
+    TResponseInputItem,
+)
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.history import ConversationHistory
+from src.section7.sandbox import SandboxContext
+
+
+class SessionRecord(BaseModel):
+    type: Literal["start", "item", "resume", "done"]
+    timestamp: float
+    # type="start"のときのみ
+    sandbox: str | None = None
+    input: list[dict[str, Any]] | None = None
+    # type="item"のときのみ
+    item: dict[str, Any] | None = None
+    # type="resume"のときのみ。再開時に残した、それまでに記録したアイテムの数
+    kept: int | None = None
+    # type="done"のときのみ
+    final_output: str | None = None
+
+
+class SessionState(BaseModel):
+    session_id: str
+    sandbox: Path
+    input: list[dict[str, Any]]
+    items: list[dict[str, Any]]
+    done: bool
+    final_output: str | None = None
+
+    def complete_items(self) -> int:
+        """
+        最後まで記録できたターンのアイテムの数を返します。
+        SDKはツールを実行する前に推論（reasoning）とツール呼び出しのアイテムを出力するので、
+        ツールの実行中に落ちると、結果のない呼び出しとその前の推論が残ります。
+        推論のアイテムは続くアイテムなしでは受け付けられないため、すべての呼び出しに結果があり、
+        推論で終わっていない最後の位置までを完了したターンとみなします。
+        """
+        pending: set[Any] = set()
+        complete = 0
+        for i, item in enumerate(self.items):
+            if item.get("type") == "function_call":
+                pending.add(item.get("call_id"))
+            elif item.get("type") == "function_call_output":
+                pending.discard(item.get("call_id"))
+            if not pending and item.get("type") != "reasoning":
+                complete = i + 1
+        return complete
+
+    def resume_input(self) -> list[TResponseInputItem]:
+        """
+        再開時にモデルへ渡す入力を返します。
+        途中で落ちた最後のターンは丸ごと取り除き、再開後にモデルがやり直すようにします。
+        """
+        items = self.items[: self.complete_items()]
+        return cast(list[TResponseInputItem], self.input + items)
+
+
+class SessionLog:
+    """
+    1セッション分の追記専用ログ。
+    書き込むたびにflushするのでプロセスが落ちても記録は残ります。
+    fsyncは`fsync_interval`秒に1回だけバックグラウンドのスレッドで行い、ターンごとの待ち時間を増やしません。
+    """
+
+    def __init__(self, path: Path, fsync_interval: float = 1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._file = path.open("a", encoding="utf-8")
+        # 書き込み途中で落ちた最終行があれば削除し、次の記録がその行につながらないようにする
+        with path.open("rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning(f"Removing a partial record at the end of {path}")
+            self._file.truncate(end)
+        self._last_fsync = time.monotonic()
+        self._fsync_task: asyncio.Future[None] | None = None
+
+    def append(self, record: SessionRecord) -> None:
+        self._file.write(record.model_dump_json(exclude_none=True) + "\n")
+        self._file.flush()
+        now = time.monotonic()
+        in_flight = self._fsync_task is not None and not self._fsync_task.done()
+        if now - self._last_fsync >= self.fsync_interval and not in_flight:
+            self._last_fsync = now
+            self._fsync_task = asyncio.get_running_loop().run_in_executor(
+                None, os.fsync, self._file.fileno()
+            )
+
+    async def close(self) -> None:
+        if self._fsync_task is not None:
+            await self._fsync_task
+        await asyncio.to_thread(os.fsync, self._file.fileno())
+        self._file.close()
+
+
+class SessionStore:
+    """
+    セッションIDごとに実行のログを保存し、落ちた実行を最後に記録したところから再開します。
+
+    ```python
+    store = SessionStore(Path("sessions"))
+    result = await store.run(agent, "session-1", input=task, context=context)
+    # プロセスが落ちた後は、同じセッションIDで呼ぶと続きから再開する
+    result = await store.run(agent, "session-1")
+    ```
+
+    長いセッションを再開すると記録済みのツール出力をすべて送り直すことになるので、
+    モデルへの入力は`ConversationHistory`で`max_input_tokens`に収まるよう縮めてから渡します。
+    ログには縮める前のアイテムをそのまま記録します。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        fsync_interval: float = 1.0,
+        max_input_tokens: int | None = 100_000,
+    ):
+        """
+        Args:
+            root (Path): ログを保存するディレクトリ
+            fsync_interval (float): ログをfsyncする間隔（秒）
+            max_input_tokens (int | None): 実行開始時にモデルへ渡す入力のトークン数の上限。Noneの場合は縮めません
+        """
+        self.root = root
+        self.fsync_interval = fsync_interval
+        self.max_input_tokens = max_input_tokens
+        root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, session_id: str) -> Path:
+        return self.root / f"{session_id}.jsonl"
+
+    def exists(self, session_id: str) -> bool:
+        return self.path(session_id).exists()
+
+    def list_sessions(self) -> list[str]:
+        return sorted(path.stem for path in self.root.glob("*.jsonl"))
+
+    def load(self, session_id: str) -> SessionState:
+        """
+        ログを読み込んでセッションの状態を復元します。書き込み途中で落ちた最終行は読み飛ばします。
+        """
+        sandbox: Path | None = None
+        input: list[dict[str, Any]] = []
+        items: list[dict[str, Any]] = []
+        final_output: str | None = None
+        done = False
+        with self.path(session_id).open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = SessionRecord.model_validate_json(line)
+                except ValueError:
+                    logger.warning(f"[{session_id}] Skipping broken record")
+                    continue
+                if record.type == "start":
+                    sandbox = Path(record.sandbox or "")
+                    input = record.input or []
+                elif record.type == "item" and record.item is not None:
+                    items.append(record.item)
+                elif record.type == "resume" and record.kept is not None:
+                    # 前回の再開で取り除いた途中のターンは、その後に記録したアイテムと混ぜない
+                    del items[record.kept :]
+                elif record.type == "done":
+                    done = True
+                    final_output = record.final_output
+        if sandbox is None:
+            raise RuntimeError(f"Session {session_id} has no start record")
+        return SessionState(
+            session_id=session_id,
+            sandbox=sandbox,
+            input=input,
+            items=items,
+            done=done,
+            final_output=final_output,
+        )
+
+    async def run(
+        self,
+        agent: Agent[SandboxContext],
+        session_id: str,
+        input: str | list[TResponseInputItem] | None = None,
+        context: SandboxContext | None = None,
+        max_turns: int = 100,
+        run_config: RunConfig | None = None,
+    ) -> RunResultStreaming:
+        """
+        セッションを実行します。ログが残っている場合は`input`を無視し、
+        記録済みの会話と同じサンドボックスで続きから再開します。
+
+        Args:
+            agent (Agent[SandboxContext]): 実行するエージェント
+            session_id (str): セッションID
+            input (str | list[TResponseInputItem] | None): 新しいセッションの入力
+            context (SandboxContext | None): 新しいセッションのサンドボックス。
+                再開する場合は`sandbox`だけを記録済みのパスに置き換えて使い、スナップショットなどの設定は引き継ぎます
+            max_turns (int): 今回の実行の最大ターン数
+            run_config (RunConfig | None): `Runner`に渡す設定
+        """
+        if self.exists(session_id):
+            state = self.load(session_id)
+            if state.done:
+                raise RuntimeError(f"Session {session_id} has already finished")
+            logger.info(
+                f"[{session_id}] Resuming from {len(state.items)} recorded items"
+            )
+            if context is None:
+                context = SandboxContext(sandbox=state.sandbox)
+            else:
+                context.sandbox = state.sandbox
+            context.session_id = session_id
+            run_input = state.resume_input()
+            log = SessionLog(self.path(session_id), self.fsync_interval)
+            log.append(
+                SessionRecord(
+                    type="resume", timestamp=time.time(), kept=state.complete_items()
+                )
+            )
+        else:
+            if input is None or context is None:
+                raise RuntimeError(
+                    f"Session {session_id} does not exist; input and context are required"
+                )
+            context.session_id = session_id
+            run_input = (
+                [{"role": "user", "content": input}]
+                if isinstance(input, str)
+                else input
+            )
+            log = SessionLog(self.path(session_id), self.fsync_interval)
+            log.append(
+                SessionRecord(
+                    type="start",
+                    timestamp=time.time(),
+                    sandbox=str(context.sandbox),
+                    input=[dict(item) for item in run_input],
+                )
+            )
+
+        if self.max_input_tokens is not None:
+            history = ConversationHistory(max_tokens=self.max_input_tokens)
+            history.add(run_input)
+            run_input = history.to_input_list()
+        result = Runner.run_streamed(
+            agent,
+            input=run_input,
+            context=context,
+            max_turns=max_turns,
+            run_config=run_config,
+        )
+        try:
+            async for event in result.stream_events():
+                if isinstance(event, RunItemStreamEvent):
+                    item = json.loads(
+                        json.dumps(event.item.to_input_item(), default=str)
+                    )
+                    log.append(
+                        SessionRecord(type="item", timestamp=time.time(), item=item)
+                    )
+            log.append(
+                SessionRecord(
+                    type="done",
+                    timestamp=time.time(),
+                    final_output=str(result.final_output),
+                )
+            )
+        finally:
+            await log.close()
+        return result
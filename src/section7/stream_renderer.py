@@ -0,0 +1,206 @@
+"""
+`Runner.run_streamed`の実行を、モデルの出力やツール呼び出しが起きたそばからターミナルに表示するレンダラー。
+出力先がターミナルでない場合（パイプやファイルへのリダイレクト）は、1行に1イベントのJSONを書き出します。
+
+```python
+result = await StreamRenderer().run(agent, input=user_input)
+```
+"""
+
+import json
+import sys
+import time
+from typing import Any, TextIO
+
+from agents import (
+    Agent,
+    RunContextWrapper,
+    RunHooks,
+    Runner,
+    RunResult,
+    RunResultStreaming,
+    Tool,
+)
+from agents.items import TResponseInputItem
+
+# ツールの引数と出力を1行で表示するときの最大文字数
+PREVIEW_CHARS = 80
+
+DIM = "\033[2m"
+RESET = "\033[0m"
+
+
+def _preview(value: Any) -> str:
+    text = " ".join(str(value).split())
+    return text if len(text) <= PREVIEW_CHARS else text[: PREVIEW_CHARS - 3] + "..."
+
+
+class _ToolHooks(RunHooks[Any]):
+    """
+    ツールの実行の開始と終了をレンダラーに伝えるフック。
+    ストリームのツール呼び出しのイベントは、SDKのバージョンによってはツールの実行が終わってからまとめて届くため、
+    実行時間の計測にはフックを使います。
+    """
+
+    def __init__(self, renderer: "StreamRenderer"):
+        self.renderer = renderer
+
+    async def on_tool_start(
+        self, context: RunContextWrapper[Any], agent: Agent[Any], tool: Tool
+    ) -> None:
+        self.renderer._on_tool_start(tool.name, context)
+
+    async def on_tool_end(
+        self,
+        context: RunContextWrapper[Any],
+        agent: Agent[Any],
+        tool: Tool,
+        result: Any,
+    ) -> None:
+        self.renderer._on_tool_end(tool.name, context, result)
+
+
+class StreamRenderer:
+    """
+    ストリーミング実行のイベントを表示するクラス。
+
+    - モデルが出力したテキストをトークン単位で表示します
+    - ツール呼び出しの開始と終了、かかった時間を表示します
+    - 最初のトークンが届くまでの時間（time to first token）を計測します
+    """
+
+    def __init__(self, output: TextIO = sys.stdout, json_lines: bool | None = None):
+        """
+        Args:
+            output (TextIO): 表示先
+            json_lines (bool | None): Trueの場合はJSON Linesで書き出します。Noneの場合は出力先がターミナルでなければJSON Linesにします
+        """
+        self.output = output
+        self.json_lines = not output.isatty() if json_lines is None else json_lines
+        self.time_to_first_token: float | None = None
+        self.tool_durations: list[tuple[str, float]] = []
+        self._start = time.perf_counter()
+        # 実行中のツール呼び出し。呼び出しIDが取れないSDKのバージョンでは、ツール名ごとに開始順で対応させる
+        self._tool_calls: dict[str, list[float]] = {}
+        self._in_text = False
+        self.hooks = _ToolHooks(self)
+
+    async def run(
+        self,
+        agent: Agent[Any],
+        input: str | list[TResponseInputItem],
+        **kwargs: Any,
+    ) -> RunResultStreaming:
+        """
+        `Runner.run_streamed`でエージェントを実行し、終わるまでイベントを表示します。
+        引数は`Runner.run_streamed`と同じです。
+        """
+        self._start = time.perf_counter()
+        result = Runner.run_streamed(agent, input=input, hooks=self.hooks, **kwargs)
+        async for event in result.stream_events():
+            match event.type:
+                case "raw_response_event":
+                    if event.data.type == "response.output_text.delta":
+                        self._on_text(event.data.delta)
+                case "agent_updated_stream_event":
+                    self._on_agent(event.new_agent)
+        self._on_done()
+        return result
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def _emit(self, event: str, **data: Any) -> None:
+        record = {"event": event, "elapsed_ms": round(self._elapsed() * 1000, 1)} | data
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+    def _write_line(self, line: str) -> None:
+        if self._in_text:
+            self.output.write("\n")
+            self._in_text = False
+        self.output.write(f"{DIM}{line}{RESET}\n")
+        self.output.flush()
+
+    def _on_text(self, delta: str) -> None:
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self._elapsed()
+        if self.json_lines:
+            self._emit("text_delta", delta=delta)
+            return
+        self.output.write(delta)
+        self.output.flush()
+        self._in_text = True
+
+    def _tool_key(self, name: str, context: RunContextWrapper[Any]) -> str:
+        return getattr(context, "tool_call_id", None) or name
+
+    def _on_tool_start(self, name: str, context: RunContextWrapper[Any]) -> None:
+        key = self._tool_key(name, context)
+        self._tool_calls.setdefault(key, []).append(time.perf_counter())
+        arguments = getattr(context, "tool_arguments", None)
+        if self.json_lines:
+            self._emit("tool_start", name=name, arguments=arguments)
+        else:
+            # 引数はツールのコンテキストから取れるSDKのバージョンでのみ表示する
+            shown = f"({_preview(arguments)})" if arguments is not None else ""
+            self._write_line(f"▶ {name}{shown}")
+
+    def _on_tool_end(
+        self, name: str, context: RunContextWrapper[Any], result: Any
+    ) -> None:
+        starts = self._tool_calls.get(self._tool_key(name, context))
+        duration = time.perf_counter() - starts.pop(0) if starts else 0.0
+        self.tool_durations.append((name, duration))
+        if self.json_lines:
+            self._emit(
+                "tool_end",
+                name=name,
+                duration_ms=round(duration * 1000, 1),
+                output=str(result),
+            )
+        else:
+            self._write_line(f"✔ {name} ({duration:.2f}s) {_preview(result)}")
+
+    def _on_agent(self, agent: Agent[Any]) -> None:
+        if self.json_lines:
+            self._emit("agent_updated", agent=agent.name)
+        else:
+            self._write_line(f"[{agent.name}]")
+
+    def _on_done(self) -> None:
+        ttft = self.time_to_first_token
+        if self.json_lines:
+            self._emit(
+                "done",
+                time_to_first_token_ms=round(ttft * 1000, 1)
+                if ttft is not None
+                else None,
+                tool_calls=len(self.tool_durations),
+            )
+            return
+        ttft_text = f"{ttft:.2f}s" if ttft is not None else "-"
+        self._write_line(
+            f"time to first token: {ttft_text}, total: {self._elapsed():.2f}s, "
+            f"tool calls: {len(self.tool_durations)}"
+        )
+
+
+async def run_and_render(
+    agent: Agent[Any],
+    input: str | list[TResponseInputItem],
+    stream: bool | None = None,
+    **kwargs: Any,
+) -> RunResult | RunResultStreaming:
+    """
+    エージェントを実行して結果を表示します。サンプルコードから使うための関数です。
+    `stream`がNoneの場合は、コマンドライン引数に`--stream`があればストリーミングで実行します。
+    ストリーミングしない場合は、実行が終わってから`final_output`を表示します。
+    """
+    if stream is None:
+        stream = "--stream" in sys.argv
+    if stream:
+        return await StreamRenderer().run(agent, input=input, **kwargs)
+    result = await Runner.run(agent, input=input, **kwargs)
+    print(result.final_output)
+    return result
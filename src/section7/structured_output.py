@@ -0,0 +1,241 @@
+"""
+構造化出力（`output_type`）の検証を速くするためのユーティリティ。
+
+Agents SDKは`Agent(output_type=Recipe)`のように型を渡すと、ターンごとに`AgentOutputSchema`を作り直し、
+そのたびに`TypeAdapter`の構築とJSONスキーマの生成が走ります。
+`output_schema(Recipe)`を渡すと、型ごとに一度だけ作ったスキーマを使い回します。
+
+```python
+recipe_agent = Agent(name="レシピアシスタント", output_type=output_schema(Recipe), ...)
+```
+
+ストリーミング実行では、`stream_list_items`でリストのフィールド（`ingredients`など）の要素を、
+出力が終わるのを待たずに届いた順に受け取れます。
+"""
+
+import functools
+import json
+import time
+import typing
+from collections.abc import AsyncIterator
+from typing import Any, TypeVar
+
+from agents import AgentOutputSchema, RunResultStreaming
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import from_json
+
+T = TypeVar("T")
+
+
+@functools.cache
+def type_adapter(output_type: Any) -> TypeAdapter[Any]:
+    """
+    型ごとに一度だけ`TypeAdapter`を作ります。`TypeAdapter`の構築はバリデータのコンパイルを伴うため重い処理です。
+    """
+    return TypeAdapter(output_type)
+
+
+@functools.cache
+def output_schema(output_type: Any, strict: bool = True) -> AgentOutputSchema:
+    """
+    型ごとに一度だけ作った`AgentOutputSchema`を返します。`Agent`の`output_type`にそのまま渡せます。
+    """
+    return AgentOutputSchema(output_type, strict_json_schema=strict)
+
+
+@functools.cache
+def json_schema(output_type: Any) -> dict[str, Any]:
+    return type_adapter(output_type).json_schema()
+
+
+def parse_output(output_type: type[T], data: str | bytes) -> T:
+    """
+    JSONの文字列またはバイト列を、辞書を経由せずに直接`output_type`に検証します。
+    """
+    if isinstance(output_type, type) and issubclass(output_type, BaseModel):
+        return output_type.model_validate_json(data)
+    return type_adapter(output_type).validate_json(data)
+
+
+def _list_item_type(output_type: type[BaseModel], field: str) -> Any:
+    annotation = output_type.model_fields[field].annotation
+    if typing.get_origin(annotation) is not list:
+        raise TypeError(f"{output_type.__name__}.{field} is not a list field")
+    return typing.get_args(annotation)[0]
+
+
+class ListItemParser:
+    """
+    少しずつ届くJSONから、リストのフィールドの要素を完成した順に取り出すパーサー。
+
+    リストの直下の区切りが届くたびに途中までのJSONをパースし直し、リストの最後以外の要素を完成したものとみなします。
+    最後の要素は、数値の桁や文字列がまだ届いている途中かもしれないので、リストが閉じてから返します。
+    """
+
+    def __init__(self, output_type: type[BaseModel], field: str):
+        self.output_type = output_type
+        self.field = field
+        self.item_adapter = type_adapter(_list_item_type(output_type, field))
+        self.reset()
+
+    def feed(self, delta: str) -> list[Any]:
+        """
+        届いたテキストを追加し、新しく完成した要素を返します。
+        """
+        self._buffer += delta
+        # 要素が完成するのは、リストの直下で要素やリストが閉じたときだけなので、それ以外はパースしない
+        if not self._scan(delta):
+            return []
+        value = from_json(self._buffer, allow_partial=True)
+        items = value.get(self.field) if isinstance(value, dict) else None
+        if not isinstance(items, list):
+            return []
+        fields = list(value)
+        closed = fields.index(self.field) < len(fields) - 1
+        return self._emit(items if closed else items[:-1])
+
+    def close(self) -> list[Any]:
+        """
+        出力が終わったときに呼び、まだ返していない要素を返します。
+        """
+        if not self._buffer.strip():
+            return []
+        value = json.loads(self._buffer)
+        return self._emit(value.get(self.field) or [])
+
+    def reset(self) -> None:
+        self._buffer = ""
+        self._emitted = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def _scan(self, delta: str) -> bool:
+        """
+        括弧の深さを追い、リストの要素の区切りになりうる文字が含まれていたかを返します。
+        深さ1がルートのオブジェクト、深さ2がフィールドのリストです。
+        """
+        boundary = False
+        for char in delta:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                boundary = boundary or self._depth <= 2
+            elif char == ",":
+                boundary = boundary or self._depth <= 2
+        return boundary
+
+    def _emit(self, items: list[Any]) -> list[Any]:
+        new_items = [
+            self.item_adapter.validate_python(item) for item in items[self._emitted :]
+        ]
+        self._emitted += len(new_items)
+        return new_items
+
+
+async def stream_list_items(
+    result: RunResultStreaming, field: str
+) -> AsyncIterator[Any]:
+    """
+    `Runner.run_streamed`の実行から、最終出力のリストのフィールドの要素を届いた順に返します。
+    エージェントの`output_type`は`BaseModel`のサブクラスか、それを渡した`output_schema`である必要があります。
+    """
+    parser: ListItemParser | None = None
+    async for event in result.stream_events():
+        if event.type == "agent_updated_stream_event":
+            output_type = event.new_agent.output_type
+            if isinstance(output_type, AgentOutputSchema):
+                output_type = output_type.output_type
+            parser = ListItemParser(output_type, field)
+        elif event.type == "raw_response_event" and parser is not None:
+            if event.data.type == "response.created":
+                parser.reset()
+            elif event.data.type == "response.output_text.delta":
+                for item in parser.feed(event.data.delta):
+                    yield item
+            elif event.data.type == "response.completed":
+                for item in parser.close():
+                    yield item
+                parser.reset()
+
+
+class _Ingredient(BaseModel):
+    name: str
+    amount: float
+    unit: str
+
+
+class _Recipe(BaseModel):
+    title: str
+    cuisine_type: str
+    ingredients: list[_Ingredient]
+
+
+def main():
+    """
+    構造化出力の検証方法ごとの所要時間を比べるマイクロベンチマーク。
+    `uv run python -m src.section7.structured_output`で実行します。
+    """
+    n = 2000
+    outputs = [
+        _Recipe(
+            title=f"カレーライス{i}",
+            cuisine_type="洋食",
+            ingredients=[
+                _Ingredient(name=f"材料{j}", amount=j * 1.5, unit="g")
+                for j in range(12)
+            ],
+        )
+        .model_dump_json()
+        .encode()
+        for i in range(n)
+    ]
+
+    def per_turn_schema(data: bytes) -> Any:
+        # SDKに型を渡したときと同じく、毎回スキーマを作り直す
+        return AgentOutputSchema(_Recipe).validate_json(data.decode())
+
+    def via_dict(data: bytes) -> Any:
+        return _Recipe.model_validate(json.loads(data))
+
+    def cached_schema(data: bytes) -> Any:
+        return output_schema(_Recipe).validate_json(data.decode())
+
+    def direct(data: bytes) -> Any:
+        return parse_output(_Recipe, data)
+
+    def streamed(data: bytes) -> Any:
+        parser = ListItemParser(_Recipe, "ingredients")
+        text = data.decode()
+        items = []
+        for i in range(0, len(text), 16):
+            items.extend(parser.feed(text[i : i + 16]))
+        items.extend(parser.close())
+        return items
+
+    for name, func in [
+        ("AgentOutputSchema per turn", per_turn_schema),
+        ("json.loads + model_validate", via_dict),
+        ("cached output_schema", cached_schema),
+        ("model_validate_json (bytes)", direct),
+        ("incremental list parsing", streamed),
+    ]:
+        start = time.perf_counter()
+        for data in outputs:
+            func(data)
+        elapsed = time.perf_counter() - start
+        print(f"{name:30s} {elapsed / n * 1e6:8.1f} us/output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any, ParamSpec, TypeVar
+
+from agents import (
+    Agent,
+    FunctionTool,
+    ItemHelpers,
+    RunConfig,
+    RunContextWrapper,
+    Runner,
+    function_tool,
+)
+from loguru import logger
+from pydantic import BaseModel
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class CacheMetrics(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    # 同じキーの計算中に届き、その結果を待って共有した呼び出しの数
+    coalesced: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"hit rate: {self.hit_rate:.1%} ({self.hits} hits / {self.coalesced} coalesced "
+            f"/ {self.misses} misses), {self.evictions} evictions"
+        )
+
+
+def normalize_text(text: str) -> str:
+    """
+    キャッシュのキーに使うため、全角・半角の違いと空白の違いをなくします。
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def make_key(*parts: Any) -> str:
+    """
+    JSONにできる値の組からキャッシュのキー（SHA-256）を作ります。
+    """
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    ツールの結果をキーごとにファイルへ保存するキャッシュ。
+    `ttl`秒より古い結果は使わず、合計サイズが`max_bytes`を超えたら最後に使われたのが古い順に削除します。
+    同じキーの計算が同時に要求された場合は1回だけ計算し、結果を共有します。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ttl: float = 7 * 24 * 60 * 60,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        """
+        Args:
+            root (Path): キャッシュを保存するディレクトリ
+            ttl (float): 結果の有効期限（秒）
+            max_bytes (int): キャッシュ全体のサイズの上限
+        """
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.metrics = CacheMetrics()
+        self.root.mkdir(parents=True, exist_ok=True)
+        # キー -> ファイルサイズ。最後に使われたのが古い順に並ぶ
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        for path in sorted(self.root.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            self._entries[path.stem] = path.stat().st_size
+        self._size = sum(self._entries.values())
+        self._inflight: dict[str, asyncio.Task[Any]] = {}
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def _read(self, key: str) -> tuple[bool, Any, int]:
+        """
+        保存された結果を読み、(見つかったか, 値, ファイルサイズ)を返します。
+        """
+        path = self._path(key)
+        try:
+            record = json.loads(path.read_text(encoding="utf-8"))
+            if time.time() - record["created_at"] > self.ttl:
+                return False, None, 0
+            # 最後に使われた時刻をmtimeに記録し、再起動後もLRUの順番を保つ
+            os.utime(path)
+            size = path.stat().st_size
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False, None, 0
+        return True, record["value"], size
+
+    def _write(self, key: str, value: Any) -> int:
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps({"created_at": time.time(), "value": value}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        os.replace(tmp, path)
+        return path.stat().st_size
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            self._size -= size
+            self.metrics.evictions += 1
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        キャッシュされた結果を返します。なければ`compute`を実行して保存します。
+        結果はJSONにできる値である必要があります。
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics.coalesced += 1
+        else:
+            # 計算は呼び出し元とは別のタスクで行う。最初の呼び出し元がキャンセルされても、
+            # 同じキーを待っている他の呼び出しは計算の結果を受け取れる
+            task = asyncio.create_task(self._compute(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._finish, key))
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        found, value, size = await asyncio.to_thread(self._read, key)
+        if found:
+            self.metrics.hits += 1
+        else:
+            self.metrics.misses += 1
+            value = await compute()
+            size = await asyncio.to_thread(self._write, key, value)
+        # 同じディレクトリを共有する他のプロセスやインスタンスが書いたファイルは、
+        # このインスタンスが起動時に調べた一覧にないので、ここで追加する
+        self._size += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict()
+        return value
+
+    def _finish(self, key: str, task: asyncio.Task[Any]) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 待っている呼び出しがすべてキャンセルされていても「例外が取得されなかった」警告が出ないようにする
+        if not task.cancelled():
+            task.exception()
+
+    def cached(self, func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        """
+        同じ引数で呼ばれたときに結果を再利用する非同期関数にするデコレータ。
+        `@function_tool`の内側に付けて使います。`RunContextWrapper`の引数はキーに含めません。
+
+        ```python
+        @function_tool
+        @cache.cached
+        async def fetch_docs(package: str) -> str: ...
+        ```
+        """
+        if not inspect.iscoroutinefunction(func):
+            raise TypeError(f"{func.__qualname__} must be an async function")
+
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            key = make_key(
+                func.__module__,
+                func.__qualname__,
+                [arg for arg in args if not isinstance(arg, RunContextWrapper)],
+                kwargs,
+            )
+            return await self.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+
+def cached_agent_tool(
+    agent: Agent[Any],
+    cache: ResponseCache,
+    tool_name: str,
+    tool_description: str,
+    max_turns: int = 10,
+    run_config: RunConfig | None = None,
+) -> FunctionTool:
+    """
+    `agent.as_tool`と同じようにエージェントをツールにします。
+    エージェントの指示・モデル・正規化した入力が同じ呼び出しは、エージェントを実行せずにキャッシュから返します。
+    サブエージェントには呼び出し元のコンテキストを渡し、`run_config`を指定しない場合は呼び出し元の実行設定（モデルのプロバイダなど）を引き継ぎます。
+    """
+    instructions = (
+        agent.instructions if isinstance(agent.instructions, str) else agent.name
+    )
+
+    async def run_agent(wrapper: RunContextWrapper[Any], input: str) -> str:
+        result = await Runner.run(
+            agent,
+            input=input,
+            context=wrapper.context,
+            max_turns=max_turns,
+            # 古いバージョンのSDKでは、ツールのコンテキストが実行設定を持たない
+            run_config=run_config or getattr(wrapper, "run_config", None),
+        )
+        return ItemHelpers.text_message_outputs(result.new_items)
+
+    @function_tool(name_override=tool_name, description_override=tool_description)
+    async def tool(wrapper: RunContextWrapper[Any], input: str) -> str:
+        key = make_key(instructions, str(agent.model), normalize_text(input))
+        output = await cache.get_or_compute(key, lambda: run_agent(wrapper, input))
+        logger.debug(f"{tool_name} cache: {cache.metrics.summary()}")
+        return output
+
+    return tool
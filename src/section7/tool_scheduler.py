@@ -0,0 +1,244 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import statistics
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+from typing import Any, Literal
+from weakref import WeakKeyDictionary
+
+from agents import FunctionTool, RunContextWrapper, function_tool
+from loguru import logger
+from pydantic import BaseModel
+
+from src.section7.sandbox import SandboxContext
+
+# read: 同じパスへの読み込み同士は並行に実行する
+# write: 同じパスへの読み書きとは直列に実行する
+# exclusive: 同じサンドボックスの他のツールとは一切並行に実行しない（任意のファイルを変更しうるコマンドなど）
+# none: ロックを取らない
+Access = Literal["read", "write", "exclusive", "none"]
+
+
+class ReadWriteLock:
+    """
+    読み込み同士は並行に、書き込みは単独で実行するための非同期ロック。
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: not self._writer and self._readers == 0
+            )
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+    def lock(self, write: bool):
+        return self.write() if write else self.read()
+
+
+class LockTable:
+    """
+    キーごとの`ReadWriteLock`を、使われている間だけ保持するテーブル。
+    長時間動くプロセスで、触ったパスの数だけロックが溜まり続けないように、最後の利用者が抜けたら削除します。
+    ロックはイベントループごとに分けるので、同じプロセスで`asyncio.run`を繰り返しても使えます。
+    """
+
+    def __init__(self):
+        # (イベントループ, キー) -> (ロック, 利用者の数)
+        self._entries: dict[
+            tuple[asyncio.AbstractEventLoop, Any], tuple[ReadWriteLock, int]
+        ] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: Any, write: bool) -> AsyncIterator[None]:
+        key = (asyncio.get_running_loop(), key)
+        lock, users = self._entries.get(key) or (ReadWriteLock(), 0)
+        self._entries[key] = (lock, users + 1)
+        try:
+            async with lock.lock(write):
+                yield
+        finally:
+            lock, users = self._entries[key]
+            if users == 1:
+                del self._entries[key]
+            else:
+                self._entries[key] = (lock, users - 1)
+
+
+class ToolLatency(BaseModel):
+    # ロックや同時実行数の上限で待たされた時間と、実際に実行していた時間（秒）
+    waits: list[float] = []
+    runs: list[float] = []
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.runs)} calls, "
+            f"wait p50: {statistics.median(self.waits) * 1000:.1f}ms, "
+            f"run p50: {statistics.median(self.runs) * 1000:.1f}ms, "
+            f"run max: {max(self.runs) * 1000:.1f}ms"
+        )
+
+
+class ToolScheduler:
+    """
+    1ターンに複数のツール呼び出しがあったときに、それらを安全に並行実行するためのスケジューラ。
+    Agents SDKは同じターンのツール呼び出しを並行に起動するので、このクラスでは衝突するものだけを待たせます。
+
+    - ツールごとに同時実行数の上限を設けます
+    - サンドボックス内の同じパスへの読み込みは並行に、書き込みは直列に実行します
+    - 同期関数のツールは上限付きのスレッドプールで実行します
+    - 呼び出しごとの待ち時間と実行時間を記録します
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tool"
+        )
+        # ツール名 -> 同時実行数の上限
+        self._limits: dict[str, int] = {}
+        # セマフォは最初に待ったイベントループに結び付くので、イベントループごとに作る
+        self._semaphores: WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]
+        ] = WeakKeyDictionary()
+        self._sandbox_locks = LockTable()
+        self._path_locks = LockTable()
+        self.latencies: defaultdict[str, ToolLatency] = defaultdict(ToolLatency)
+
+    def tool(
+        self,
+        access: Access = "none",
+        path_arg: str = "path",
+        max_concurrency: int | None = None,
+    ) -> Callable[[Callable[..., Any]], FunctionTool]:
+        """
+        `@function_tool`の代わりに使うデコレータ。
+
+        Args:
+            access (Access): サンドボックスへのアクセスの種類
+            path_arg (str): アクセスするパスを表す引数の名前（サンドボックスからの相対パス）
+            max_concurrency (int | None): このツールの同時実行数の上限。Noneの場合は上限なし
+        """
+
+        def decorator(func: Callable[..., Any]) -> FunctionTool:
+            name = func.__name__
+            if max_concurrency is not None:
+                self._limits[name] = max_concurrency
+            signature = inspect.signature(func)
+            is_async = inspect.iscoroutinefunction(func)
+
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                async with self._acquire(
+                    name, access, signature, path_arg, args, kwargs
+                ):
+                    acquired = time.perf_counter()
+                    if is_async:
+                        result = await func(*args, **kwargs)
+                    else:
+                        context = contextvars.copy_context()
+                        result = await asyncio.get_running_loop().run_in_executor(
+                            self._executor,
+                            functools.partial(context.run, func, *args, **kwargs),
+                        )
+                end = time.perf_counter()
+                latency = self.latencies[name]
+                latency.waits.append(acquired - start)
+                latency.runs.append(end - acquired)
+                logger.debug(
+                    f"{name} waited {(acquired - start) * 1000:.1f}ms, "
+                    f"ran {(end - acquired) * 1000:.1f}ms"
+                )
+                return result
+
+            return function_tool(wrapper)
+
+        return decorator
+
+    @asynccontextmanager
+    async def _acquire(
+        self,
+        name: str,
+        access: Access,
+        signature: inspect.Signature,
+        path_arg: str,
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+    ) -> AsyncIterator[None]:
+        async with AsyncExitStack() as stack:
+            semaphore = self._semaphore(name)
+            if semaphore is not None:
+                await stack.enter_async_context(semaphore)
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            wrapper = next(
+                (arg for arg in args if isinstance(arg, RunContextWrapper)), None
+            )
+            if access != "none" and wrapper is not None:
+                context: SandboxContext = wrapper.context
+                await stack.enter_async_context(
+                    self._sandbox_locks.lock(
+                        context.sandbox, write=access == "exclusive"
+                    )
+                )
+                path = self._resolve(context, bound.get(path_arg))
+                if access in ("read", "write") and path is not None:
+                    await stack.enter_async_context(
+                        self._path_locks.lock(path, write=access == "write")
+                    )
+            yield
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore | None:
+        limit = self._limits.get(name)
+        if limit is None:
+            return None
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if name not in semaphores:
+            semaphores[name] = asyncio.Semaphore(limit)
+        return semaphores[name]
+
+    @staticmethod
+    def _resolve(context: SandboxContext, path: Any) -> Path | None:
+        if not isinstance(path, str):
+            return None
+        try:
+            return context.resolve(path)
+        except RuntimeError:
+            # サンドボックスの外を指すパスはツール自身がエラーを返すので、ロックは不要
+            return None
+
+    def summary(self) -> str:
+        return "\n".join(
+            f"{name}: {latency.summary()}" for name, latency in self.latencies.items()
+        )
+
+
+tool_scheduler = ToolScheduler()
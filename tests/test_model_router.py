@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any
+
+import pytest
+from agents import ModelSettings
+from agents.models.interface import ModelTracing
+
+from src.section7.model_router import ModelRouter, RoutingPolicy
+from src.section7.offline_model import (
+    FaultyModel,
+    MockModelProvider,
+    ScriptedModel,
+    ScriptStep,
+)
+
+ARGS = (None, "質問", ModelSettings(), [], None, [], ModelTracing.DISABLED)
+
+
+def answering(text: str, latency: float = 0.0, errors: list[Exception] | None = None):
+    return FaultyModel(
+        ScriptedModel([ScriptStep(message=text)]), latency=latency, errors=errors
+    )
+
+
+def make_router(models: dict[str, Any], **policy: Any) -> ModelRouter:
+    routes = {"main": list(models)}
+    return ModelRouter(
+        RoutingPolicy(routes=routes, final_route=None, **policy),
+        MockModelProvider(models),
+    )
+
+
+def text(response: Any) -> str:
+    return response.output[0].content[0].text
+
+
+def test_falls_back_in_route_order():
+    router = make_router(
+        {
+            "first": answering("first", errors=[TimeoutError()]),
+            "second": answering("second", errors=[TimeoutError()]),
+            "third": answering("third"),
+        },
+        hedge_after=None,
+    )
+    response = asyncio.run(router.get_model("main").get_response(*ARGS))
+    assert text(response) == "third"
+    assert [router.stats[("main", name)].errors for name in ("first", "second")] == [
+        1,
+        1,
+    ]
+    assert router.stats[("main", "third")].calls == 1
+
+
+def test_raises_last_error_when_all_models_fail():
+    router = make_router(
+        {
+            "first": answering("first", errors=[TimeoutError("first")]),
+            "second": answering("second", errors=[TimeoutError("second")]),
+        },
+        hedge_after=None,
+    )
+    with pytest.raises(TimeoutError, match="second"):
+        asyncio.run(router.get_model("main").get_response(*ARGS))
+
+
+def test_does_not_fall_back_on_other_errors():
+    router = make_router(
+        {
+            "first": answering("first", errors=[ValueError("bad request")]),
+            "second": answering("second"),
+        },
+        hedge_after=None,
+    )
+    with pytest.raises(ValueError):
+        asyncio.run(router.get_model("main").get_response(*ARGS))
+    assert router.stats[("main", "second")].calls == 0
+
+
+def test_hedges_after_delay_and_records_loser_usage():
+    router = make_router(
+        {"slow": answering("slow", latency=0.5), "fast": answering("fast")},
+        hedge_after=0.1,
+    )
+
+    async def run() -> tuple[Any, float]:
+        start = time.perf_counter()
+        response = await router.get_model("main").get_response(*ARGS)
+        elapsed = time.perf_counter() - start
+        await router.join()
+        return response, elapsed
+
+    response, elapsed = asyncio.run(run())
+    assert text(response) == "fast"
+    assert 0.1 <= elapsed < 0.4
+    slow = router.stats[("main", "slow")]
+    assert slow.lost == 1
+    assert slow.cancelled == 0
+    # 負けた呼び出しも最後まで実行され、レイテンシが記録される
+    assert slow.latencies and slow.latencies[0] >= 0.5
+
+
+def test_does_not_hedge_fast_responses():
+    router = make_router(
+        {"first": answering("first", latency=0.05), "second": answering("second")},
+        hedge_after=0.2,
+    )
+    response = asyncio.run(router.get_model("main").get_response(*ARGS))
+    assert text(response) == "first"
+    assert router.stats[("main", "second")].calls == 0
+
+
+class FailingStream:
+    """
+    最初のイベントの前に失敗し、閉じられたかどうかを記録するストリーム。
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self) -> "FailingStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        raise TimeoutError()
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+class FailingStreamModel(ScriptedModel):
+    def __init__(self):
+        super().__init__([])
+        self.stream = FailingStream()
+
+    def stream_response(self, *args: Any, **kwargs: Any) -> Any:
+        return self.stream
+
+
+def test_stream_falls_back_and_closes_failed_stream():
+    failing = FailingStreamModel()
+    router = make_router({"first": failing, "second": answering("second")})
+
+    async def run() -> list[Any]:
+        model = router.get_model("main")
+        return [event async for event in model.stream_response(*ARGS)]
+
+    events = asyncio.run(run())
+    assert failing.stream.closed
+    assert events[-1].type == "response.completed"
+    assert router.stats[("main", "first")].errors == 1
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any
+
+import openai
+from agents import Agent, ModelSettings, RunConfig, Runner
+from agents.models.interface import ModelTracing
+from agents.models.openai_provider import OpenAIProvider
+
+from src.section7.mock_openai_server import MockOpenAIServer
+from src.section7.offline_model import ScriptedModel, ScriptStep
+from src.section7.rate_limiter import (
+    RateLimit,
+    RequestScheduler,
+    ScheduledModel,
+    ScheduledModelProvider,
+)
+
+
+def run_agents(
+    server_limit: RateLimit, scheduler: RequestScheduler, count: int
+) -> tuple[MockOpenAIServer, float]:
+    async def run() -> tuple[MockOpenAIServer, float]:
+        async with MockOpenAIServer(default_limit=server_limit, latency=0.01) as server:
+            client = openai.AsyncOpenAI(
+                base_url=server.base_url, api_key="mock", max_retries=0
+            )
+            provider = ScheduledModelProvider(
+                "batch", OpenAIProvider(openai_client=client), scheduler
+            )
+            agent = Agent(name="Assistant", instructions="...", model="gpt-4.1")
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    Runner.run(
+                        agent,
+                        f"質問{i}",
+                        run_config=RunConfig(
+                            model_provider=provider, tracing_disabled=True
+                        ),
+                    )
+                    for i in range(count)
+                )
+            )
+            return server, time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def test_pauses_and_retries_after_429():
+    # スケジューラはサーバーの制限を知らないので、最初の送り出しで429を受ける
+    server_limit = RateLimit(requests=3, tokens=1_000_000, period=1.0)
+    scheduler = RequestScheduler(
+        {"gpt-4.1": RateLimit(requests=100, tokens=1_000_000, period=1.0)},
+        base_delay=0.05,
+    )
+    server, elapsed = run_agents(server_limit, scheduler, 6)
+    stats = scheduler.stats[("gpt-4.1", "batch")]
+    assert server.stats.served == 6
+    assert stats.rate_limited == server.stats.rejected > 0
+    # 429を受けたら、サーバーの窓が空くまでそのモデルへの送り出しを止めてからリトライする
+    assert elapsed >= server_limit.period * 0.9
+    # 止めている間は送り出さないので、拒否されるのは最初に一斉に送った分だけ
+    assert server.stats.rejected <= 6 - server_limit.requests
+
+
+def test_paces_requests_without_429():
+    # トークンバケットは3件まで一度に、その後は1秒に3件のペースで送り出す
+    limit = RateLimit(requests=3, tokens=1_000_000, period=1.0)
+    scheduler = RequestScheduler({"gpt-4.1": limit}, base_delay=0.05)
+    server_limit = RateLimit(requests=6, tokens=1_000_000, period=1.0)
+    server, elapsed = run_agents(server_limit, scheduler, 6)
+    assert server.stats.served == 6
+    assert server.stats.rejected == 0
+    assert scheduler.stats[("gpt-4.1", "batch")].rate_limited == 0
+    # 残りの3件はバケットが補充されるのを待つ
+    assert elapsed >= 0.9
+
+
+def connection_error() -> openai.APIConnectionError:
+    # リクエストのオブジェクトを用意せずに、リトライの対象になる例外を作る
+    return openai.APIConnectionError.__new__(openai.APIConnectionError)
+
+
+def test_failed_attempt_returns_reserved_tokens():
+    # 1回分のトークンしか残らない上限。失敗した試行の分を返さないと、リトライは数十秒待たされる
+    limit = RateLimit(requests=100, tokens=1_000, period=100.0)
+    scheduler = RequestScheduler({"gpt-4.1": limit}, base_delay=0.01)
+    attempts = 0
+
+    async def func() -> str:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise connection_error()
+        return "OK"
+
+    async def run() -> str:
+        return await asyncio.wait_for(
+            scheduler.call("gpt-4.1", 800, "batch", func, lambda _: 800), timeout=2.0
+        )
+
+    assert asyncio.run(run()) == "OK"
+    assert attempts == 2
+
+
+class FailingStream:
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self) -> "FailingStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        raise connection_error()
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+class FlakyStreamModel(ScriptedModel):
+    """
+    最初のストリームだけ、最初のイベントの前に失敗するモデル。
+    """
+
+    def __init__(self):
+        super().__init__([ScriptStep(message="OK")])
+        self.failed = FailingStream()
+
+    def stream_response(self, *args: Any, **kwargs: Any) -> Any:
+        if not self.failed.closed:
+            return self.failed
+        return super().stream_response(*args, **kwargs)
+
+
+def test_stream_retry_closes_failed_stream():
+    scheduler = RequestScheduler({}, base_delay=0.01)
+    model = FlakyStreamModel()
+    scheduled = ScheduledModel(model, "gpt-4.1", "batch", scheduler)
+
+    async def run() -> list[Any]:
+        return [
+            event
+            async for event in scheduled.stream_response(
+                None, "質問", ModelSettings(), [], None, [], ModelTracing.DISABLED
+            )
+        ]
+
+    events = asyncio.run(run())
+    assert model.failed.closed
+    assert events[-1].type == "response.completed"
+    assert scheduler.stats[("gpt-4.1", "batch")].retries == 1
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+from src.section7.sandbox_snapshot import SnapshotStore, SnapshotTracker
+
+
+def make_sandbox(root: Path) -> SnapshotTracker:
+    sandbox = root / "sandbox"
+    (sandbox / ".venv" / "lib").mkdir(parents=True)
+    (sandbox / ".venv" / "lib" / "mod.py").write_text("x = 1\n")
+    (sandbox / "main.py").write_text("print('hello')\n")
+    return SnapshotTracker(sandbox, SnapshotStore(root / "store"))
+
+
+def test_restore_reverts_changes(tmp_path: Path):
+    tracker = make_sandbox(tmp_path)
+    snapshot = tracker.snapshot("initial")
+    (tracker.sandbox / "main.py").write_text("print('changed')\n")
+    (tracker.sandbox / "new.py").write_text("")
+    tracker.invalidate()
+    changed = tracker.restore(snapshot.id)
+    assert sorted(changed) == ["main.py", "new.py"]
+    assert (tracker.sandbox / "main.py").read_text() == "print('hello')\n"
+    assert not (tracker.sandbox / "new.py").exists()
+
+
+def test_in_place_venv_edit_does_not_leak_into_fork_or_snapshot(tmp_path: Path):
+    tracker = make_sandbox(tmp_path)
+    snapshot = tracker.snapshot("initial")
+    fork = tracker.fork(snapshot.id, tmp_path / "fork")
+    # site-packagesのファイルをその場で書き換える（inodeは変わらない）
+    with open(tracker.sandbox / ".venv" / "lib" / "mod.py", "a") as f:
+        f.write("y = 2\n")
+    assert (fork.sandbox / ".venv" / "lib" / "mod.py").read_text() == "x = 1\n"
+    tracker.invalidate()
+    tracker.restore(snapshot.id)
+    assert (tracker.sandbox / ".venv" / "lib" / "mod.py").read_text() == "x = 1\n"